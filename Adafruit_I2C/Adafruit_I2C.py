@@ -1,7 +1,72 @@
 #!/usr/bin/python
 import re
-import smbus
 import logging
+import threading
+import time
+try:
+  import smbus
+except ImportError: # off the Pi the bus is given a handle (see sim/i2c.py)
+  smbus = None
+
+# ===========================================================================
+# I2C bus manager
+# ===========================================================================
+
+class I2CError(IOError):
+  "Raised when an I2C transaction still fails after its retries"
+  pass
+
+class I2CBus(object):
+  """One SMBus handle shared by every device on a bus. The kernel driver
+  keeps the slave address per file descriptor, so transactions from several
+  threads are serialised with a lock. A failed transaction is retried up to
+  retries times, waiting backoff, 2 * backoff, 4 * backoff... seconds (outside
+  the lock) between attempts, and then raises I2CError. handle is any object
+  with the smbus.SMBus methods (default: the kernel bus busnum)."""
+
+  def __init__(self, busnum, retries=3, backoff=0.005, handle=None):
+    self.busnum = busnum
+    self.handle = handle if handle is not None else smbus.SMBus(busnum)
+    self.lock = threading.Lock()
+    self.retries = retries
+    self.backoff = backoff
+    self.transactions = 0
+    self.errors = 0
+    self.failures = 0
+
+  def transfer(self, address, name, *args):
+    "Runs the SMBus call name (e.g. read_word_data) for the device at address"
+    for attempt in range(self.retries + 1):
+      with self.lock:
+        self.transactions += 1
+        try:
+          return getattr(self.handle, name)(address, *args)
+        except IOError, err:
+          self.errors += 1
+          error = err
+      if attempt < self.retries:
+        time.sleep(self.backoff * 2 ** attempt)
+    self.failures += 1
+    raise I2CError(error.errno, "I2C device 0x%02X on bus %d: %s failed %d times (%s)" %
+                   (address, self.busnum, name, self.retries + 1, error.strerror or error))
+
+  def report(self):
+    "One line summary of the bus, meant for mission_info.log"
+    return "I2C bus %d: %d transactions, %d errors, %d failures after retries" % (
+           self.busnum, self.transactions, self.errors, self.failures)
+
+_buses = {}
+_buses_lock = threading.Lock()
+_pi_revision = None
+
+def getBus(busnum=-1):
+  "Returns the shared manager of a bus (the default one if busnum is negative), opening it once"
+  if busnum < 0:
+    busnum = Adafruit_I2C.getPiI2CBusNumber()
+  with _buses_lock:
+    if busnum not in _buses:
+      _buses[busnum] = I2CBus(busnum)
+    return _buses[busnum]
 
 # ===========================================================================
 # Adafruit_I2C Class
@@ -11,7 +76,14 @@ class Adafruit_I2C(object):
 
   @staticmethod
   def getPiRevision():
-    "Gets the version number of the Raspberry Pi board"
+    "Gets the version number of the Raspberry Pi board. /proc/cpuinfo is only parsed once"
+    global _pi_revision
+    if _pi_revision is None:
+      _pi_revision = Adafruit_I2C._readPiRevision()
+    return _pi_revision
+
+  @staticmethod
+  def _readPiRevision():
     # Revision list available at: http://elinux.org/RPi_HardwareHistory#Board_Revision_History
     try:
       with open('/proc/cpuinfo', 'r') as infile:
@@ -35,13 +107,15 @@ class Adafruit_I2C(object):
     # Gets the I2C bus number /dev/i2c#
     return 1 if Adafruit_I2C.getPiRevision() > 1 else 0
 
-  def __init__(self, address, busnum=-1, debug=False):
+  def __init__(self, address, busnum=-1, debug=False, bus=None):
     self.address = address
     # By default, the correct I2C bus is auto-detected using /proc/cpuinfo
     # Alternatively, you can hard-code the bus version below:
-    # self.bus = smbus.SMBus(0); # Force I2C0 (early 256MB Pi's)
-    # self.bus = smbus.SMBus(1); # Force I2C1 (512MB Pi's)
-    self.bus = smbus.SMBus(busnum if busnum >= 0 else Adafruit_I2C.getPiI2CBusNumber())
+    # self.bus = getBus(0); # Force I2C0 (early 256MB Pi's)
+    # self.bus = getBus(1); # Force I2C1 (512MB Pi's)
+    # All the devices of a bus share its handle (see I2CBus). An I2CBus can
+    # also be given directly, e.g. one over a simulated handle
+    self.bus = bus if bus is not None else getBus(busnum)
     self.debug = debug
     self.logger = logging.getLogger('Adafruit_I2C.Device.Bus.{0}.Address.{1:#0X}' \
       .format(busnum, address))
@@ -56,88 +130,72 @@ class Adafruit_I2C(object):
       data >>= 8
     return val
 
-  def errMsg(self):
-    print "Error accessing 0x%02X: Check your I2C address" % self.address
-    return -1
+  # Errors are raised as I2CError (an IOError) once the bus gave up retrying
 
   def write8(self, reg, value):
     "Writes an 8-bit value to the specified register/address"
-    try:
-      self.bus.write_byte_data(self.address, reg, value)
-      if self.debug:
-        print "I2C: Wrote 0x%02X to register 0x%02X" % (value, reg)
-    except IOError, err:
-      return self.errMsg()
+    self.bus.transfer(self.address, "write_byte_data", reg, value)
+    if self.debug:
+      print "I2C: Wrote 0x%02X to register 0x%02X" % (value, reg)
 
   def write16(self, reg, value):
     "Writes a 16-bit value to the specified register/address pair"
-    try:
-      self.bus.write_word_data(self.address, reg, value)
-      if self.debug:
-        print ("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
-         (value, reg, reg+1))
-    except IOError, err:
-      return self.errMsg()
+    self.bus.transfer(self.address, "write_word_data", reg, value)
+    if self.debug:
+      print ("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
+       (value, reg, reg+1))
 
   def writeRaw8(self, value):
     "Writes an 8-bit value on the bus"
-    try:
-      self.bus.write_byte(self.address, value)
-      if self.debug:
-        print "I2C: Wrote 0x%02X" % value
-    except IOError, err:
-      return self.errMsg()
+    self.bus.transfer(self.address, "write_byte", value)
+    if self.debug:
+      print "I2C: Wrote 0x%02X" % value
 
   def writeList(self, reg, list):
     "Writes an array of bytes using I2C format"
-    try:
-      if self.debug:
-        print "I2C: Writing list to register 0x%02X:" % reg
-        print list
-      self.bus.write_i2c_block_data(self.address, reg, list)
-    except IOError, err:
-      return self.errMsg()
+    if self.debug:
+      print "I2C: Writing list to register 0x%02X:" % reg
+      print list
+    self.bus.transfer(self.address, "write_i2c_block_data", reg, list)
 
   def readList(self, reg, length):
-    "Read a list of bytes from the I2C device"
-    try:
-      results = self.bus.read_i2c_block_data(self.address, reg, length)
-      if self.debug:
-        print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
-         (self.address, reg))
-        print results
-      return results
-    except IOError, err:
-      return self.errMsg()
+    "Read a list of bytes from the I2C device in a single transaction"
+    results = self.bus.transfer(self.address, "read_i2c_block_data", reg, length)
+    if self.debug:
+      print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
+       (self.address, reg))
+      print results
+    return results
+
+  def readBlockU16BE(self, reg, count):
+    """Reads count consecutive big endian 16-bit registers starting at reg in
+    a single transaction. Only for devices that auto-increment their register
+    pointer."""
+    data = self.readList(reg, 2 * count)
+    return [(data[i] << 8) | data[i + 1] for i in range(0, 2 * count, 2)]
 
   def readU8(self, reg):
     "Read an unsigned byte from the I2C device"
-    try:
-      result = self.bus.read_byte_data(self.address, reg)
-      if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
-         (self.address, result & 0xFF, reg))
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.bus.transfer(self.address, "read_byte_data", reg)
+    if self.debug:
+      print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
+       (self.address, result & 0xFF, reg))
+    return result
 
   def readS8(self, reg):
     "Reads a signed byte from the I2C device"
-    try:
-      result = self.bus.read_byte_data(self.address, reg)
-      if result > 127: result -= 256
-      if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
-         (self.address, result & 0xFF, reg))
-      return result
-    except IOError, err:
-      return self.errMsg()
+    result = self.bus.transfer(self.address, "read_byte_data", reg)
+    if result > 127: result -= 256
+    if self.debug:
+      print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
+       (self.address, result & 0xFF, reg))
+    return result
 
   def readU16(self, register, little_endian=True):
     """Read an unsigned 16-bit value from the specified register, with the
     specified endianness (default little endian, or least significant byte
     first)."""
-    result = self.bus.read_word_data(self.address,register) & 0xFFFF
+    result = self.bus.transfer(self.address, "read_word_data", register) & 0xFFFF
     self.logger.debug("Read 0x%04X from register pair 0x%02X, 0x%02X",result, register, register+1)
     # Swap bytes if using big endian because read_word_data assumes little
     # endian on ARM (little endian) systems.
@@ -55,28 +55,37 @@ class MCP9808(object):
 	def __init__(self, address=MCP9808_I2CADDR_DEFAULT, i2c=None, **kwargs):
 		"""Initialize MCP9808 device on the specified I2C address and bus number.
 		Address defaults to 0x18 and bus number defaults to the appropriate bus
-		for the hardware.
+		for the hardware. Sensors on the same bus share its handle, so they can
+		be read from several threads.
 		"""
 		self._logger = logging.getLogger('Adafruit_MCP9808.MCP9808')
 		if i2c is None:
 			import Adafruit_I2C.Adafruit_I2C as I2C
 			i2c = I2C
-		self._device = i2c.Adafruit_I2C(address)
+		self._device = i2c.Adafruit_I2C(address, **kwargs)
+		self._identified = None
 
 
 	def begin(self):
 		"""Start taking temperature measurements. Returns True if the device is
-		intialized, False otherwise.
+		intialized, False otherwise. The IDs are only read the first time. Raises
+		IOError if the device does not answer.
 		"""
-		# Check manufacturer and device ID match expected values.
+		if self._identified is not None:
+			return self._identified
+		# Check manufacturer and device ID match expected values. The MCP9808
+		# does not auto-increment its register pointer, so each ID is its own
+		# transaction.
 		mid = self._device.readU16BE(MCP9808_REG_MANUF_ID)
 		did = self._device.readU16BE(MCP9808_REG_DEVICE_ID)
 		self._logger.debug('Read manufacturer ID: {0:04X}'.format(mid))
 		self._logger.debug('Read device ID: {0:04X}'.format(did))
-		return mid == 0x0054 and did == 0x0400
+		self._identified = mid == 0x0054 and did == 0x0400
+		return self._identified
 
 	def readTempC(self):
-		"""Read sensor and return its value in degrees celsius."""
+		"""Read sensor and return its value in degrees celsius. One bus
+		transaction; raises IOError if it keeps failing."""
 		# Read temperature register value.
 		t = self._device.readU16BE(MCP9808_REG_AMBIENT_TEMP)
 		self._logger.debug('Raw ambient temp register value: 0x{0:04X}'.format(t & 0xFFFF))
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# Benchmark of the capture hot path on the simulated hardware of sim/ (camera,
+# GPIO, I2C bus with an MCP9808), on the real clock. Each case runs the
+# unmodified GliderCamera loop in its own process for a number of frames
+# (master) or trigger cycles (slave) and measures frames per second, the
+# time of every capture() call, the trigger to exposure latency (slave), CPU
+# use and peak resident memory. Results are compared with the stored
+# baselines; a metric worse than its baseline by more than --tolerance is
+# reported as a regression and makes the run exit with status 1. Baselines
+# depend on the machine: store them again (--save) when it changes.
+#
+#   python benchmark.py                          # every case, compared with the baselines
+#   python benchmark.py --cases master-pipeline slave-edge --frames 300
+#   python benchmark.py --save                   # stores the results as the new baselines
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+import yaml
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baselines.json")
+
+# name: (config.yaml, camera_config.yaml) settings of the case
+CASES = [
+  ("master-files", {"mode": "master"}, {}),
+  ("master-pipeline", {"mode": "master"}, {"pipeline_writer": True}),
+  ("master-segments", {"mode": "master"}, {"pipeline_writer": True, "storage_backend": "segments"}),
+  ("master-split", {"mode": "master"}, {"process_split": True}),
+  ("slave-edge", {"mode": "slave", "slave_trigger": "edge"}, {"pipeline_writer": True}),
+  ("slave-burst", {"mode": "slave", "slave_trigger": "edge", "burst_mode": True}, {"pipeline_writer": True}),
+]
+# Settings of every case: nothing waits on purpose and nothing depends on the free space of the machine
+MISSION = {"config_reload": False, "schedule_report_frames": 0, "missed_frame_policy": "skip"}
+CAMERA = {"memory_threshold": 0, "adaptive_policy": False, "resume_mission": False, "sensor_log": False,
+          "dedup": False, "exposure_predictor": False, "camera_idle_timeout": -1, "camera_warmup": 0,
+          "led_delay_on": 0, "led_delay_off": 0}
+
+# metric: True if higher is better
+METRICS = [("fps", True), ("latency_p50", False), ("latency_p95", False), ("trigger_p95", False),
+           ("cpu", False), ("rss", False)]
+SETTINGS = ["frames", "cycles", "capture_time", "frame_kb", "period", "trigger_period"]
+
+def percentile(values, p):
+  if not values:
+    return None
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def writeConfig(source, filename, settings):
+  with open(source) as f:
+    config = yaml.safe_load(f)
+  config.update(settings)
+  with open(filename, "w") as f:
+    yaml.safe_dump(config, f, default_flow_style=False)
+
+def runCase(name, args):
+  """ Runs one case in this process and returns its metrics """
+  from camera import GliderCamera
+  from clock import SystemClock
+  from Adafruit_I2C.Adafruit_I2C import I2CBus
+  from sim.camera import SimulatedCamera
+  from sim.gpio import SimulatedGPIO
+  from sim.i2c import SimulatedSMBus, MCP9808Registers
+  from sim.sensor import SimulatedMCP9808
+
+  class Stop(Exception):
+    pass
+
+  class BenchCamera(GliderCamera):
+    """ GliderCamera timing every capture and stopping after a number of frames or trigger cycles """
+
+    def capture(self):
+      start = self.clock.monotonic()
+      GliderCamera.capture(self)
+      latencies.append(self.clock.monotonic() - start)
+      if self.mode == "master" and len(latencies) >= args.frames:
+        raise Stop()
+
+    def captureBurst(self, count):
+      start = self.clock.monotonic()
+      GliderCamera.captureBurst(self, count)
+      latencies.append((self.clock.monotonic() - start) / count)
+
+    def captureCycle(self, trigger_time=None, count=None):
+      GliderCamera.captureCycle(self, trigger_time, count)
+      cycles.append(trigger_time)
+      if len(cycles) >= args.cycles:
+        raise Stop()
+
+    def startTrigger(self):
+      trigger = GliderCamera.startTrigger(self)
+      pulser.start()
+      return trigger
+
+    def shutdown(self):
+      pass
+
+  mission, camera = dict(MISSION), dict(CAMERA)
+  for case, mission_settings, camera_settings in CASES:
+    if case == name:
+      mission.update(mission_settings)
+      camera.update(camera_settings)
+  now = datetime.now()
+  mission.update({"mission_name": "benchmark", "period": args.period,
+                  "start_date": (now - timedelta(days=1)).strftime("%d/%m/%Y %H:%M"),
+                  "end_date": (now + timedelta(days=1)).strftime("%d/%m/%Y %H:%M")})
+  here = os.path.dirname(os.path.abspath(__file__))
+  workdir = tempfile.mkdtemp(prefix="benchmark-")
+  os.chdir(workdir)
+  writeConfig(os.path.join(here, "config.yaml"), "config.yaml", mission)
+  writeConfig(os.path.join(here, "camera_config.yaml"), "camera_config.yaml", camera)
+
+  clock = SystemClock()
+  gpio = SimulatedGPIO(clock)
+  fake = SimulatedCamera(clock, args.capture_time, args.capture_time, frame_bytes=int(args.frame_kb * 1000),
+                         frame_bytes_sd=int(args.frame_kb * 100), seed=args.seed, write_files=True)
+  smbus = SimulatedSMBus(clock, seed=args.seed)
+  smbus.attach(0x18, MCP9808Registers(SimulatedMCP9808(clock, mean=25.0, swing=0.0, seed=args.seed)))
+  latencies = []
+  cycles = []
+  done = threading.Event()
+  def pulses(pin):
+    while not done.is_set():
+      clock.sleep(args.trigger_period)
+      gpio.pulse(pin, 0.001)
+
+  camera_object = BenchCamera("config.yaml", "camera_config.yaml", gpio=gpio, camera_factory=lambda: fake,
+                              clock=clock, i2c_bus=I2CBus(1, handle=smbus))
+  pulser = threading.Thread(target=pulses, args=(camera_object.signal_input,), name="Pulser")
+  pulser.daemon = True
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+  children = resource.getrusage(resource.RUSAGE_CHILDREN)
+  start = clock.monotonic()
+  try:
+    camera_object.run()
+  except Stop:
+    sys.exc_clear() # the traceback would keep the camera alive
+  done.set()
+  # what the destructor would do, within the measured time: queued frames count once written
+  for component in ("writer", "housekeeper", "segments"):
+    if getattr(camera_object, component) is not None:
+      getattr(camera_object, component).close()
+      setattr(camera_object, component, None)
+  elapsed = clock.monotonic() - start
+  end_usage = resource.getrusage(resource.RUSAGE_SELF)
+  end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+  cpu = (end_usage.ru_utime + end_usage.ru_stime - usage.ru_utime - usage.ru_stime +
+         end_children.ru_utime + end_children.ru_stime - children.ru_utime - children.ru_stime)
+  frames = camera_object.storage.frames
+  triggers = list(camera_object.trigger.latencies) if camera_object.trigger is not None else []
+  camera_object.temp_sampler.stop()
+  del camera_object # the destructor writes its last files in the mission directory
+  os.chdir(here)
+  shutil.rmtree(workdir)
+  return {
+    "frames": frames,
+    "fps": frames / elapsed,
+    "latency_p50": percentile(latencies, 50),
+    "latency_p95": percentile(latencies, 95),
+    "latency_max": max(latencies) if latencies else None,
+    "trigger_p50": percentile(triggers, 50),
+    "trigger_p95": percentile(triggers, 95),
+    "cpu": 100.0 * cpu / elapsed,
+    "rss": max(end_usage.ru_maxrss, end_children.ru_maxrss) / 1024.0, # MB (ru_maxrss is in KB on Linux)
+  }
+
+def ms(value):
+  return "%8.2f" % (value * 1000) if value is not None else "       -"
+
+def printResults(results):
+  print "%-16s %6s %7s %8s %8s %8s %8s %8s %6s %7s" % ("case", "frames", "fps", "p50 ms", "p95 ms", "max ms",
+                                                       "trig p50", "trig p95", "cpu %", "rss MB")
+  for name, r in results:
+    print "%-16s %6d %7.1f %s %s %s %s %s %6.1f %7.1f" % (
+          name, r["frames"], r["fps"], ms(r["latency_p50"]), ms(r["latency_p95"]), ms(r["latency_max"]),
+          ms(r["trigger_p50"]), ms(r["trigger_p95"]), r["cpu"], r["rss"])
+
+def compare(results, baselines, tolerance):
+  """ Lines describing the metrics worse than their baseline by more than tolerance (a fraction) """
+  regressions = []
+  for name, r in results:
+    base = baselines["cases"].get(name)
+    if base is None:
+      continue
+    for metric, higher in METRICS:
+      value, reference = r.get(metric), base.get(metric)
+      if value is None or not reference:
+        continue
+      change = (value - reference) / float(reference)
+      if (higher and change < -tolerance) or (not higher and change > tolerance):
+        regressions.append("%s %s: %.4g against %.4g (%+.0f%%)" % (name, metric, value, reference, change * 100))
+  return regressions
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Capture hot path benchmark on simulated hardware")
+  parser.add_argument("--cases", nargs="+", choices=[case[0] for case in CASES], default=[case[0] for case in CASES])
+  parser.add_argument("--frames", type=int, default=200, help="frames of the master cases")
+  parser.add_argument("--cycles", type=int, default=40, help="trigger cycles of the slave cases")
+  parser.add_argument("--capture-time", type=float, default=0.005, help="seconds the fake camera takes per frame")
+  parser.add_argument("--frame-kb", type=float, default=500, help="mean frame size")
+  parser.add_argument("--period", type=float, default=0.001, help="seconds between frames (the camera is the limit)")
+  parser.add_argument("--trigger-period", type=float, default=0.1, help="seconds between slave trigger pulses")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--baselines", default=BASELINES)
+  parser.add_argument("--tolerance", type=float, default=0.4, help="allowed worsening of a metric (fraction)")
+  parser.add_argument("--save", action="store_true", help="stores the results as the new baselines")
+  parser.add_argument("--run", help=argparse.SUPPRESS) # one case, run by the parent in its own process
+  args = parser.parse_args()
+
+  if args.run:
+    # the camera (and its housekeeping process) log to stdout: only the result goes to it
+    out = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    result = runCase(args.run, args)
+    sys.stdout.flush()
+    out.write(json.dumps(result) + "\n")
+    out.close()
+    sys.exit(0)
+
+  settings = dict((name, getattr(args, name)) for name in SETTINGS)
+  results = []
+  for name in args.cases:
+    command = [sys.executable, os.path.abspath(__file__), "--run", name]
+    for setting in SETTINGS + ["seed"]:
+      command += ["--" + setting.replace("_", "-"), str(getattr(args, setting))]
+    output = subprocess.check_output(command)
+    results.append((name, json.loads(output.splitlines()[-1])))
+  printResults(results)
+
+  if args.save:
+    baselines = {"host": os.uname()[1], "date": datetime.now().strftime("%Y-%m-%d"), "settings": settings,
+                 "cases": dict(results)}
+    with open(args.baselines, "w") as f:
+      json.dump(baselines, f, indent=2, sort_keys=True, separators=(",", ": "))
+      f.write("\n")
+    print "Baselines saved to %s" % args.baselines
+  elif os.path.exists(args.baselines):
+    with open(args.baselines) as f:
+      baselines = json.load(f)
+    if baselines["settings"] != settings:
+      print "The baselines were taken with other settings (%s), not compared" % baselines["settings"]
+      sys.exit(0)
+    regressions = compare(results, baselines, args.tolerance)
+    for line in regressions:
+      print "Regression: " + line
+    if regressions:
+      sys.exit(1)
+    print "No regression against the baselines of %s (%s)" % (baselines["host"], baselines["date"])
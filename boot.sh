@@ -1,3 +1,3 @@
 #!/bin/bash
 cd /home/pi/glider_camera
-python camera.py > mission_info.log
+python camera.py >> mission_info.log
@@ -1,91 +1,529 @@
 #!/usr/bin/env python
-import yaml
 from datetime import datetime
-import time
-import picamera
+import io
 import os
-import RPi.GPIO as GPIO
 import Adafruit_MCP9808.MCP9808 as MCP9808
+# The Pi specific modules are optional, so the camera logic can also run
+# against simulated hardware (see simulate.py)
+try:
+  import picamera
+except ImportError:
+  picamera = None
+try:
+  import RPi.GPIO as GPIO
+except (ImportError, RuntimeError): # RPi.GPIO raises RuntimeError when it is not on a Pi
+  GPIO = None
+from clock import SystemClock
+from scheduler import CaptureScheduler
+from storage import StorageBudget
+from writer import FrameWriter
+from trigger import EdgeTrigger
+from session import CameraSession
+from sampler import TemperatureSampler
+from frame_index import FrameIndex
+from leds import LedEngine, BlinkPattern
+from instrument import StageTimer, NullTimer
+from policy import AdaptivePolicy
+from dedup import DuplicateFilter
+from exposure import ExposurePredictor
+from state import MissionState, nextSlot
+from segments import SegmentArchive
+from sensors import SensorHub
+from config import MissionConfig, CameraConfig, ConfigWatcher, ConfigError
+from housekeeping import Housekeeper, openIndex, supervise, HOUSEKEEPING_SETTINGS
 
 class GliderCamera:
-  def __init__(self):
-    """ Constructor of GliderCamera class """
+  def __init__(self, config_filename="config.yaml", camera_config_filename="camera_config.yaml",
+               gpio=None, camera_factory=None, temp_sensor=None, clock=None, i2c_bus=None):
+    """ Constructor of GliderCamera class. The hardware (GPIO module, camera factory, temperature
+    sensor, I2C bus of the sensors) and the clock default to the real ones; sim/ has stand-ins for all of them """
     print "[GliderCamera]"
+    self.clock = clock if clock is not None else SystemClock()
+    self.gpio = gpio if gpio is not None else GPIO
+    self.camera_factory = camera_factory if camera_factory is not None else picamera.PiCamera
+    self.temp_sensor = temp_sensor
+    self.i2c_bus = i2c_bus # None: the Pi's I2C bus
     self.mission_name = "test"
-    self.start_date = datetime.now() # datetime.now() returns the current date and time
+    self.start_date = self.clock.now() # returns the current date and time
     self.end_date = self.start_date
     self.period = 10
-    self.readConfig("config.yaml", "camera_config.yaml")
+    self.last_capture = None
+    self.slave_cycles = 0
+    self.in_cycle = False
+    self.cycle_frames = 0
+    self.previous_signal = False
+    self.readConfig(config_filename, camera_config_filename)
     self.startLed()
     self.startSensor()
+    self.startStorage()
+    self.startSensorHub()
+    self.startPolicy()
+    self.startDuplicateFilter()
+    self.startExposure()
+    self.startState()
+    self.startHousekeeping()
+    self.session = CameraSession(self.camera_factory, self.camera_config.camera_idle_timeout,
+                                 self.camera_config.camera_warmup, clock=self.clock)
+    self.startThreads()
+
+  def run(self):
+    """ Runs the mission in the configured mode """
     if self.mode == "master":
       self.captureMaster()
     elif self.mode == "slave":
       self.captureSlave()
 
-
   def __del__(self):
     """ Destructor of GliderCamera class """
+    if getattr(self, "writer", None) is not None:
+      self.writer.close() # flushes the frames still in the queue
+    if getattr(self, "housekeeper", None) is not None:
+      self.housekeeper.close() # lets the housekeeping process write what it has been handed
+    if getattr(self, "state", None) is not None:
+      self.checkpoint(force=True)
+    if getattr(self, "segments", None) is not None:
+      self.segments.close()
+    if getattr(self, "session", None) is not None:
+      self.session.close()
+    if getattr(self, "index", None) is not None:
+      self.index.close()
+    if getattr(self, "sensors", None) is not None:
+      self.sensors.stop()
+    if getattr(self, "leds", None) is not None:
+      self.leds.stop()
+    if getattr(self, "timer", None) is not None:
+      self.timer.flush()
     # All the output GPIOs must be turned off (all lights turned off) when stopping the execution (ctrl C)
-    GPIO.output(self.led_output, 0) # this function sets to 0V (0) or 3,3V (1) the desired output GPIO pin
-    GPIO.output(self.led_state_red, 0)
-    GPIO.output(self.led_state_green, 0)
+    self.gpio.output(self.led_output, 0) # this function sets to 0V (0) or 3,3V (1) the desired output GPIO pin
+    self.gpio.output(self.led_state_red, 0)
+    self.gpio.output(self.led_state_green, 0)
 
   def readCameraConfig(self, filename):
-    """ Reads the specified yaml configuration file """
-    stream = open(filename, 'r')
-    ys = yaml.load(stream)
-    self.camera_config = ys
+    """ Reads and checks the specified yaml configuration file """
+    self.camera_config = CameraConfig.load(filename)
 
   def readConfig(self, config_filename, camera_config_filename):
-    """ Reads both configurations and loads their parameters to the class """
-    stream = open(config_filename, 'r')
-    ys = yaml.load(stream)
-    self.start_date = datetime.strptime(ys["start_date"], '%d/%m/%Y %H:%M')
-    self.end_date = datetime.strptime(ys["end_date"], '%d/%m/%Y %H:%M')
-    self.mission_name = ys["mission_name"]
-    self.mode = ys["mode"]
-    self.photos_per_cycle = ys["photos_per_cycle"]
-    self.period = ys["period"];
+    """ Reads and checks both configurations and loads their parameters to the class. Every
+    problem in a file is reported at once, before anything is started """
+    self.config_filename = config_filename
+    self.camera_config_filename = camera_config_filename
+    self.config = MissionConfig.load(config_filename)
+    self.mission_name = self.config.mission_name
+    self.mode = self.config.mode
+    self.slave_trigger = self.config.slave_trigger
+    self.instrumentation = self.config.instrumentation
+    self.setMissionConfig()
+    self.scheduler = CaptureScheduler(self.period, self.missed_frame_policy, clock=self.clock)
     self.readCameraConfig(camera_config_filename)
+    self.config_watcher = None
+    if self.config.config_reload:
+      self.config_watcher = ConfigWatcher([config_filename, camera_config_filename],
+                                          self.config.config_check_interval, clock=self.clock)
     print "Mission configuration:"
     print "\t* Mission:          %s" % self.mission_name
     print "\t* Mode:             %s" % self.mode
     if self.mode == "slave":
       print "\t* Photos per cycle: %s" % self.photos_per_cycle
+      print "\t* Slave trigger:    %s" % self.slave_trigger
+      print "\t* Burst mode:       %s" % self.burst_mode
     print "\t* Init date:        %s" % self.start_date
     print "\t* End date:         %s" % self.end_date
     print "\t* Period:           %s" % self.period
+    print "\t* Missed frames:    %s" % self.missed_frame_policy
+
+  def setMissionConfig(self):
+    """ Loads the mission parameters that can change while the mission runs """
+    self.start_date = self.config.start_date
+    self.end_date = self.config.end_date
+    self.photos_per_cycle = self.config.photos_per_cycle
+    self.burst_mode = self.config.burst_mode
+    self.burst_video_port = self.config.burst_video_port
+    self.period = self.config.period
+    self.missed_frame_policy = self.config.missed_frame_policy
+    self.schedule_report_frames = self.config.schedule_report_frames
+    self.stats_interval = self.config.stats_interval
+
+  def reloadConfig(self):
+    """ Re-reads the configuration files when they change and applies the changes that are safe
+    between two frames; the others wait for the next restart """
+    if self.config_watcher is None or not self.config_watcher.changed():
+      return
+    try:
+      config = MissionConfig.load(self.config_filename)
+      camera_config = CameraConfig.load(self.camera_config_filename)
+    except (ConfigError, IOError), err:
+      print "Configuration not reloaded: %s" % err
+      return
+    mission_changes = self.config.diff(config)
+    camera_changes = self.camera_config.diff(camera_config)
+    restart = [field.name for field in mission_changes + camera_changes if not self.isHot(field)]
+    if restart:
+      print "Configuration changes applied at the next restart: %s" % ", ".join(restart)
+    mission_changes = [field for field in mission_changes if self.isHot(field)]
+    camera_changes = [field for field in camera_changes if self.isHot(field)]
+    if not mission_changes and not camera_changes:
+      return
+    print "Configuration reloaded: %s" % ", ".join(
+          ["%s=%s" % (field.name, getattr(config, field.name)) for field in mission_changes] +
+          ["%s=%s" % (field.name, getattr(camera_config, field.name)) for field in camera_changes])
+    self.config = self.config.merge(config, mission_changes)
+    self.camera_config = self.camera_config.merge(camera_config, camera_changes)
+    self.applyConfig()
+
+  def isHot(self, field):
+    """ True if a changed field is applied while the mission runs. The housekeeping process reads its
+    settings when it starts, so with process_split they wait for the next restart as well; so do iso
+    and exposure_mode with the exposure predictor, which sets them itself and only starts from iso """
+    if self.housekeeper is not None and field.name in HOUSEKEEPING_SETTINGS:
+      return False
+    if self.exposure is not None and field.name in ("iso", "exposure_mode"):
+      return False
+    return field.hot
+
+  def applyConfig(self):
+    """ Passes the reloaded parameters on to the running components. Neither the camera nor the schedule restart """
+    period = self.period
+    self.setMissionConfig()
+    self.scheduler.policy = self.missed_frame_policy
+    if self.period != period:
+      self.scheduler.setPeriod(self.period * self.policy.level().period_factor)
+    if self.instrumentation:
+      self.timer.interval = self.stats_interval
+    self.config_watcher.interval = self.config.config_check_interval
+    c = self.camera_config
+    self.setLedConfig()
+    self.max_temp = c.max_temp
+    self.min_temp = c.min_temp
+    self.temp_sampler.interval = c.temp_sample_interval
+    self.temp_sampler.smoothing = c.temp_smoothing
+    self.temp_sampler.max_age = c.temp_max_age
+    self.memory_threshold = c.memory_threshold
+    self.storage.threshold = c.memory_threshold * 1024
+    self.storage.resync_frames = c.storage_resync_frames
+    adaptive_policy = self.adaptive_policy
+    self.adaptive_policy = self.policyEnabled()
+    if adaptive_policy and not self.adaptive_policy:
+      # back to the full capture level and the configured period
+      self.policy.reset()
+      self.capture_options = self.captureOptions(self.policy.level())
+      self.scheduler.setPeriod(self.period)
+    self.policy.margin = c.policy_margin
+    if self.sensors is not None:
+      self.sensors.interval = c.sensor_interval
+    if self.dedup is not None:
+      self.dedup.threshold = c.dedup_threshold
+      self.dedup.keep_every = c.dedup_keep_every
+      self.dedup.contrast_floor = c.dedup_contrast_floor
+    if self.exposure is not None:
+      self.exposure.target = c.exposure_target
+      self.exposure.shutter_range = (c.exposure_shutter_min, c.exposure_shutter_max)
+      self.led_time_on_capture = c.exposure_led_delay_on
+    else:
+      self.led_time_on_capture = self.led_time_on
+    if self.state is not None:
+      self.state.save_frames = c.state_save_frames
+      self.state.save_interval = c.state_save_interval
+    self.session.idle_timeout = c.camera_idle_timeout
+    self.session.warmup = c.camera_warmup
+    self.session.apply(self.cameraSettings()) # only the settings that changed are written to the camera
 
   def startLed(self):
     """ Reads and sets the configuration for the LED output """
+    GPIO = self.gpio
     GPIO.setmode(GPIO.BCM) # RPi has two modes of numbering GPIO pins
     GPIO.setwarnings(False)
-    self.led_output = self.camera_config["led_pin_output"]
-    self.signal_input = self.camera_config["signal_pin_input"]
-    self.led_state_red = self.camera_config["state_red"]
-    self.led_state_green = self.camera_config["state_green"]
+    self.led_output = self.camera_config.led_pin_output
+    self.signal_input = self.camera_config.signal_pin_input
+    self.led_state_red = self.camera_config.state_red
+    self.led_state_green = self.camera_config.state_green
     GPIO.setup(self.led_output, GPIO.OUT, initial=GPIO.LOW) #GPIO.LOw sets the initial value to 0 V
     GPIO.setup(self.signal_input, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
     GPIO.setup(self.led_state_red, GPIO.OUT, initial=GPIO.LOW)
     GPIO.setup(self.led_state_green, GPIO.OUT, initial=GPIO.LOW)
-    self.led_time_on = self.camera_config["led_delay_on"]
-    self.led_time_off = self.camera_config["led_delay_off"]
-    self.time_green_led_out_of_time = self.camera_config["time_green_led_out_of_time"]
-    self.time_green_led_waiting_slave = self.camera_config["time_green_led_waiting_slave"]
-    self.time_red_led = self.camera_config["time_red_led"]
-    self.num_flashes_green_led_out_of_time = self.camera_config["num_flashes_green_led_out_of_time"]
-    self.num_flashes_green_led_waiting_slave = self.camera_config["num_flashes_green_led_waiting_slave"]
-    self.num_flashes_red_led = self.camera_config["num_flashes_red_led"]
-    self.time_between_flashes = self.camera_config["time_between_flashes"]
-    self.time_of_each_flash = self.camera_config["time_of_each_flash"]
+    self.setLedConfig()
+    self.leds = LedEngine(GPIO, self.clock)
+    self.trigger_bouncetime = self.camera_config.trigger_bouncetime
+    self.trigger = None
+    self.trigger_time = None
+
+  def setLedConfig(self):
+    """ Loads the LED timings and builds the state LED patterns """
+    self.led_time_on = self.camera_config.led_delay_on
+    self.led_time_off = self.camera_config.led_delay_off
+    self.time_green_led_out_of_time = self.camera_config.time_green_led_out_of_time
+    self.time_green_led_waiting_slave = self.camera_config.time_green_led_waiting_slave
+    self.time_red_led = self.camera_config.time_red_led
+    self.num_flashes_green_led_out_of_time = self.camera_config.num_flashes_green_led_out_of_time
+    self.num_flashes_green_led_waiting_slave = self.camera_config.num_flashes_green_led_waiting_slave
+    self.num_flashes_red_led = self.camera_config.num_flashes_red_led
+    self.time_between_flashes = self.camera_config.time_between_flashes
+    self.time_of_each_flash = self.camera_config.time_of_each_flash
+    # The state LEDs are driven by a background engine: the loops only post the pattern to show
+    self.pattern_out_of_time = BlinkPattern(self.num_flashes_green_led_out_of_time, self.time_of_each_flash,
+                                            self.time_between_flashes, self.time_green_led_out_of_time)
+    self.pattern_waiting_slave = BlinkPattern(self.num_flashes_green_led_waiting_slave, self.time_of_each_flash,
+                                              self.time_between_flashes, self.time_green_led_waiting_slave)
+    self.pattern_memory_alarm = BlinkPattern(self.num_flashes_red_led, self.time_of_each_flash,
+                                             self.time_between_flashes, self.time_red_led)
 
   def startSensor(self):
     """ Reads and sets the configuration for the temperature sensor """
-    self.max_temp = self.camera_config["max_temp"]
-    self.min_temp = self.camera_config["min_temp"]
-    self.temp_sensor = MCP9808.MCP9808()
+    self.max_temp = self.camera_config.max_temp
+    self.min_temp = self.camera_config.min_temp
+    if self.temp_sensor is None:
+      self.temp_sensor = MCP9808.MCP9808(bus=self.i2c_bus)
     self.temp_sensor.begin()
+    # The sensor is read from a background thread; the capture gate uses the smoothed cached value
+    self.temp_sampler = TemperatureSampler(self.temp_sensor, self.camera_config.temp_sample_interval,
+                                           self.camera_config.temp_buffer_size, self.camera_config.temp_max_age,
+                                           self.camera_config.temp_smoothing, clock=self.clock)
+
+  def startSensorHub(self):
+    """ Registers the housekeeping sensors logged to <mission>/sensors.bin. The gate temperature
+    is taken from the sampler's cache, so it costs no extra read """
+    self.sensors = None
+    if not self.camera_config.sensor_log:
+      return
+    self.sensors = SensorHub(self.path + "/sensors.bin", self.camera_config.sensor_interval, clock=self.clock)
+    self.sensors.add("temperature", self.temp_sampler.latest)
+    for sensor in self.camera_config.sensors: # all MCP9808, checked with the configuration
+      device = MCP9808.MCP9808(address=sensor["address"], bus=self.i2c_bus)
+      # a missing or failed sensor is logged as NaN; it must not stop the mission
+      try:
+        if not device.begin():
+          print "Sensor %s at 0x%02x is not an MCP9808, not read" % (sensor["name"], sensor["address"])
+          self.sensors.add(sensor["name"], lambda: None)
+          continue
+      except (IOError, OSError), err:
+        print "Sensor %s at 0x%02x does not answer (%s), logged as failing" % (sensor["name"], sensor["address"], err)
+      self.sensors.add(sensor["name"], device.readTempC)
+
+  def startThreads(self):
+    """ Starts the background work: state LEDs, temperature sampling and housekeeping sensors """
+    self.leds.start()
+    self.temp_sampler.start()
+    if self.sensors is not None:
+      self.sensors.start()
+
+  def checkTemperature(self, temp):
+    """ Checks whether the temperature is known and within the temperature range or not """
+    return temp is not None and temp < self.max_temp and temp > self.min_temp
+
+  def startStorage(self):
+    """ Creates the mission directory and the storage budget of its filesystem """
+    # Creates the directory where images will be saved
+    self.path = os.getcwd() + "/" + self.mission_name
+    if not os.path.exists(self.path):
+      os.makedirs(self.path)
+    self.memory_threshold = self.camera_config.memory_threshold
+    self.storage = StorageBudget(self.path, self.memory_threshold,
+                                 resync_frames=self.camera_config.storage_resync_frames, clock=self.clock)
+    # Images go to <mission>/YYYYmmdd/HH/ and each one gets a record in <mission>/frames.idx
+    if self.camera_config.process_split:
+      # the housekeeping process appends to the index, this one only numbers the frames
+      self.index = openIndex(self.path, self.camera_config.housekeeping_timeout)
+    else:
+      self.index = FrameIndex(self.path + "/frames.idx")
+    # Per-stage timings of the loops, rewritten every stats_interval seconds to <mission>/stats.txt
+    if self.instrumentation:
+      self.timer = StageTimer(self.path + "/stats.txt", self.stats_interval, clock=self.clock)
+    else:
+      self.timer = NullTimer()
+    self.segments = None
+    self.writer = None
+    if self.camera_config.process_split:
+      return # frames are written by the housekeeping process (see startHousekeeping)
+    if self.camera_config.storage_backend == "segments":
+      # Frames are appended to <mission>/segments/seg-NNNNNN.gcs instead of one file each
+      self.segments = SegmentArchive(self.path + "/segments", self.camera_config.segment_size * 1000000,
+                                     self.camera_config.writer_fsync_frames)
+    if self.camera_config.pipeline_writer:
+      # Frames are encoded to memory and written by a background thread
+      self.writer = FrameWriter(self.camera_config.writer_queue_size, self.camera_config.writer_fsync_frames,
+                                on_written=lambda filename, size, record: self.frameSaved(record, size), clock=self.clock,
+                                sink=self.segments)
+
+  def startHousekeeping(self):
+    """ Starts the housekeeping process when the capture and the housekeeping are split """
+    self.housekeeper = None
+    if not self.camera_config.process_split:
+      return
+    c = self.camera_config
+    self.housekeeper = Housekeeper(self.path, self.camera_config_filename, c.writer_queue_size, c.housekeeping_timeout,
+                                   c.process_restart_delay, c.housekeeping_backlog, on_status=self.storage.follow)
+    if self.housekeeper.start(self.storage.state()):
+      # the HELLO comes once the process holds the lock: frames indexed since openIndex keep their numbers
+      self.index.next_seq = max(self.index.next_seq, self.housekeeper.next_seq)
+
+  def startPolicy(self):
+    """ Reads the capture levels the adaptive policy steps through as the storage budget tightens """
+    self.adaptive_policy = self.policyEnabled()
+    if self.camera_config.adaptive_policy and not self.adaptive_policy:
+      print "Capture policy: not used in slave mode"
+    self.policy = AdaptivePolicy(self.camera_config.capture_levels, self.camera_config.policy_margin)
+    self.capture_options = self.captureOptions(self.policy.level())
+
+  def policyEnabled(self):
+    """ The policy projects the frames left from the period, so it only holds in master mode: in
+    slave mode frames come with the glider triggers """
+    return self.camera_config.adaptive_policy and self.mode == "master"
+
+  def captureOptions(self, level):
+    """ Encoder options (JPEG quality, resize) passed to every capture at a capture level """
+    options = {"quality": level.quality}
+    if level.scale < 1:
+      # resized by the GPU; picamera wants even sizes
+      options["resize"] = (int(self.camera_config.width * level.scale) // 2 * 2,
+                           int(self.camera_config.height * level.scale) // 2 * 2)
+    return options
+
+  def adaptCapture(self):
+    """ Lets the adaptive policy step the capture level up or down """
+    if not self.adaptive_policy:
+      return
+    previous = self.policy.current
+    budget = self.storage.freeBytes() - self.storage.threshold
+    seconds_left = (self.end_date - self.clock.now()).total_seconds()
+    current = self.policy.decide(budget, self.storage.bytes_per_frame, seconds_left, self.period, self.clock.time())
+    if current != previous:
+      level = self.policy.level()
+      self.capture_options = self.captureOptions(level)
+      self.scheduler.setPeriod(self.period * level.period_factor)
+      print "Capture policy: level %d -> %d (%s): %s" % (previous, current, level.describe(), self.policy.decisions[-1][3])
+
+  def startDuplicateFilter(self):
+    """ Sets up the optional near-duplicate suppression (needs NumPy) """
+    self.dedup = None
+    if self.camera_config.dedup:
+      self.dedup = DuplicateFilter(self.camera_config.dedup_preview_width, self.camera_config.dedup_preview_height,
+                                   self.camera_config.dedup_threshold, self.camera_config.dedup_history,
+                                   self.camera_config.dedup_keep_every,
+                                   contrast_floor=self.camera_config.dedup_contrast_floor)
+
+  def preview(self):
+    """ Takes a small YUV preview through the video port """
+    stream = io.BytesIO()
+    self.camera.capture(stream, format='yuv', use_video_port=True,
+                        resize=(self.camera_config.dedup_preview_width, self.camera_config.dedup_preview_height))
+    return stream.getvalue()
+
+  def startExposure(self):
+    """ Sets up the optional exposure prediction (needs NumPy), starting from shutter_speed and iso """
+    self.exposure = None
+    self.led_time_on_capture = self.led_time_on
+    if self.camera_config.exposure_predictor:
+      self.exposure = ExposurePredictor(self.camera_config.shutter_speed, self.camera_config.iso,
+                                        self.camera_config.dedup_preview_width, self.camera_config.dedup_preview_height,
+                                        self.camera_config.exposure_target,
+                                        shutter_range=(self.camera_config.exposure_shutter_min,
+                                                       self.camera_config.exposure_shutter_max))
+      # nothing has to settle: the LED only has to be on before the exposure starts
+      self.led_time_on_capture = self.camera_config.exposure_led_delay_on
+    self.frozen_exposure = None # (camera opening, ISO) the gains were frozen at
+
+  def updateExposure(self, yuv=None):
+    """ Predicts the exposure of the next frame from a preview taken under the LED with the current one """
+    if yuv is None:
+      yuv = self.preview()
+    self.exposure.update(yuv)
+    self.applyExposure()
+
+  def applyExposure(self):
+    """ Fixes the predicted exposure on the open camera. The gains are frozen while exposure_mode is
+    'off' and only follow a new ISO with the auto exposure on: it is turned on again for camera_warmup
+    seconds (the LED is off, this is after the frame) before freezing them at the new ISO. When the next
+    frame is due sooner than that, the ISO change waits for a later frame and the shutter takes it """
+    if self.frozen_exposure != (self.session.opens, self.exposure.iso):
+      left = self.timeToNextFrame()
+      if left is not None and left < self.camera_config.camera_warmup and self.frozen_exposure is not None and \
+         self.frozen_exposure[0] == self.session.opens:
+        iso = self.frozen_exposure[1]
+        lo, hi = self.exposure.shutter_range
+        print "ISO %d deferred: next frame in %.3fs" % (self.exposure.iso, left)
+        self.exposure.shutter = int(min(max(self.exposure.shutter * self.exposure.iso / float(iso), lo), hi))
+        self.exposure.iso = iso
+        self.session.apply([("shutter_speed", self.exposure.shutter)])
+        return
+      self.session.apply([("exposure_mode", "auto"), ("iso", self.exposure.iso)])
+      self.clock.sleep(self.camera_config.camera_warmup)
+    self.session.apply([("shutter_speed", self.exposure.shutter), ("exposure_mode", "off")])
+    self.frozen_exposure = (self.session.opens, self.exposure.iso)
+
+  def timeToNextFrame(self):
+    """ Seconds left to the deadline of the next frame, None when none is scheduled (the slave cycle is over) """
+    if self.mode != "master" and (not self.in_cycle or self.cycle_frames + 1 >= self.photos_per_cycle):
+      return None
+    return self.scheduler.deadline() - self.clock.monotonic()
+
+  def startState(self):
+    """ Opens the mission checkpoint and restores the progress of a mission interrupted by a reboot """
+    self.state = MissionState(self.path + "/state.json", self.camera_config.state_save_frames,
+                              self.camera_config.state_save_interval, clock=self.clock)
+    self.resume = self.state.load() if self.camera_config.resume_mission else None
+    if self.resume is None:
+      return
+    # frames reserved but never indexed (still in the writer queue at the power cut) keep their numbers
+    self.index.next_seq = max(self.index.next_seq, self.resume["next_seq"])
+    self.storage.restore(self.resume["storage"])
+    self.last_capture = self.resume["last_capture"]
+    self.slave_cycles = self.resume["slave_cycles"]
+    self.previous_signal = self.resume["previous_signal"]
+    if self.adaptive_policy:
+      self.policy.restore(self.resume["policy"])
+      level = self.policy.level()
+      self.capture_options = self.captureOptions(level)
+      self.scheduler.setPeriod(self.period * level.period_factor)
+    last = datetime.fromtimestamp(self.last_capture) if self.last_capture is not None else "never"
+    print "Resuming mission: next frame %d, last capture %s, %d slave cycles" % (self.index.next_seq, last, self.slave_cycles)
+
+  def missionState(self):
+    """ Progress of the mission saved in the checkpoint """
+    now = self.clock.time()
+    return {
+      "mission_name": self.mission_name,
+      "next_seq": self.index.next_seq,
+      "last_capture": self.last_capture,
+      # the monotonic clock restarts with the system, so the phase of the grid is kept in wall time
+      "next_deadline": now + self.scheduler.deadline() - self.clock.monotonic(),
+      "period": self.scheduler.period,
+      "storage": self.storage.state(),
+      "policy": self.policy.state(),
+      "slave_cycles": self.slave_cycles,
+      "in_cycle": self.in_cycle,
+      "cycle_frames": self.cycle_frames,
+      "previous_signal": self.previous_signal,
+    }
+
+  def checkpoint(self, force=False):
+    """ Rewrites the mission checkpoint every state_save_frames frames, or right away if forced """
+    if self.state is not None and (force or self.state.due()):
+      with self.timer.span("checkpoint"):
+        self.state.save(self.missionState())
+
+  def startSchedule(self):
+    """ Anchors the capture grid, on the phase of the interrupted mission when resuming """
+    resume, self.resume = self.resume, None
+    if resume is None:
+      self.scheduler.start()
+      return
+    now = self.clock.time()
+    slot, missed = nextSlot(resume["next_deadline"], self.scheduler.period, now)
+    if slot - now > self.scheduler.period:
+      # the wall clock went back (no RTC and no NTP yet): the saved phase means nothing
+      self.scheduler.start()
+      return
+    self.scheduler.start(self.clock.monotonic() + slot - now)
+    print "Resumed the capture grid: %d slots lost while down, next frame in %.1fs" % (missed, slot - now)
+
+  def resumeCycle(self):
+    """ Finishes the slave cycle a reboot interrupted """
+    resume, self.resume = self.resume, None
+    if resume is None or not resume["in_cycle"]:
+      return
+    left = self.photos_per_cycle - resume["cycle_frames"]
+    if left > 0:
+      print "Resuming an interrupted cycle: %d photos left" % left
+      self.captureCycle(count=left)
 
   def shutdown(self):
     """ Shutdowns the entire system """
@@ -93,143 +531,339 @@ class GliderCamera:
     import subprocess
     subprocess.call(["sudo",  "shutdown",  "-k",  "+10",  '"RPi2 is going down to save battery. If you are planning to work, cancel it using < sudo shutdown -c > and remember to change the end date"'])
 
+  def cameraSettings(self):
+    """ Camera params of camera_config.yaml. The exposure ones are left to the predictor when it is on """
+    width = self.camera_config.width
+    height = self.camera_config.height
+    settings = [
+      ("resolution", (width,height)),
+      ("sharpness", self.camera_config.sharpness),
+      ("contrast", self.camera_config.contrast),
+      ("brightness", self.camera_config.brightness),
+      ("drc_strength", self.camera_config.drc),
+    ]
+    if self.exposure is None:
+      settings += [("iso", self.camera_config.iso), ("exposure_mode", self.camera_config.exposure_mode)]
+    return settings
+
   def startCamera(self):
-    """ Initializes the camera and its params """
-    time.sleep(1)
-    # Creates the directory where images will be saved
-    self.path = os.getcwd() + "/" + self.mission_name
-    if not os.path.exists(self.path):
-      os.makedirs(self.path)
-    self.camera = picamera.PiCamera()
-    width = self.camera_config["width"]
-    height = self.camera_config["height"]
-    self.camera.resolution = (width,height)
-    self.camera.sharpness = self.camera_config["sharpness"]
-    self.camera.brightness = self.camera_config["brightness"]
-    self.camera.iso = self.camera_config["iso"]
-    self.camera.exposure_mode = self.camera_config["exposure_mode"]
-    self.camera.drc_strength = self.camera_config["drc"]
-    self.memory_threshold = self.camera_config["memory_threshold"]
+    """ Initializes the camera and its params. The camera is reused if the session kept it open """
+    settings = self.cameraSettings()
+    opens = self.session.opens
+    if self.exposure is not None:
+      settings += [("iso", self.exposure.iso)]
+    self.camera = self.session.acquire(settings)
+    if self.exposure is not None:
+      if self.session.opens != opens:
+        # a new camera starts with the auto exposure on: the warmup let the gains settle at the ISO
+        self.frozen_exposure = (self.session.opens, self.exposure.iso)
+      self.applyExposure()
 
   def checkTime(self):
     """ Checks whether the current time fits in the mission timing window or not """
-    time_now = datetime.now()
+    time_now = self.clock.now()
     if time_now < self.start_date:
       d = self.start_date - time_now
       print "Capture will start in " + repr(d.days) + " days..."
-      # starts the green led flashing sets, which indicate that it is too soon to start the mission
-      number_of_intervals = d.seconds/self.time_green_led_out_of_time
-      remaining = d.seconds%self.time_green_led_out_of_time
-      for i in range(0, number_of_intervals):
-        self.state(0,0,self.led_state_green,self.time_green_led_out_of_time,self.num_flashes_green_led_out_of_time) # performing complete flashing set periods
-      self.state(1,remaining,self.led_state_green,self.time_green_led_out_of_time,self.num_flashes_green_led_out_of_time) # performing the last flashing set which has 
-      # a very high probability of not being complete (the remaining time to start the mission is less than the time between flashing sets)
+      # the green led flashing sets indicate that it is too soon to start the mission
+      self.leds.show(self.led_state_green, self.pattern_out_of_time)
+      while time_now < self.start_date:
+        self.clock.sleep(min((self.start_date - time_now).total_seconds(), 3600))
+        time_now = self.clock.now()
+      self.leds.clear(self.led_state_green)
     elif time_now > self.end_date:
       print "Capture time ended. Shutdown..."
       self.shutdown()
     return True
 
-  def flash(self, led_pin, num_flashes_led):
-    """ Performs num_flashes_led blinks at the led_pin pin """
-    for i in range(0, num_flashes_led):
-      if i > 0:
-        time.sleep(self.time_between_flashes)
-      GPIO.output(led_pin, 1)
-      time.sleep(self.time_of_each_flash)
-      GPIO.output(led_pin, 0)
-
-  def state(self, finish_bool, time_to_finish, led_pin, time_waiting, num_flashes_green_led):
-    """ Controls the complete flashing period of the green led when it is out of the timing window """
-    ini_aux = datetime.now()
-    self.flash(led_pin, num_flashes_green_led)
-    fin_aux = datetime.now()
-    diff = (fin_aux - ini_aux).total_seconds()
-    if finish_bool == 0:
-      if time_waiting - diff > 0:
-        time.sleep(time_waiting - diff)
-    elif finish_bool == 1:
-      if time_to_finish - diff > 0:
-        time.sleep(time_to_finish - diff)
-
   def checkMemory(self):
     """ Checks the current memory space left and compares it with the memory threshold """
-    import subprocess
-    p1 = subprocess.Popen(["sudo", "df"], stdout = subprocess.PIPE)
-    p2 = subprocess.Popen(["grep", "rootfs"], stdin = p1.stdout, stdout = subprocess.PIPE)
-    p3 = subprocess.Popen(["awk", "{print $4}"], stdin = p2.stdout, stdout = subprocess.PIPE)
-    p1.stdout.close()
-    p2.stdout.close()
-    memory = p3.stdout.readline()
-    available = int(memory) - self.memory_threshold
-    if available > 0:
-      return True 
+    return self.storage.aboveThreshold()
+
+  def indicateMemory(self):
+    """ Red led flashing sets while the free space is under the memory threshold """
+    if self.housekeeper is not None:
+      return # the LED is driven by the housekeeping process
+    if self.checkMemory():
+      self.leds.clear(self.led_state_red)
     else:
-      return False
+      self.leds.show(self.led_state_red, self.pattern_memory_alarm)
 
 
   def captureMaster(self):
     """ Automatic capture mode """
     self.startCamera()
-    while self.checkTime():
+    self.checkTime() # waits for the start date before anchoring the schedule
+    self.startSchedule()
+    while True:
+      with self.timer.span("check_time"):
+        self.checkTime()
+      with self.timer.span("schedule_wait"):
+        self.scheduler.wait()
       self.capture()
+      self.checkpoint()
+      self.reportSchedule()
+      self.timer.maybeFlush()
+      self.reloadConfig()
 
   def captureSlave(self):
     """ Slave capture mode. Capture cycles do NOT overlap """
-    previous_signal = False
+    self.checkTime()
+    self.resumeCycle()
+    if self.slave_trigger == "edge":
+      self.captureSlaveEdge()
+      return
     slave_message_shown = False
     while self.checkTime():
-      current_signal = GPIO.input(self.signal_input) #returns the value of an input GPIO
-      if current_signal == previous_signal:
+      current_signal = self.gpio.input(self.signal_input) #returns the value of an input GPIO
+      if current_signal == self.previous_signal:
         # Wait
         if not slave_message_shown:
           print "Slave mode: Waiting for rising edge..."
           slave_message_shown = True
-        ini_aux = datetime.now()
-        self.flash(self.led_state_green, self.num_flashes_green_led_waiting_slave)
+        self.leds.show(self.led_state_green, self.pattern_waiting_slave)
         #TO DO how much time can we sleep?
-        fin_aux = datetime.now()
-        remaining = self.time_green_led_waiting_slave - (fin_aux - ini_aux).total_seconds()
-        if remaining > 0:
-          time.sleep(remaining)
-      elif previous_signal == True:
+        self.clock.sleep(self.time_green_led_waiting_slave)
+        self.reloadConfig()
+      elif self.previous_signal == True:
         # Reset the previous value to be ready for the next rising edge
-        previous_signal = False
+        self.previous_signal = False
         slave_message_shown = False
+        self.checkpoint(force=True)
       else:
         # Capture starts
-        previous_signal = True
-        self.startCamera()
-        for i in range(0, self.photos_per_cycle):
-          self.capture()
-          if datetime.now() > self.end_date:
-            break
-        self.camera.close()
+        self.previous_signal = True
+        self.leds.clear(self.led_state_green)
+        self.captureCycle()
+
+  def captureSlaveEdge(self):
+    """ Slave capture mode driven by GPIO edge callbacks. Rising edges are timestamped and queued as
+    they arrive, so none is lost while the camera is capturing """
+    self.trigger = self.startTrigger()
+    print "Slave mode: Waiting for rising edge..."
+    while True:
+      with self.timer.span("check_time"):
+        self.checkTime()
+      self.leds.show(self.led_state_green, self.pattern_waiting_slave)
+      with self.timer.span("trigger_wait"):
+        trigger_time = self.trigger.wait(self.time_green_led_waiting_slave)
+      self.timer.maybeFlush()
+      if trigger_time is None:
+        self.reloadConfig()
+        continue
+      self.leds.clear(self.led_state_green)
+      self.captureCycle(trigger_time)
+      self.trigger.discard() # edges received during the cycle are not queued for later
+      print self.trigger.report()
+      print "Slave mode: Waiting for rising edge..."
+
+  def startTrigger(self):
+    """ Starts watching the rising edges of the slave signal """
+    return EdgeTrigger(self.gpio, self.signal_input, bouncetime=self.trigger_bouncetime, clock=self.clock)
+
+  def captureCycle(self, trigger_time=None, count=None):
+    """ Takes count (default photos_per_cycle) photos. trigger_time is the monotonic time of the edge that started the cycle """
+    count = self.photos_per_cycle if count is None else count
+    self.trigger_time = trigger_time
+    self.in_cycle = True
+    self.cycle_frames = self.photos_per_cycle - count
+    with self.timer.span("camera_start"):
+      self.startCamera()
+    if self.burst_mode:
+      self.captureBurst(count)
+      self.cycle_frames += count
+    else:
+      self.scheduler.start()
+      for i in range(0, count):
+        with self.timer.span("schedule_wait"):
+          self.scheduler.wait()
+        self.capture()
+        self.cycle_frames += 1
+        self.checkpoint() # after the frame is counted, or a resume would take it again
+        if self.clock.now() > self.end_date:
+          break
+    with self.timer.span("camera_release"):
+      self.session.release() # the camera is closed after camera_idle_timeout seconds without a new cycle
+    self.trigger_time = None
+    self.in_cycle = False
+    self.slave_cycles += 1
+    self.checkpoint(force=True)
+    print self.scheduler.report()
+    print self.session.report()
+    print self.storage.report(self.clock.now(), self.end_date, self.period)
+
+  def reportSchedule(self):
+    """ Prints the schedule statistics every schedule_report_frames frames """
+    if self.schedule_report_frames > 0 and self.scheduler.frames % self.schedule_report_frames == 0:
+      print self.scheduler.report()
+      print self.storage.report(self.clock.now(), self.end_date, self.period)
+      print self.temp_sampler.report()
+      if self.sensors is not None:
+        print self.sensors.report()
+      if self.adaptive_policy:
+        print self.policy.report()
+      if self.dedup is not None:
+        print self.dedup.report()
+      if self.exposure is not None:
+        print self.exposure.report()
+      if self.writer is not None:
+        print self.writer.report()
+      if self.housekeeper is not None:
+        print self.housekeeper.report()
+      if self.segments is not None:
+        print self.segments.report()
+      if self.state is not None:
+        print self.state.report()
+
+  def exposureStarting(self):
+    """ Records the trigger to exposure latency on the first exposure of a triggered cycle """
+    if self.trigger_time is not None:
+      latency = self.trigger.exposed(self.trigger_time)
+      self.trigger_time = None
+      print "Trigger to exposure latency: %.3fs" % latency
+
+  def newFrame(self, temp):
+    """ Returns the index record (sequence number, times and shard path) of a frame about to be captured """
+    return self.index.newFrame(self.clock.monotonic(), self.clock.time(), temp)
+
+  def frameFilename(self, record):
+    """ Full path of a frame, creating its shard directory if needed """
+    filename = self.path + "/" + record.path
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    return filename
+
+  def fileSize(self, filename):
+    """ Size in bytes of a saved frame """
+    return os.path.getsize(filename)
+
+  def frameSaved(self, record, size):
+    """ Accounts for a frame once it is on disk """
+    self.storage.add(size)
+    self.index.append(record._replace(size=size))
+
+  def storeFrame(self, record, data):
+    """ Hands an encoded frame to the housekeeping process or the background writer, or appends it to the current segment """
+    if self.housekeeper is not None:
+      self.housekeeper.put(record, data) # never waits: the frame is queued in memory until it is sent
+    elif self.writer is not None:
+      self.writer.put(self.path + "/" + record.path, data, record) # blocks only while the writer queue is full
+    else:
+      self.frameSaved(self.segments.append(record, data), len(data))
+
+  def saveFrame(self, record):
+    """ Captures a frame, either directly to its file or to memory for the writer or the segments """
+    self.exposureStarting()
+    if self.writer is not None or self.segments is not None or self.housekeeper is not None:
+      stream = io.BytesIO()
+      with self.timer.span("camera_capture"):
+        self.camera.capture(stream, format='jpeg', **self.capture_options)
+      with self.timer.span("frame_store"):
+        self.storeFrame(record, stream.getvalue())
+    else:
+      filename = self.frameFilename(record)
+      with self.timer.span("camera_capture"): # includes the file write
+        self.camera.capture(filename, **self.capture_options)
+      with self.timer.span("frame_saved"):
+        self.frameSaved(record, self.fileSize(filename))
+
+  def captureBurst(self, count):
+    """ Captures count images as fast as the sensor allows, with a single temperature check,
+    LED pulse and memory check for the whole burst """
+    burst_time = self.clock.now().strftime("%Y%m%d-%H%M%S")
+    temp = self.temp_sampler.smoothed()
+    if not self.checkTemperature(temp):
+      print burst_time + ": Out of temperature boundaries"
+      return
+    records = [self.newFrame(temp) for i in range(0, count)]
+    self.gpio.output(self.led_output, 1)
+    with self.timer.span("led_on"):
+      self.clock.sleep(self.led_time_on)
+    self.exposureStarting()
+    ini_aux = self.clock.monotonic()
+    if self.writer is not None or self.segments is not None or self.housekeeper is not None:
+      streams = [io.BytesIO() for i in range(0, count)]
+      self.camera.capture_sequence(streams, format='jpeg', use_video_port=self.burst_video_port, **self.capture_options)
+      elapsed = self.clock.monotonic() - ini_aux
+      self.gpio.output(self.led_output, 0)
+      for record, stream in zip(records, streams):
+        self.storeFrame(record, stream.getvalue())
+    else:
+      filenames = [self.frameFilename(record) for record in records]
+      self.camera.capture_sequence(filenames, use_video_port=self.burst_video_port, **self.capture_options)
+      elapsed = self.clock.monotonic() - ini_aux
+      self.gpio.output(self.led_output, 0)
+      for record, filename in zip(records, filenames):
+        self.frameSaved(record, self.fileSize(filename))
+    self.timer.record("burst_capture", elapsed)
+    print "Saved burst %s..%s at %sC: %d frames in %.3fs (%.2f fps)" % (
+          records[0].path, os.path.basename(records[-1].path), temp, count, elapsed, count / elapsed if elapsed > 0 else 0.0)
+    with self.timer.span("memory_check"):
+      self.indicateMemory()
+    self.policy.frameCaptured(count)
+    if self.sensors is not None:
+      for record in records:
+        self.sensors.frameTaken(record.seq)
+    self.last_capture = records[-1].wall
+    if self.state is not None:
+      self.state.frameCaptured(count)
+    self.adaptCapture()
+    with self.timer.span("led_off"):
+      self.clock.sleep(self.led_time_off)
 
   def capture(self):
-    """ Captures an image whilst lightning the LED """
-    ini_aux = datetime.now()
-    image_time = time.strftime("%Y%m%d-%H%M%S")
-    GPIO.output(self.led_state_red, 0)
-    temp = self.temp_sensor.readTempC()
-    if temp < self.max_temp and temp > self.min_temp: #checks whether we are within the temperature range or not
-      GPIO.output(self.led_output, 1)
-      time.sleep(self.led_time_on)
-      self.camera.capture(self.path + '/img-' + image_time + '.jpg')
-      print("Saved img-" + image_time + ".jpg at " + str(temp) + "C")
+    """ Captures an image whilst lightning the LED. Frame timing is left to the scheduler """
+    image_time = self.clock.now().strftime("%Y%m%d-%H%M%S")
+    with self.timer.span("temperature"):
+      temp = self.temp_sampler.smoothed()
+    if self.checkTemperature(temp):
+      self.gpio.output(self.led_output, 1)
+      with self.timer.span("led_on"):
+        self.clock.sleep(self.led_time_on_capture)
+      keep = True
+      yuv = None
+      if self.dedup is not None:
+        with self.timer.span("dedup"):
+          yuv = self.preview()
+          keep, distance = self.dedup.check(yuv)
+      if keep:
+        record = self.newFrame(temp)
+        self.saveFrame(record)
+        self.policy.frameCaptured()
+        if self.sensors is not None:
+          self.sensors.frameTaken(record.seq)
+        self.last_capture = record.wall
+        if self.state is not None:
+          self.state.frameCaptured()
+        print("Saved " + record.path + " at " + str(temp) + "C (late %.3fs)" % self.scheduler.last_lateness +
+              (" [writer queue %d]" % self.writer.depth() if self.writer is not None else "") +
+              (" [housekeeping %d]" % self.housekeeper.depth() if self.housekeeper is not None else ""))
+      else:
+        print image_time + ": Near-duplicate of a recent frame (distance %.3f), not saved" % distance
+      if self.exposure is not None:
+        with self.timer.span("exposure"):
+          self.updateExposure(yuv)
     else:
       print image_time + ": Out of temperature boundaries"
-    GPIO.output(self.led_output , 0)
-    if not self.checkMemory():
-      self.flash(self.led_state_red,self.num_flashes_red_led) # a red led flashing set for each attempt of capture indicates that we have surpassed the memory threshold
-    fin_aux = datetime.now()
-    capture_time = (fin_aux - ini_aux).total_seconds()
-    time.sleep(self.led_time_off)
-    remaining = self.period - self.led_time_on - self.led_time_off - capture_time
-    if remaining > 0:
-      time.sleep(remaining)
+    self.gpio.output(self.led_output , 0)
+    with self.timer.span("memory_check"):
+      self.indicateMemory()
+    with self.timer.span("capture_policy"):
+      self.adaptCapture()
+    with self.timer.span("led_off"):
+      self.clock.sleep(self.led_time_off)
 
-if __name__ == "__main__":
+def runMission():
   try:
-   GliderCamera()
+   GliderCamera().run()
   except KeyboardInterrupt:
     print(" Stopping camera...")
+
+if __name__ == "__main__":
+  camera_config = CameraConfig.load("camera_config.yaml")
+  if camera_config.process_split:
+    # the capture process is started again if it dies
+    supervise(runMission, camera_config.process_restart_delay)
+  else:
+    runMission()
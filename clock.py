@@ -0,0 +1,59 @@
+import ctypes
+import ctypes.util
+import os
+import time
+from datetime import datetime
+
+# Python 2 has no time.monotonic(), so CLOCK_MONOTONIC is read straight from
+# librt/libc. Wall-clock time (time.time/datetime.now) jumps whenever NTP or
+# the RTC corrects it, which must never move a capture deadline.
+CLOCK_MONOTONIC = 1
+
+class _Timespec(ctypes.Structure):
+  _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+def _loadClockGettime():
+  for name in ("rt", "c"):
+    path = ctypes.util.find_library(name)
+    if path is None:
+      continue
+    try:
+      lib = ctypes.CDLL(path, use_errno=True)
+      func = lib.clock_gettime
+    except (OSError, AttributeError):
+      continue
+    func.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    return func
+  return None
+
+if hasattr(time, "monotonic"):
+  monotonic = time.monotonic
+else:
+  _clock_gettime = _loadClockGettime()
+  if _clock_gettime is None:
+    # Last resort: not monotonic, but keeps non-Linux development hosts working
+    monotonic = time.time
+  else:
+    def monotonic():
+      """ Returns the CLOCK_MONOTONIC time in seconds """
+      t = _Timespec()
+      if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+      return t.tv_sec + t.tv_nsec * 1e-9
+
+class SystemClock(object):
+  """ Real clock used by the camera: monotonic time for deadlines, wall time for names and mission dates """
+
+  def monotonic(self):
+    return monotonic()
+
+  def time(self):
+    return time.time()
+
+  def now(self):
+    return datetime.now()
+
+  def sleep(self, seconds):
+    if seconds > 0:
+      time.sleep(seconds)
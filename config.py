@@ -0,0 +1,314 @@
+import difflib
+import os
+from datetime import datetime
+
+import yaml
+
+from clock import SystemClock
+from scheduler import CaptureScheduler
+from policy import CaptureLevel
+
+class ConfigError(ValueError):
+  """ Raised with every problem found in a configuration file, not just the first one """
+
+  def __init__(self, filename, problems):
+    ValueError.__init__(self, "%s: %s" % (filename, "; ".join(problems)))
+    self.filename = filename
+    self.problems = problems
+
+# Checks: each one returns a description of the problem, or None
+
+def between(lo, hi):
+  def check(value):
+    if not lo <= value <= hi:
+      return "must be between %s and %s" % (lo, hi)
+  return check
+
+def atLeast(lo):
+  def check(value):
+    if value < lo:
+      return "must be at least %s" % lo
+  return check
+
+def positive(value):
+  if value <= 0:
+    return "must be positive"
+
+def choice(*values):
+  def check(value):
+    if value not in values:
+      return "must be one of %s" % ", ".join(repr(v) for v in values)
+  return check
+
+def isoValue(value):
+  if value != 0 and not 100 <= value <= 800:
+    return "must be 0 (automatic) or between 100 and 800"
+
+# Checks across fields: each one takes the whole configuration, fields that
+# failed their own checks are left out
+
+def ordered(low, high, strict=False):
+  def check(config):
+    a, b = getattr(config, low, None), getattr(config, high, None)
+    if a is not None and b is not None and (a > b or (strict and a == b)):
+      return "%s (%s) must be %s %s (%s)" % (low, a, "below" if strict else "at most", high, b)
+  return check
+
+# Types: each one converts a YAML value or raises ValueError
+
+def integer(value):
+  if isinstance(value, bool) or not isinstance(value, (int, long)):
+    raise ValueError("must be an integer")
+  return value
+
+def number(value):
+  if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+    raise ValueError("must be a number")
+  return value
+
+def boolean(value):
+  if not isinstance(value, bool):
+    raise ValueError("must be true or false")
+  return value
+
+def string(value):
+  if not isinstance(value, basestring):
+    raise ValueError("must be a string")
+  return str(value)
+
+def date(value):
+  try:
+    return datetime.strptime(value, '%d/%m/%Y %H:%M')
+  except (TypeError, ValueError):
+    raise ValueError("must be a date like \"31/07/2015 07:33\"")
+
+def captureLevels(value):
+  if not isinstance(value, list) or not value:
+    raise ValueError("must be a non empty list of levels")
+  levels = []
+  for i, level in enumerate(value):
+    try:
+      level = CaptureLevel(integer(level["quality"]), number(level["scale"]), number(level["period_factor"]),
+                           number(level["size"]))
+    except (KeyError, TypeError):
+      raise ValueError("level %d must have quality, scale, period_factor and size" % i)
+    except ValueError, err:
+      raise ValueError("level %d: %s" % (i, err))
+    if not 1 <= level.quality <= 100 or not 0 < level.scale <= 1 or level.period_factor < 1 or level.size <= 0:
+      raise ValueError("level %d: quality 1-100, scale in (0, 1], period_factor >= 1 and size > 0 expected" % i)
+    levels.append(level)
+  return levels
+
+def sensorList(value):
+  if not isinstance(value, list):
+    raise ValueError("must be a list of sensors")
+  for i, sensor in enumerate(value):
+    if not isinstance(sensor, dict) or set(sensor) != set(["name", "type", "address"]):
+      raise ValueError("sensor %d must have exactly name, type and address" % i)
+    if sensor["type"] != "mcp9808":
+      raise ValueError("sensor %d: unknown type '%s'" % (i, sensor["type"]))
+    integer(sensor["address"])
+  return value
+
+class Field(object):
+  """ One key of a configuration file. Hot fields can change while the mission runs """
+
+  __slots__ = ("name", "convert", "check", "hot")
+
+  def __init__(self, name, convert, check=None, hot=False):
+    self.name = name
+    self.convert = convert
+    self.check = check
+    self.hot = hot
+
+class Config(object):
+  """ Configuration read from a YAML file and checked against FIELDS
+
+  Every problem (missing, unknown or misspelt keys, wrong types, values out
+  of range) is reported at once by load(), before anything is started. The
+  values are plain attributes; subclasses declare them in __slots__.
+  """
+
+  __slots__ = ("filename",)
+  FIELDS = []
+  CHECKS = []
+
+  @classmethod
+  def load(cls, filename):
+    with open(filename, "r") as stream:
+      try:
+        data = yaml.safe_load(stream)
+      except yaml.YAMLError, err:
+        raise ConfigError(filename, [str(err)])
+    return cls.fromDict(data if data is not None else {}, filename)
+
+  @classmethod
+  def fromDict(cls, data, filename="<config>"):
+    config = cls()
+    config.filename = filename
+    problems = []
+    names = [field.name for field in cls.FIELDS]
+    for key in sorted(set(data) - set(names)):
+      close = difflib.get_close_matches(key, names, 1)
+      problems.append("unknown key '%s'%s" % (key, " (did you mean '%s'?)" % close[0] if close else ""))
+    for field in cls.FIELDS:
+      if field.name not in data:
+        problems.append("missing key '%s'" % field.name)
+        continue
+      try:
+        value = field.convert(data[field.name])
+      except ValueError, err:
+        problems.append("%s %s" % (field.name, err))
+        continue
+      problem = field.check(value) if field.check is not None else None
+      if problem is not None:
+        problems.append("%s %s" % (field.name, problem))
+        continue
+      setattr(config, field.name, value)
+    for check in cls.CHECKS:
+      problem = check(config)
+      if problem is not None:
+        problems.append(problem)
+    if problems:
+      raise ConfigError(filename, problems)
+    return config
+
+  def diff(self, other):
+    """ Fields whose value differs in other """
+    return [field for field in self.FIELDS if getattr(self, field.name) != getattr(other, field.name)]
+
+  def merge(self, other, fields):
+    """ Copy of this configuration with the values of fields taken from other """
+    config = self.__class__()
+    config.filename = self.filename
+    for field in self.FIELDS:
+      setattr(config, field.name, getattr(other if field in fields else self, field.name))
+    return config
+
+MISSION_FIELDS = [
+  Field("mission_name", string),
+  Field("mode", string, choice("master", "slave")),
+  Field("photos_per_cycle", integer, positive, hot=True),
+  Field("slave_trigger", string, choice("edge", "poll")),
+  Field("burst_mode", boolean, hot=True),
+  Field("burst_video_port", boolean, hot=True),
+  Field("period", number, positive, hot=True),
+  Field("start_date", date, hot=True),
+  Field("end_date", date, hot=True),
+  Field("missed_frame_policy", string, choice(*CaptureScheduler.POLICIES), hot=True),
+  Field("schedule_report_frames", integer, atLeast(0), hot=True),
+  Field("instrumentation", boolean),
+  Field("stats_interval", number, positive, hot=True),
+  Field("config_reload", boolean),
+  Field("config_check_interval", number, positive, hot=True),
+]
+
+class MissionConfig(Config):
+  """ Mission settings (config.yaml) """
+  __slots__ = tuple(field.name for field in MISSION_FIELDS)
+  FIELDS = MISSION_FIELDS
+
+CAMERA_FIELDS = [
+  Field("width", integer, between(64, 2592)),
+  Field("height", integer, between(64, 1944)),
+  Field("sharpness", integer, between(-100, 100), hot=True),
+  Field("contrast", integer, between(-100, 100), hot=True),
+  Field("brightness", integer, between(0, 100), hot=True),
+  Field("iso", integer, isoValue, hot=True),
+  Field("exposure_mode", string, choice("off", "auto", "night", "nightpreview", "backlight", "spotlight", "sports",
+                                        "snow", "beach", "verylong", "fixedfps", "antishake", "fireworks"), hot=True),
+  Field("drc", string, choice("off", "low", "medium", "high"), hot=True),
+  Field("shutter_speed", integer, atLeast(0)),
+  Field("camera_idle_timeout", number, hot=True),
+  Field("camera_warmup", number, atLeast(0), hot=True),
+  Field("led_delay_on", number, atLeast(0), hot=True),
+  Field("led_delay_off", number, atLeast(0), hot=True),
+  Field("led_pin_output", integer, between(0, 27)),
+  Field("signal_pin_input", integer, between(0, 27)),
+  Field("trigger_bouncetime", integer, atLeast(0)),
+  Field("state_red", integer, between(0, 27)),
+  Field("state_green", integer, between(0, 27)),
+  Field("time_green_led_out_of_time", number, positive, hot=True),
+  Field("time_green_led_waiting_slave", number, positive, hot=True),
+  Field("time_red_led", number, positive, hot=True),
+  Field("time_between_flashes", number, atLeast(0), hot=True),
+  Field("time_of_each_flash", number, positive, hot=True),
+  Field("num_flashes_green_led_out_of_time", integer, atLeast(0), hot=True),
+  Field("num_flashes_green_led_waiting_slave", integer, atLeast(0), hot=True),
+  Field("num_flashes_red_led", integer, atLeast(0), hot=True),
+  Field("memory_threshold", number, atLeast(0), hot=True),
+  Field("storage_resync_frames", integer, positive, hot=True),
+  Field("adaptive_policy", boolean, hot=True),
+  Field("capture_levels", captureLevels),
+  Field("policy_margin", number, atLeast(1), hot=True),
+  Field("sensor_log", boolean),
+  Field("sensor_interval", number, positive, hot=True),
+  Field("sensors", sensorList),
+  Field("exposure_predictor", boolean),
+  Field("exposure_target", number, between(1, 254), hot=True),
+  Field("exposure_shutter_min", integer, positive, hot=True),
+  Field("exposure_shutter_max", integer, positive, hot=True),
+  Field("exposure_led_delay_on", number, atLeast(0), hot=True),
+  Field("resume_mission", boolean),
+  Field("state_save_frames", integer, positive, hot=True),
+  Field("state_save_interval", number, positive, hot=True),
+  Field("dedup", boolean),
+  Field("dedup_preview_width", integer, between(16, 640)),
+  Field("dedup_preview_height", integer, between(16, 480)),
+  Field("dedup_threshold", number, atLeast(0), hot=True),
+  Field("dedup_history", integer, positive),
+  Field("dedup_keep_every", integer, positive, hot=True),
+  Field("dedup_contrast_floor", number, atLeast(0), hot=True),
+  Field("pipeline_writer", boolean),
+  Field("writer_queue_size", integer, positive),
+  Field("writer_fsync_frames", integer, positive),
+  Field("storage_backend", string, choice("files", "segments")),
+  Field("segment_size", integer, positive),
+  Field("process_split", boolean),
+  Field("housekeeping_timeout", number, positive),
+  Field("housekeeping_backlog", integer, positive),
+  Field("process_restart_delay", number, atLeast(0)),
+  Field("max_temp", number, hot=True),
+  Field("min_temp", number, hot=True),
+  Field("temp_sample_interval", number, positive, hot=True),
+  Field("temp_buffer_size", integer, positive),
+  Field("temp_smoothing", integer, positive, hot=True),
+  Field("temp_max_age", number, positive, hot=True),
+]
+
+class CameraConfig(Config):
+  """ Hardware and timing settings (camera_config.yaml) """
+  __slots__ = tuple(field.name for field in CAMERA_FIELDS)
+  FIELDS = CAMERA_FIELDS
+  CHECKS = [ordered("exposure_shutter_min", "exposure_shutter_max"), ordered("min_temp", "max_temp", strict=True)]
+
+class ConfigWatcher(object):
+  """ Tells when configuration files have been modified, looking at their mtime every interval seconds """
+
+  def __init__(self, filenames, interval=30, clock=None):
+    self.filenames = filenames
+    self.interval = interval
+    self.clock = clock if clock is not None else SystemClock()
+    self.stamps = self._stamps()
+    self.last_check = self.clock.monotonic()
+
+  def _stamps(self):
+    stamps = []
+    for filename in self.filenames:
+      try:
+        st = os.stat(filename)
+        stamps.append((st.st_mtime, st.st_size))
+      except OSError:
+        stamps.append(None)
+    return stamps
+
+  def changed(self):
+    """ True once after any of the files changed. Costs nothing until interval has passed """
+    if self.clock.monotonic() - self.last_check < self.interval:
+      return False
+    self.last_check = self.clock.monotonic()
+    stamps = self._stamps()
+    if stamps == self.stamps:
+      return False
+    self.stamps = stamps
+    return True
@@ -0,0 +1,135 @@
+# Shared fixtures of the behaviour tests: a GliderCamera running the real
+# control loops against the simulated hardware of sim/ on a virtual clock,
+# in a temporary mission directory.
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmark import writeConfig
+from camera import GliderCamera
+from frame_index import FrameIndex
+from sim.camera import SimulatedCamera
+from sim.clock import VirtualClock
+from sim.gpio import SimulatedGPIO
+from sim.sensor import SimulatedMCP9808, LazyTemperatureSampler
+from sim.trigger import PulseTrain, VirtualTrigger
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+START = datetime(2020, 1, 1, 12, 0)
+
+# Settings of every test mission: no background thread on the virtual clock, no wait on purpose and
+# nothing that depends on the free space of the machine
+MISSION = {"mission_name": "test", "config_reload": False, "schedule_report_frames": 0, "instrumentation": False,
+           "start_date": START.strftime("%d/%m/%Y %H:%M"),
+           "end_date": (START + timedelta(hours=1)).strftime("%d/%m/%Y %H:%M")}
+CAMERA = {"memory_threshold": 0, "adaptive_policy": False, "sensor_log": False, "dedup": False,
+          "exposure_predictor": False, "camera_idle_timeout": -1, "camera_warmup": 0, "led_delay_on": 0,
+          "led_delay_off": 0, "pipeline_writer": False, "process_split": False, "storage_backend": "files"}
+
+class Stop(Exception):
+  """ Ends a test mission: the end date, or a power cut asked for by the test """
+
+class TestCamera(GliderCamera):
+  """ GliderCamera on the simulated hardware of a Mission
+
+  The temperature is sampled when asked for and the state LEDs are only
+  posted, so nothing runs behind the virtual clock. power_cut(camera) is
+  called after every checkpoint: when it returns True the mission stops
+  there, as if the power went, and nothing else is written.
+  """
+
+  __test__ = False # not a test class for pytest
+
+  def __init__(self, mission, power_cut=None):
+    self.mission = mission
+    self.power_cut = power_cut
+    GliderCamera.__init__(self, "config.yaml", "camera_config.yaml", gpio=mission.gpio,
+                          camera_factory=lambda: mission.camera, temp_sensor=mission.sensor, clock=mission.clock)
+
+  def startSensor(self):
+    GliderCamera.startSensor(self)
+    c = self.camera_config
+    self.temp_sampler = LazyTemperatureSampler(self.temp_sensor, c.temp_sample_interval, c.temp_buffer_size,
+                                               c.temp_max_age, c.temp_smoothing, clock=self.clock)
+
+  def startThreads(self):
+    self.temp_sampler.start()
+
+  def startTrigger(self):
+    until = time.mktime(self.end_date.timetuple())
+    return VirtualTrigger(self.gpio, self.signal_input, self.mission.pulses, self.clock, until=until)
+
+  def checkpoint(self, force=False):
+    GliderCamera.checkpoint(self, force)
+    if self.power_cut is not None and self.power_cut(self):
+      raise Stop("power cut")
+
+  def shutdown(self):
+    raise Stop("end date")
+
+  def runMission(self):
+    """ Runs the mission until it stops and returns why ("end date" or "power cut") """
+    try:
+      self.run()
+    except Stop, err:
+      return str(err)
+
+  def __del__(self):
+    pass # stopped missions are closed with close(), power cuts are not closed at all
+
+  def close(self):
+    self.power_cut = None # the last checkpoint is written
+    GliderCamera.__del__(self)
+
+class Mission(object):
+  """ Temporary mission directory with its configuration files and the simulated hardware """
+
+  def __init__(self, path):
+    self.path = path
+    self.clock = VirtualClock(START)
+    self.camera = SimulatedCamera(self.clock, capture_time=0.1, frame_bytes=1000, frame_bytes_sd=0,
+                                  write_files=True)
+    self.sensor = SimulatedMCP9808(self.clock, mean=20.0, swing=0.0)
+    self.pulses = PulseTrain(self.clock.monotonic(), times=[])
+    self.configure()
+
+  def configure(self, mission=None, camera=None):
+    """ Writes config.yaml and camera_config.yaml: the repository ones with the test settings and these """
+    self.mission_settings = dict(MISSION, **(mission or {}))
+    self.camera_settings = dict(CAMERA, **(camera or {}))
+    writeConfig(os.path.join(HERE, "config.yaml"), os.path.join(self.path, "config.yaml"), self.mission_settings)
+    writeConfig(os.path.join(HERE, "camera_config.yaml"), os.path.join(self.path, "camera_config.yaml"),
+                self.camera_settings)
+
+  def reconfigure(self, mission=None, camera=None):
+    """ Rewrites the configuration files with these changes, as an operator would during the mission """
+    self.configure(dict(self.mission_settings, **(mission or {})), dict(self.camera_settings, **(camera or {})))
+    stamp = self.clock.time() + 10 # a new mtime even within the resolution of the file system
+    for name in ("config.yaml", "camera_config.yaml"):
+      os.utime(os.path.join(self.path, name), (stamp, stamp))
+
+  def pulseAt(self, *seconds):
+    """ Glider pulses at these seconds from now """
+    now = self.clock.monotonic()
+    self.pulses = PulseTrain(now, times=[now + s for s in seconds])
+
+  def start(self, power_cut=None):
+    """ Boots the glider camera: a mission stopped by a power cut left its GPIO set up """
+    self.gpio = SimulatedGPIO(self.clock)
+    return TestCamera(self, power_cut)
+
+  def frames(self):
+    """ Records of the frame index """
+    index = FrameIndex(os.path.join(self.path, "test", "frames.idx"), readonly=True)
+    try:
+      return [index.read(i) for i in range(len(index))]
+    finally:
+      index.close()
+
+@pytest.fixture
+def mission(tmpdir, monkeypatch):
+  """ Mission in a temporary directory, which is the working directory of the test """
+  monkeypatch.chdir(tmpdir)
+  return Mission(str(tmpdir))
@@ -0,0 +1,74 @@
+# NumPy is optional: it is only needed when near-duplicate suppression is on
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+def lumaPlane(yuv, width, height):
+  """ Y plane of a YUV420 capture of width x height as a height x width uint8 array """
+  # picamera pads the planes to a width multiple of 32 and a height multiple of 16
+  stride = (width + 31) // 32 * 32
+  rows = (height + 15) // 16 * 16
+  y = np.frombuffer(yuv, dtype=np.uint8, count=stride * rows).reshape(rows, stride)
+  return y[:height, :width]
+
+class DuplicateFilter(object):
+  """ Drops frames that look like one of the last frames kept
+
+  Each frame yields a small luma preview (the Y plane of a YUV capture
+  resized by the GPU). The preview is averaged down to a signature of
+  (width / block) x (height / block) cells and normalised to zero mean and
+  unit variance, so a change of brightness alone does not count as a new
+  scene. The contrast is never scaled up from below contrast_floor luma
+  levels, or the sensor noise of a flat scene (open water) would come out
+  as a whole new scene at every frame. A frame is a near-duplicate when the mean absolute difference to
+  the closest of the last `history` kept signatures is under threshold; the
+  comparison against all of them is a single vectorized NumPy operation.
+  One frame in keep_every is kept anyway, so a still scene is still sampled.
+  """
+
+  def __init__(self, width=64, height=48, threshold=0.15, history=8, keep_every=30, block=4, contrast_floor=8.0):
+    if np is None:
+      raise RuntimeError("Near-duplicate suppression needs NumPy")
+    if width % block or height % block:
+      raise ValueError("The preview size must be a multiple of the block size")
+    self.width = width
+    self.height = height
+    self.threshold = threshold
+    self.keep_every = keep_every
+    self.block = block
+    self.contrast_floor = contrast_floor
+    cells = (width // block) * (height // block)
+    self.signatures = np.zeros((history, cells), dtype=np.float32)
+    self.stored = 0
+    self.next_slot = 0
+    self.dropped_in_row = 0
+    self.kept = 0
+    self.dropped = 0
+
+  def signature(self, yuv):
+    """ Signature of a YUV420 preview of width x height (only the Y plane is used) """
+    y = lumaPlane(yuv, self.width, self.height).astype(np.float32)
+    b = self.block
+    cells = y.reshape(self.height // b, b, self.width // b, b).mean(axis=(1, 3)).ravel()
+    return (cells - cells.mean()) / max(cells.std(), self.contrast_floor, 1e-3)
+
+  def check(self, yuv):
+    """ Returns (keep, distance to the closest recent signature) and remembers the frame if it is kept """
+    sig = self.signature(yuv)
+    distance = None
+    if self.stored:
+      distance = float(np.abs(self.signatures[:self.stored] - sig).mean(axis=1).min())
+      if distance < self.threshold and self.dropped_in_row + 1 < self.keep_every:
+        self.dropped_in_row += 1
+        self.dropped += 1
+        return False, distance
+    self.signatures[self.next_slot] = sig
+    self.next_slot = (self.next_slot + 1) % len(self.signatures)
+    self.stored = min(self.stored + 1, len(self.signatures))
+    self.dropped_in_row = 0
+    self.kept += 1
+    return True, distance
+
+  def report(self):
+    return "Duplicates: %d frames kept, %d near-duplicates dropped" % (self.kept, self.dropped)
@@ -0,0 +1,75 @@
+from dedup import np, lumaPlane
+
+# ISO steps of the camera
+ISO_STEPS = (100, 200, 320, 400, 500, 640, 800)
+
+class ExposurePredictor(object):
+  """ Predicts the shutter speed and ISO of the next frame from the luma histogram of the last one
+
+  With the auto exposure on, the LED has to stay lit while the camera
+  settles on every frame. Here the exposure is fixed (exposure_mode 'off')
+  and after each frame a small preview taken under the LED is analysed: its
+  256-bin luma histogram gives the mean level and the level under which all
+  but clip_fraction of the pixels lie. The exposure (shutter x gain) is
+  scaled to bring the mean to target, less if that would push the
+  highlights over `highlight`, and damped in the log domain so a single odd
+  frame cannot make it oscillate. The shutter takes the change: with the
+  exposure fixed the gains are frozen, and a new ISO only reaches them
+  after the auto exposure has run again (see GliderCamera.applyExposure).
+  The ISO moves to the step that brings the shutter back in range only once
+  the shutter is at one of its limits.
+  """
+
+  def __init__(self, shutter=3800, iso=375, width=64, height=48, target=110, highlight=245, clip_fraction=0.005,
+               shutter_range=(500, 30000), iso_range=(100, 800), damping=0.6, max_step=8.0):
+    if np is None:
+      raise RuntimeError("Exposure prediction needs NumPy")
+    self.shutter = shutter
+    self.iso = iso
+    self.width = width
+    self.height = height
+    self.target = target
+    self.highlight = highlight
+    self.clip_fraction = clip_fraction
+    self.shutter_range = shutter_range
+    self.iso_range = iso_range
+    self.damping = damping
+    self.max_step = max_step
+    self.levels = np.arange(256)
+    self.mean = None
+    self.bright = None
+    self.updates = 0
+
+  def analyse(self, yuv):
+    """ (mean luma, luma level under which all but clip_fraction of the pixels lie) of a YUV420 preview """
+    y = lumaPlane(yuv, self.width, self.height)
+    hist = np.bincount(y.ravel(), minlength=256)
+    n = float(y.size)
+    mean = float((hist * self.levels).sum()) / n
+    bright = int(np.searchsorted(np.cumsum(hist), n * (1 - self.clip_fraction)))
+    return mean, bright
+
+  def update(self, yuv):
+    """ Analyses a preview taken with the current settings and returns the (shutter, iso) for the next frame """
+    self.mean, self.bright = self.analyse(yuv)
+    ratio = self.target / max(self.mean, 1.0)
+    if self.bright * ratio > self.highlight:
+      ratio = self.highlight / float(max(self.bright, 1))
+    ratio = min(max(ratio ** self.damping, 1.0 / self.max_step), self.max_step)
+    exposure = self.shutter * self.iso * ratio
+    lo, hi = self.shutter_range
+    if not lo <= exposure / self.iso <= hi:
+      steps = [iso for iso in ISO_STEPS if self.iso_range[0] <= iso <= self.iso_range[1]]
+      fitting = [iso for iso in steps if lo <= exposure / iso <= hi]
+      if fitting:
+        self.iso = fitting[0] if exposure / self.iso > hi else fitting[-1]
+      else:
+        self.iso = steps[-1] if exposure / self.iso > hi else steps[0]
+    self.shutter = int(min(max(exposure / self.iso, lo), hi))
+    self.updates += 1
+    return self.shutter, self.iso
+
+  def report(self):
+    return "Exposure: shutter %dus, ISO %d, last preview mean %s, highlights %s, %d updates" % (
+           self.shutter, self.iso, "%.1f" % self.mean if self.mean is not None else "n/a",
+           self.bright if self.bright is not None else "n/a", self.updates)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# One fixed-size record per saved frame, appended in capture order:
+#   sequence (u64), monotonic time (f64), wall time (f64, unix seconds),
+#   temperature (f32, NaN if unknown), size in bytes (u32),
+#   path relative to the mission directory (48 bytes, NUL padded)
+RECORD = struct.Struct("<QddfI48s")
+HEADER = struct.Struct("<8sI")
+MAGIC = "GCFIDX01"
+
+FrameRecord = namedtuple("FrameRecord", "seq monotonic wall temperature size path")
+
+def packRecord(record):
+  temperature = float("nan") if record.temperature is None else record.temperature
+  return RECORD.pack(record.seq, record.monotonic, record.wall, temperature, record.size, record.path)
+
+def unpackRecord(data):
+  seq, monotonic, wall, temperature, size, path = RECORD.unpack(data)
+  if temperature != temperature:
+    temperature = None
+  return FrameRecord(seq, monotonic, wall, temperature, size, path.rstrip("\0"))
+
+def shardPath(seq, wall):
+  """ Path of a frame relative to the mission directory: one directory per day and one per hour """
+  t = time.localtime(wall)
+  return "%s/%s/img-%s-%06d.jpg" % (time.strftime("%Y%m%d", t), time.strftime("%H", t),
+                                    time.strftime("%Y%m%d-%H%M%S", t), seq)
+
+class FrameIndex(object):
+  """ Append-only index of the frames of a mission
+
+  Frames are stored in <mission>/YYYYmmdd/HH/ shards so no directory grows
+  past a few hundred files, and every saved frame appends one RECORD to the
+  index file. Records are in capture order, so sequence numbers and
+  (as long as the wall clock is not set backwards) wall times are sorted and
+  lookups are binary searches over the file, without walking the tree. A
+  record torn by a power cut is dropped when the index is reopened.
+  """
+
+  def __init__(self, filename, sync_every=10, readonly=False):
+    self.filename = filename
+    self.sync_every = sync_every
+    self.lock = threading.Lock()
+    self.unsynced = 0
+    exists = os.path.exists(filename) and os.path.getsize(filename) >= HEADER.size
+    if readonly:
+      self.file = open(filename, "rb")
+    else:
+      self.file = open(filename, "r+b" if exists else "w+b")
+    if exists:
+      magic, record_size = HEADER.unpack(self.file.read(HEADER.size))
+      if magic != MAGIC or record_size != RECORD.size:
+        raise ValueError("%s is not a frame index" % filename)
+      self.count = (os.path.getsize(filename) - HEADER.size) // RECORD.size
+      if not readonly:
+        self.file.truncate(HEADER.size + self.count * RECORD.size)
+    else:
+      self.file.write(HEADER.pack(MAGIC, RECORD.size))
+      self.file.flush()
+      self.count = 0
+    self.next_seq = self.read(self.count - 1).seq + 1 if self.count > 0 else 0
+
+  def reserve(self):
+    """ Returns a new sequence number for a frame about to be captured """
+    with self.lock:
+      seq = self.next_seq
+      self.next_seq += 1
+      return seq
+
+  def newFrame(self, monotonic, wall, temperature=None):
+    """ Reserves a sequence number and returns the record of a frame to be captured (size still 0) """
+    seq = self.reserve()
+    return FrameRecord(seq, monotonic, wall, temperature, 0, shardPath(seq, wall))
+
+  def append(self, record):
+    """ Appends the record of a saved frame """
+    data = packRecord(record)
+    with self.lock:
+      self.file.seek(0, os.SEEK_END)
+      self.file.write(data)
+      self.file.flush()
+      self.count += 1
+      self.unsynced += 1
+      if self.unsynced >= self.sync_every:
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+  def refresh(self):
+    """ Picks up the records appended since the index was opened (by the camera, for a read only index) """
+    with self.lock:
+      count = (os.fstat(self.file.fileno()).st_size - HEADER.size) // RECORD.size
+    if count > self.count:
+      self.count = count
+      self.next_seq = self.read(count - 1).seq + 1
+
+  def __len__(self):
+    return self.count
+
+  def read(self, i):
+    """ Returns the i-th record of the index """
+    with self.lock:
+      self.file.seek(HEADER.size + i * RECORD.size)
+      data = self.file.read(RECORD.size)
+    return unpackRecord(data)
+
+  def _bisect(self, key, value):
+    lo, hi = 0, self.count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if key(self.read(mid)) < value:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  def get(self, seq):
+    """ Record of the frame with sequence number seq, or None """
+    i = self._bisect(lambda r: r.seq, seq)
+    if i < self.count:
+      record = self.read(i)
+      if record.seq == seq:
+        return record
+    return None
+
+  def since(self, seq, limit=None):
+    """ Records with a sequence number greater or equal than seq """
+    i = self._bisect(lambda r: r.seq, seq)
+    end = self.count if limit is None else min(self.count, i + limit)
+    for j in range(i, end):
+      yield self.read(j)
+
+  def between(self, t1, t2):
+    """ Records of the frames taken between the wall times t1 (included) and t2 (excluded) """
+    i = self._bisect(lambda r: r.wall, t1)
+    while i < self.count:
+      record = self.read(i)
+      if record.wall >= t2:
+        return
+      yield record
+      i += 1
+
+  def close(self):
+    with self.lock:
+      if "+" in self.file.mode:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+      self.file.close()
+
+if __name__ == "__main__":
+  import argparse
+  from datetime import datetime
+  def parseDate(text):
+    return time.mktime(datetime.strptime(text, "%d/%m/%Y %H:%M").timetuple())
+  parser = argparse.ArgumentParser(description="Lists the frames of a mission index")
+  parser.add_argument("index", help="frame index file (<mission>/frames.idx)")
+  parser.add_argument("--from", dest="start", type=parseDate, default=0, help="dd/mm/YYYY HH:MM")
+  parser.add_argument("--to", dest="end", type=parseDate, default=float("inf"), help="dd/mm/YYYY HH:MM")
+  args = parser.parse_args()
+  index = FrameIndex(args.index, readonly=True)
+  for r in index.between(args.start, args.end):
+    print "%8d %s %7s %9d %s" % (r.seq, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r.wall)),
+                                 "%.2f" % r.temperature if r.temperature is not None else "n/a", r.size, r.path)
@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+# Split of the mission in two processes (process_split in camera_config.yaml):
+#
+#   capture process:      trigger -> temperature gate -> LED -> expose ->
+#                         hand the encoded frame over a socket
+#   housekeeping process: write (files or segments), index, storage
+#                         accounting, memory LED
+#
+# Each frame crosses the socket as its index record (frame_index.RECORD,
+# size = length of the data) followed by the data. The housekeeping process
+# answers with one STATUS per frame once it is written (or failed), carrying
+# the storage figures the adaptive policy of the capture process needs.
+# Frames stay in the memory of the capture process until they are confirmed:
+# if the housekeeping process dies or stops answering it is restarted and
+# the unconfirmed frames are sent again; those already indexed are skipped.
+# The capture process itself is run under supervise(), which starts it again
+# (resuming from its checkpoint) if it dies.
+import fcntl
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+import threading
+from collections import OrderedDict, deque
+
+from clock import SystemClock
+from frame_index import RECORD, FrameIndex, packRecord, unpackRecord
+
+# camera_config.yaml settings the housekeeping process reads when it starts
+HOUSEKEEPING_SETTINGS = ("memory_threshold", "storage_resync_frames", "storage_backend", "segment_size",
+                         "writer_queue_size", "writer_fsync_frames", "state_red", "num_flashes_red_led",
+                         "time_of_each_flash", "time_between_flashes", "time_red_led")
+
+# kind (HELLO, SAVED, FAILED), sequence number (of the frame, or the next one to
+# index for HELLO), size, free bytes, frames, bytes written, bytes per frame (0: unknown)
+STATUS = struct.Struct("<BQIqQQd")
+HELLO = 0
+SAVED = 1
+FAILED = 2
+
+def recvExactly(sock, n):
+  """ Reads n bytes from sock, or returns None at the end of the stream """
+  chunks = []
+  while n > 0:
+    try:
+      chunk = sock.recv(min(n, 1 << 20))
+    except socket.error:
+      return None
+    if not chunk:
+      return None
+    chunks.append(chunk)
+    n -= len(chunk)
+  return "".join(chunks)
+
+def openIndex(path, timeout):
+  """ Opens the frame index of the mission read only for the capture process of a split mission. It waits
+  (up to timeout seconds) for the housekeeping lock, so a process left by a previous capture process has
+  appended its last frames: the next sequence number follows them. Only the housekeeping process writes
+  to the index, and only while it holds the lock """
+  filename = path + "/frames.idx"
+  lock_file = open(path + "/housekeeping.lock", "w")
+  try:
+    deadline = time.time() + timeout
+    locked = False
+    while not locked:
+      try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        locked = True
+      except IOError:
+        if time.time() > deadline:
+          print "Housekeeping lock still held after %ds: the index may grow behind the capture process" % timeout
+          break
+        time.sleep(0.1)
+    if locked or not os.path.exists(filename):
+      FrameIndex(filename).close() # creates it, or drops a record torn by a power cut
+    return FrameIndex(filename, readonly=True)
+  finally:
+    lock_file.close() # releases the lock
+
+class Housekeeping(object):
+  """ Housekeeping process: writes, indexes and accounts for the frames received from the capture process """
+
+  def __init__(self, sock, path, camera_config, storage_state=None):
+    # Imported here so the capture process does not load what it does not use
+    from storage import StorageBudget
+    from writer import FrameWriter
+    from segments import SegmentArchive
+    from leds import LedEngine, BlinkPattern
+    self.sock = sock
+    self.path = path
+    c = camera_config
+    # a restarted process waits for the previous one to flush its queue
+    self.lock_file = open(path + "/housekeeping.lock", "w")
+    fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+    self.index = FrameIndex(path + "/frames.idx")
+    self.first_seq = self.index.next_seq
+    self.storage = StorageBudget(path, c.memory_threshold, resync_frames=c.storage_resync_frames)
+    if storage_state is not None:
+      self.storage.restore(storage_state)
+    self.segments = None
+    if c.storage_backend == "segments":
+      self.segments = SegmentArchive(path + "/segments", c.segment_size * 1000000, c.writer_fsync_frames)
+    self.writer = FrameWriter(c.writer_queue_size, c.writer_fsync_frames, on_written=self.saved,
+                              on_failed=self.failed, sink=self.segments)
+    self.send_lock = threading.Lock() # statuses are sent from the main and the writer threads
+    self.gpio = None
+    self.leds = None
+    try:
+      import RPi.GPIO as GPIO
+    except (ImportError, RuntimeError):
+      GPIO = None
+    if GPIO is not None:
+      GPIO.setmode(GPIO.BCM)
+      GPIO.setwarnings(False)
+      self.gpio = GPIO
+      self.led_state_red = c.state_red
+      self.pattern_memory_alarm = BlinkPattern(c.num_flashes_red_led, c.time_of_each_flash,
+                                               c.time_between_flashes, c.time_red_led)
+      self.leds = LedEngine(GPIO)
+      self.leds.start()
+    self.received = 0
+    self.skipped = 0
+
+  def send(self, kind, seq, size=0):
+    state = self.storage.state()
+    try:
+      with self.send_lock:
+        self.sock.sendall(STATUS.pack(kind, seq, size, self.storage.freeBytes(), state["frames"],
+                                      state["bytes_written"], state["bytes_per_frame"] or 0.0))
+    except socket.error:
+      pass # the capture process is gone: the frames already received are written anyway
+
+  def saved(self, filename, size, record):
+    self.index.append(record._replace(size=size))
+    self.storage.add(size)
+    self.indicateMemory()
+    self.send(SAVED, record.seq, size)
+
+  def failed(self, filename, record):
+    self.send(FAILED, record.seq)
+
+  def indicateMemory(self):
+    """ Red led flashing sets while the free space is under the memory threshold """
+    if self.leds is None:
+      return
+    if self.storage.aboveThreshold():
+      self.leds.clear(self.led_state_red)
+    else:
+      self.leds.show(self.led_state_red, self.pattern_memory_alarm)
+
+  def run(self):
+    """ Takes frames until the capture process closes its end, then flushes everything """
+    self.send(HELLO, self.first_seq)
+    while True:
+      header = recvExactly(self.sock, RECORD.size)
+      if header is None:
+        break
+      record = unpackRecord(header)
+      data = recvExactly(self.sock, record.size)
+      if data is None:
+        break
+      self.received += 1
+      if record.seq < self.first_seq:
+        # sent again after a restart, but already indexed by the previous process
+        self.skipped += 1
+        self.send(SAVED, record.seq, record.size)
+        continue
+      self.writer.put(self.path + "/" + record.path, data, record)
+    self.writer.close()
+    if self.segments is not None:
+      self.segments.close()
+    self.index.close()
+    if self.leds is not None:
+      self.leds.stop()
+      self.gpio.output(self.led_state_red, 0)
+    print "Housekeeping: %d frames received, %d already saved. %s" % (self.received, self.skipped, self.writer.report())
+    sys.stdout.flush()
+
+class Housekeeper(object):
+  """ Capture side of the housekeeping process: hands frames over and restarts the process when it fails
+
+  put() only queues a frame and returns. A sender thread passes the queued
+  frames on to the housekeeping process (at most queue_size + 1 outstanding,
+  as with the in-process writer) and takes its statuses. A process that
+  exited, or did not answer for timeout seconds while it had frames, is
+  killed and started again, at most once every restart_delay seconds. Up to
+  backlog frames wait in memory to be sent (the oldest ones are dropped past
+  that), so acquisition never waits for the housekeeping process.
+  """
+
+  def __init__(self, path, camera_config_filename, queue_size=8, timeout=60, restart_delay=10, backlog=64,
+               on_status=None, clock=None):
+    self.path = path
+    self.camera_config_filename = camera_config_filename
+    self.queue_size = queue_size
+    self.timeout = timeout
+    self.restart_delay = restart_delay
+    self.backlog = backlog
+    self.on_status = on_status # on_status(free, storage state) with the figures of every status, from the sender thread
+    self.clock = clock if clock is not None else SystemClock()
+    self.storage_state = None
+    self.next_seq = None
+    self.proc = None
+    self.sock = None
+    self.buffer = ""
+    self.lock = threading.Lock() # unacked and queue are shared by put() and the sender thread
+    self.unacked = OrderedDict() # seq -> (record, data), in capture order
+    self.queue = deque() # seqs of the unacked frames the running process has not been sent
+    self.sent = 0 # frames the running process has been sent and not confirmed
+    self.last_start = None
+    self.last_answer = None
+    self.thread = None
+    self.wake_r = self.wake_w = None
+    self.starts = 0
+    self.failures = 0
+    self.saved = 0
+    self.failed = 0
+    self.lost = 0
+    self.wait_time = 0.0
+    self.closing = False
+    self.close_restarted = False
+
+  def start(self, storage_state=None):
+    """ Starts the housekeeping process and the sender thread. Returns False if the process did not come up
+    (the sender thread starts it again) """
+    self.wake_r, self.wake_w = os.pipe()
+    flags = fcntl.fcntl(self.wake_w, fcntl.F_GETFL)
+    fcntl.fcntl(self.wake_w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    started = self._start(storage_state, hello=True)
+    self.thread = threading.Thread(target=self._run, name="Housekeeper")
+    self.thread.daemon = True
+    self.thread.start()
+    return started
+
+  def _start(self, storage_state=None, hello=False):
+    """ Starts the process; with hello, waits for its HELLO. The frames it has to be sent are already queued """
+    if storage_state is not None:
+      self.storage_state = storage_state
+    self.last_start = self.clock.monotonic()
+    self.starts += 1
+    ours, theirs = socket.socketpair()
+    args = [sys.executable, os.path.abspath(__file__), self.path, self.camera_config_filename]
+    if self.storage_state is not None:
+      args += ["--storage", json.dumps(self.storage_state)]
+    self.proc = subprocess.Popen(args, stdin=theirs, close_fds=True)
+    theirs.close()
+    ours.settimeout(self.timeout) # a send to a process that stopped reading fails instead of hanging
+    self.sock = ours
+    self.buffer = ""
+    self.sent = 0
+    self.next_seq = None
+    self.last_answer = self.last_start
+    if hello and not self._receive(self.timeout, hello=True):
+      self._down("no answer after starting")
+      return False
+    return True
+
+  def put(self, record, data):
+    """ Queues a frame for the sender thread. Returns the seconds spent """
+    start = self.clock.monotonic()
+    dropped = []
+    with self.lock:
+      self.unacked[record.seq] = (record, data)
+      self.queue.append(record.seq)
+      while len(self.queue) > self.backlog:
+        seq = self.queue.popleft()
+        del self.unacked[seq]
+        dropped.append(seq)
+    self._wake()
+    for seq in dropped:
+      self.lost += 1
+      print "Housekeeping process behind: frame %d dropped from the backlog" % seq
+    waited = self.clock.monotonic() - start
+    self.wait_time += waited
+    return waited
+
+  def _wake(self):
+    try:
+      os.write(self.wake_w, "x")
+    except OSError:
+      pass # already woken up
+
+  def _wait(self, timeout):
+    """ Sleeps until the process sends something, put() queues a frame or timeout seconds (None: no limit) """
+    ready, _, _ = select.select([self.wake_r] + ([self.sock] if self.sock is not None else []), [], [], timeout)
+    if self.wake_r in ready:
+      os.read(self.wake_r, 4096)
+
+  def _run(self):
+    """ Sender thread: sends the queued frames, takes the statuses and restarts the process when it fails """
+    while True:
+      if self.sock is None:
+        with self.lock:
+          pending = bool(self.unacked)
+        if self.closing and (not pending or self.close_restarted):
+          return
+        if self.closing:
+          self.close_restarted = True # once, without waiting for restart_delay
+          self._start()
+        elif pending and self.clock.monotonic() - self.last_start >= self.restart_delay:
+          self._start()
+        else:
+          self._wait(max(0, self.last_start + self.restart_delay - self.clock.monotonic()) if pending else None)
+        continue
+      self._receive(0)
+      if self.sock is not None and self.proc.poll() is not None:
+        self._down("exited with code %s" % self.proc.returncode)
+      if self.sock is None:
+        continue
+      item = None
+      with self.lock:
+        if self.queue and self.sent <= self.queue_size:
+          item = self.unacked.get(self.queue.popleft())
+      if item is not None:
+        self._send(*item)
+      elif self.sent and self.clock.monotonic() - self.last_answer > self.timeout:
+        self._down("no answer for %ds" % self.timeout)
+      elif self.closing and not self.unacked:
+        self._finish()
+        return
+      else:
+        self._wait(max(0, self.last_answer + self.timeout - self.clock.monotonic()) if self.sent else None)
+
+  def _send(self, record, data):
+    try:
+      self.sock.sendall(packRecord(record._replace(size=len(data))))
+      self.sock.sendall(data)
+    except socket.error, err:
+      self._down("send failed: %s" % err)
+      return False
+    self.sent += 1
+    return True
+
+  def _receive(self, timeout, hello=False):
+    """ Reads what the process sent within timeout seconds. With hello, waits for its HELLO.
+    Returns False on timeout (for a wait) or when the process is gone """
+    waiting = timeout > 0
+    deadline = self.clock.monotonic() + timeout
+    while True:
+      ready, _, _ = select.select([self.sock], [], [], max(0, deadline - self.clock.monotonic()))
+      if not ready:
+        return not waiting
+      try:
+        chunk = self.sock.recv(65536)
+      except socket.error:
+        chunk = ""
+      if not chunk:
+        self._down("exited with code %s" % self.proc.wait())
+        return False
+      self.buffer += chunk
+      got = False
+      while len(self.buffer) >= STATUS.size:
+        self._status(*STATUS.unpack(self.buffer[:STATUS.size]))
+        self.buffer = self.buffer[STATUS.size:]
+        got = True
+      if got and (not hello or self.next_seq is not None):
+        return True
+      if not waiting:
+        return True
+
+  def _status(self, kind, seq, size, free, frames, bytes_written, bytes_per_frame):
+    state = {"frames": frames, "bytes_written": bytes_written, "bytes_per_frame": bytes_per_frame or None}
+    self.storage_state = state
+    self.last_answer = self.clock.monotonic()
+    if kind == HELLO:
+      self.next_seq = seq
+    else:
+      with self.lock:
+        item = self.unacked.pop(seq, None)
+      if item is not None:
+        self.sent -= 1
+        if kind == SAVED:
+          self.saved += 1
+        else:
+          self.failed += 1
+    if self.on_status is not None:
+      self.on_status(free, state)
+
+  def _down(self, reason):
+    with self.lock:
+      if not self.closing or self.unacked:
+        self.failures += 1
+        print "Housekeeping process down (%s), %d frames waiting" % (reason, len(self.unacked))
+      self.queue = deque(self.unacked) # the next process is sent every unconfirmed frame
+    try:
+      self.sock.close()
+    except socket.error:
+      pass
+    if self.proc.poll() is None:
+      self.proc.kill()
+      self.proc.wait()
+    self.sock = None
+    self.sent = 0
+
+  def _finish(self):
+    """ Every frame is confirmed: lets the process flush and waits for it to exit """
+    self.sock.shutdown(socket.SHUT_WR)
+    while self.sock is not None and self._receive(self.timeout):
+      pass
+    if self.sock is not None:
+      self._down("no answer for %ds" % self.timeout)
+
+  def depth(self):
+    """ Frames handed over and not confirmed yet """
+    return len(self.unacked)
+
+  def close(self):
+    """ Lets the process write every frame it has been handed, then waits for it and the sender thread to end """
+    if self.thread is None:
+      return
+    self.closing = True
+    self._wake()
+    self.thread.join()
+    self.thread = None
+    os.close(self.wake_r)
+    os.close(self.wake_w)
+    if self.unacked:
+      print "Housekeeping: %d frames not saved" % len(self.unacked)
+
+  def report(self):
+    """ One line summary, meant for mission_info.log """
+    return ("Housekeeping: %d frames saved, %d failed, %d waiting, %d dropped, %.3fs waited, "
+            "%d starts, %d failures" % (self.saved, self.failed, len(self.unacked), self.lost,
+                                        self.wait_time, self.starts, self.failures))
+
+def supervise(target, restart_delay=10):
+  """ Runs target() in a child process, started again restart_delay seconds after it dies.
+  A clean exit (or ctrl C) ends the supervision """
+  import multiprocessing
+  starts = 0
+  while True:
+    starts += 1
+    proc = multiprocessing.Process(target=target, name="capture")
+    proc.start()
+    try:
+      proc.join()
+    except KeyboardInterrupt:
+      proc.join() # the child got the interrupt too
+      return
+    if proc.exitcode == 0:
+      return
+    print "Capture process died (exit code %s, start %d), starting it again in %ss" % (proc.exitcode, starts, restart_delay)
+    sys.stdout.flush()
+    time.sleep(restart_delay)
+
+if __name__ == "__main__":
+  import argparse
+  from config import CameraConfig
+  parser = argparse.ArgumentParser(description="Housekeeping process, started by the camera (see Housekeeper)")
+  parser.add_argument("path", help="mission directory")
+  parser.add_argument("camera_config", help="camera configuration file")
+  parser.add_argument("--storage", help="storage accounting to carry on (JSON)")
+  args = parser.parse_args()
+  signal.signal(signal.SIGINT, signal.SIG_IGN) # stopped by the capture process closing its end
+  sock = socket.fromfd(0, socket.AF_UNIX, socket.SOCK_STREAM)
+  state = json.loads(args.storage) if args.storage else None
+  Housekeeping(sock, args.path, CameraConfig.load(args.camera_config), state).run()
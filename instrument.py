@@ -0,0 +1,147 @@
+import math
+import os
+
+from clock import SystemClock
+
+# Histogram buckets grow by 2^(1/8) (~9%), starting at 1 microsecond
+BUCKETS_PER_OCTAVE = 8
+MIN_SECONDS = 1e-6
+_SCALE = BUCKETS_PER_OCTAVE / math.log(2)
+
+def _bucket(seconds):
+  if seconds <= MIN_SECONDS:
+    return 0
+  return int(math.log(seconds / MIN_SECONDS) * _SCALE) + 1
+
+def _bucketValue(bucket):
+  """ Upper bound of a bucket in seconds """
+  return MIN_SECONDS * 2 ** (bucket / float(BUCKETS_PER_OCTAVE))
+
+class Histogram(object):
+  """ Log-bucketed histogram of durations: constant memory, percentiles within ~9% """
+
+  def __init__(self):
+    self.counts = {}
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def add(self, seconds):
+    b = _bucket(seconds)
+    self.counts[b] = self.counts.get(b, 0) + 1
+    self.count += 1
+    self.total += seconds
+    if seconds > self.max:
+      self.max = seconds
+
+  def merge(self, other):
+    for b, n in other.counts.items():
+      self.counts[b] = self.counts.get(b, 0) + n
+    self.count += other.count
+    self.total += other.total
+    self.max = max(self.max, other.max)
+
+  def percentile(self, p):
+    if self.count == 0:
+      return 0.0
+    target = self.count * p / 100.0
+    seen = 0
+    for b in sorted(self.counts):
+      seen += self.counts[b]
+      if seen >= target:
+        return min(_bucketValue(b), self.max)
+    return self.max
+
+class _Span(object):
+  __slots__ = ("timer", "name", "start")
+
+  def __init__(self, timer, name):
+    self.timer = timer
+    self.name = name
+
+  def __enter__(self):
+    self.start = self.timer.clock.monotonic()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.timer.record(self.name, self.timer.clock.monotonic() - self.start)
+    return False
+
+class StageTimer(object):
+  """ Times the stages of the capture loop
+
+  Wrap a stage in `with timer.span("name"):`. Every interval seconds,
+  flush() rewrites the stats file with the p50/p95/max of each stage over
+  the last interval and since the start of the mission.
+  """
+
+  def __init__(self, filename, interval=600, clock=None):
+    self.filename = filename
+    self.interval = interval
+    self.clock = clock if clock is not None else SystemClock()
+    self.window = {}
+    self.totals = {}
+    self.window_start = self.clock.monotonic()
+    self.mission_start = self.window_start
+
+  def span(self, name):
+    return _Span(self, name)
+
+  def record(self, name, seconds):
+    histogram = self.window.get(name)
+    if histogram is None:
+      histogram = self.window[name] = Histogram()
+    histogram.add(seconds)
+
+  def maybeFlush(self):
+    """ Writes the stats file when the current interval is over """
+    if self.clock.monotonic() - self.window_start >= self.interval:
+      self.flush()
+
+  def flush(self):
+    now = self.clock.monotonic()
+    for name, histogram in self.window.items():
+      self.totals.setdefault(name, Histogram()).merge(histogram)
+    lines = ["# stage              window: count      p50      p95      max    total |"
+             " mission: count      p50      p95      max    total"]
+    empty = Histogram()
+    for name in sorted(self.totals):
+      w = self.window.get(name, empty)
+      t = self.totals[name]
+      lines.append("%-20s %14d %8.4f %8.4f %8.4f %8.1f | %15d %8.4f %8.4f %8.4f %8.1f" % (
+                   name, w.count, w.percentile(50), w.percentile(95), w.max, w.total,
+                   t.count, t.percentile(50), t.percentile(95), t.max, t.total))
+    lines.append("# window %.0fs, mission %.0fs (seconds)" % (now - self.window_start, now - self.mission_start))
+    # Written aside and renamed, so a reader (or a power cut) never sees a half written file
+    tmp = self.filename + ".tmp"
+    with open(tmp, "w") as f:
+      f.write("\n".join(lines) + "\n")
+    os.rename(tmp, self.filename)
+    self.window = {}
+    self.window_start = now
+
+class _NullSpan(object):
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    return False
+
+_NULL_SPAN = _NullSpan()
+
+class NullTimer(object):
+  """ Stand-in for StageTimer when the instrumentation is off: every call is a no-op """
+
+  def span(self, name):
+    return _NULL_SPAN
+
+  def record(self, name, seconds):
+    pass
+
+  def maybeFlush(self):
+    pass
+
+  def flush(self):
+    pass
@@ -0,0 +1,140 @@
+import threading
+from collections import namedtuple
+
+from clock import SystemClock
+
+class BlinkPattern(namedtuple("BlinkPattern", "flashes on off period")):
+  """ A set of `flashes` blinks lasting `on` seconds, `off` seconds apart, started again every
+  `period` seconds (None: the set is shown once) """
+
+  def levelAt(self, elapsed):
+    """ Returns (level, seconds until the level changes, or None if it never does) elapsed seconds after the start """
+    cycle = self.on + self.off
+    length = self.flashes * cycle - self.off # the set ends with the last blink
+    if self.period:
+      elapsed %= self.period
+    elif elapsed >= length:
+      return 0, None
+    if elapsed >= length:
+      return 0, self.period - elapsed
+    k = int(elapsed // cycle)
+    phase = elapsed - k * cycle
+    if phase < self.on:
+      return 1, self.on - phase
+    return 0, cycle - phase
+
+  def onTime(self, elapsed):
+    """ Seconds the LED has been lit during the first elapsed seconds of the pattern """
+    total = 0.0
+    if self.period:
+      sets = int(elapsed // self.period)
+      total += sets * self.flashes * self.on
+      elapsed -= sets * self.period
+    cycle = self.on + self.off
+    k = int(elapsed // cycle)
+    if k >= self.flashes:
+      return total + self.flashes * self.on
+    return total + k * self.on + min(elapsed - k * cycle, self.on)
+
+class LedEngine(object):
+  """ Drives the state LEDs from a background thread
+
+  The capture and trigger loops only post the pattern each LED has to show
+  (show/clear), which returns immediately; the engine thread switches the
+  pins at the right times, so indicating a state never takes time away from
+  a frame period or delays a trigger.
+  """
+
+  def __init__(self, gpio, clock=None):
+    self.gpio = gpio
+    self.clock = clock if clock is not None else SystemClock()
+    self.patterns = {} # pin -> (pattern, start time)
+    self.levels = {}
+    self.on_time = {} # lit seconds of the patterns already finished or replaced
+    self.condition = threading.Condition()
+    self.running = False
+    self.thread = None
+
+  def start(self):
+    self.running = True
+    self.thread = threading.Thread(target=self._run, name="LedEngine")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self):
+    """ Stops the engine and turns every LED off """
+    with self.condition:
+      self.running = False
+      self.patterns.clear()
+      self.condition.notify()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+    self.update()
+
+  def show(self, pin, pattern):
+    """ Shows pattern on pin. Posting the pattern the pin is already showing keeps its phase """
+    with self.condition:
+      current = self.patterns.get(pin)
+      if current is not None and current[0] == pattern:
+        return
+      now = self.clock.monotonic()
+      self._account(pin, now)
+      self.patterns[pin] = (pattern, now)
+      self.condition.notify()
+
+  def clear(self, pin):
+    """ Turns the LED off """
+    with self.condition:
+      if pin in self.patterns:
+        self._account(pin, self.clock.monotonic())
+        del self.patterns[pin]
+        self.condition.notify()
+
+  def showing(self, pin):
+    with self.condition:
+      current = self.patterns.get(pin)
+      return current[0] if current is not None else None
+
+  def update(self):
+    """ Sets every pin to the level of its pattern now. Returns the seconds until the next change (None: no change pending) """
+    now = self.clock.monotonic()
+    wait = None
+    with self.condition:
+      for pin, (pattern, start) in self.patterns.items():
+        level, change = pattern.levelAt(now - start)
+        self._set(pin, level, now)
+        if change is None:
+          self._account(pin, now)
+          del self.patterns[pin] # one-shot pattern finished
+        elif wait is None or change < wait:
+          wait = change
+      for pin in self.levels.keys():
+        if pin not in self.patterns:
+          self._set(pin, 0, now)
+    return wait
+
+  def _set(self, pin, level, now):
+    if self.levels.get(pin) == level:
+      return
+    self.gpio.output(pin, level)
+    self.levels[pin] = level
+
+  def _account(self, pin, now):
+    current = self.patterns.get(pin)
+    if current is not None:
+      pattern, start = current
+      self.on_time[pin] = self.on_time.get(pin, 0.0) + pattern.onTime(now - start)
+
+  def onTime(self, pin):
+    """ Total seconds pin has been lit, worked out from the patterns shown (no need for the thread to run) """
+    now = self.clock.monotonic()
+    with self.condition:
+      current = self.patterns.get(pin)
+      extra = current[0].onTime(now - current[1]) if current is not None else 0.0
+      return self.on_time.get(pin, 0.0) + extra
+
+  def _run(self):
+    with self.condition:
+      while self.running:
+        self.condition.wait(self.update())
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# Serves the frames of a mission over HTTP, so they can be pulled while the
+# glider is on deck (even while the camera keeps capturing) or after recovery.
+#
+#   python offload.py prova --port 8000
+#
+#   GET /status                     mission name, number of frames, next sequence number
+#   GET /frames?since=N&limit=M     JSON list of the frames with a sequence number >= N,
+#                                   and the cursor to ask for the next page
+#   GET /frames/<seq>               the JPEG (Range requests supported), with its CRC32
+#                                   in X-Frame-CRC32 and its capture time in X-Frame-Wall
+#   HEAD /frames/<seq>              the same headers without the data
+#
+# See offload_client.py for a resumable client.
+import BaseHTTPServer
+import SocketServer
+import json
+import os
+import re
+import urlparse
+
+from frame_index import FrameIndex
+from segments import SegmentReader, crc32
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def parseRange(header, size):
+  """ (start, end) (end excluded) of a single byte range request, or None if it cannot be satisfied """
+  match = RANGE.match(header.strip())
+  if match is None or match.group(1) == match.group(2) == "":
+    return None
+  first, last = match.group(1), match.group(2)
+  if first == "":
+    # suffix range: the last N bytes
+    length = int(last)
+    if length == 0:
+      return None
+    return max(0, size - length), size
+  start = int(first)
+  end = size if last == "" else min(size, int(last) + 1)
+  if start >= size or end <= start:
+    return None
+  return start, end
+
+class OffloadHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """ Request handler; the mission is found in self.server """
+
+  protocol_version = "HTTP/1.1" # keeps the connections of the client workers open
+
+  def do_GET(self):
+    self._dispatch(True)
+
+  def do_HEAD(self):
+    self._dispatch(False)
+
+  def _dispatch(self, body):
+    url = urlparse.urlparse(self.path)
+    query = urlparse.parse_qs(url.query)
+    try:
+      if url.path == "/status":
+        self._sendJson(self.server.status(), body)
+      elif url.path == "/frames":
+        since = int(query.get("since", ["0"])[0])
+        limit = min(int(query.get("limit", ["100"])[0]), self.server.max_page)
+        self._sendJson(self.server.listing(since, limit), body)
+      elif url.path.startswith("/frames/"):
+        self._sendFrame(int(url.path[len("/frames/"):]), body)
+      else:
+        self.send_error(404)
+    except ValueError:
+      self.send_error(400)
+
+  def _sendJson(self, data, body):
+    text = json.dumps(data)
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(text)))
+    self.end_headers()
+    if body:
+      self.wfile.write(text)
+
+  def _sendFrame(self, seq, body):
+    record = self.server.record(seq)
+    if record is None:
+      self.send_error(404, "No frame %d" % seq)
+      return
+    try:
+      data = self.server.frameData(record)
+    except (IOError, ValueError), err:
+      self.send_error(500, str(err))
+      return
+    start, end = 0, len(data)
+    status = 200
+    if "Range" in self.headers:
+      span = parseRange(self.headers["Range"], len(data))
+      if span is None:
+        self.send_response(416)
+        self.send_header("Content-Range", "bytes */%d" % len(data))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return
+      start, end = span
+      status = 206
+    crc = crc32(data)
+    self.send_response(status)
+    self.send_header("Content-Type", "image/jpeg")
+    self.send_header("Content-Length", str(end - start))
+    self.send_header("Accept-Ranges", "bytes")
+    self.send_header("ETag", '"%d-%08x"' % (record.seq, crc))
+    self.send_header("X-Frame-CRC32", "%08x" % crc)
+    self.send_header("X-Frame-Size", str(len(data)))
+    self.send_header("X-Frame-Wall", repr(record.wall))
+    if status == 206:
+      self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end - 1, len(data)))
+    self.end_headers()
+    if body:
+      self.wfile.write(data[start:end])
+      self.server.served += 1
+      self.server.bytes_served += end - start
+
+  def log_message(self, format, *args):
+    if self.server.verbose:
+      BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class OffloadServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """ Threaded HTTP server over the frame index of a mission
+
+  Each transfer runs on its own thread. The index is opened read only and
+  re-read on every listing, so frames captured while the server runs show up
+  in the next page. Frames are read through SegmentReader, so both storage
+  backends are served and segment entries are checked against their CRC
+  before being sent.
+  """
+
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, path, address=("", 8000), max_page=1000, verbose=False):
+    self.path = path
+    self.mission_name = os.path.basename(os.path.abspath(path))
+    self.index = FrameIndex(os.path.join(path, "frames.idx"), readonly=True)
+    self.max_page = max_page
+    self.verbose = verbose
+    self.served = 0
+    self.bytes_served = 0
+    BaseHTTPServer.HTTPServer.__init__(self, address, OffloadHandler)
+
+  def status(self):
+    self.index.refresh()
+    return {"mission": self.mission_name, "frames": len(self.index), "next_seq": self.index.next_seq}
+
+  def listing(self, since, limit):
+    """ One page of frame metadata from sequence number since on """
+    self.index.refresh()
+    frames = [{"seq": r.seq, "wall": r.wall, "temperature": r.temperature, "size": r.size}
+              for r in self.index.since(since, limit)]
+    return {"frames": frames, "next": frames[-1]["seq"] + 1 if frames else since}
+
+  def record(self, seq):
+    record = self.index.get(seq)
+    if record is None:
+      self.index.refresh()
+      record = self.index.get(seq)
+    return record
+
+  def frameData(self, record):
+    reader = SegmentReader(self.path) # one per request: readers keep their segment open
+    try:
+      return reader.read(record)
+    finally:
+      reader.close()
+
+  def close(self):
+    self.server_close()
+    self.index.close()
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="Serves the frames of a mission over HTTP")
+  parser.add_argument("mission", help="mission directory (holding frames.idx)")
+  parser.add_argument("--host", default="", help="address to listen on (all by default)")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--verbose", action="store_true", help="logs every request")
+  args = parser.parse_args()
+  server = OffloadServer(args.mission, (args.host, args.port), verbose=args.verbose)
+  print "Serving %s (%d frames) on port %d" % (args.mission, len(server.index), server.server_address[1])
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    print " Stopping offload server..."
+  server.close()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# Pulls the frames of a mission from an offload server (offload.py) into a
+# local directory, rebuilding the <YYYYmmdd>/<HH>/ tree. It can be stopped
+# and started again at any time: the cursor file remembers up to which frame
+# everything has been received, and a frame cut halfway is resumed with a
+# Range request. Every frame is checked against its CRC32.
+#
+#   python offload_client.py http://10.0.0.2:8000 recovered/prova --workers 4
+import httplib
+import json
+import os
+import Queue
+import threading
+import time
+import urlparse
+import zlib
+
+from frame_index import shardPath
+
+CHUNK = 65536
+
+class OffloadError(IOError):
+  pass
+
+class OffloadClient(object):
+  """ Resumable, concurrent client of an offload server """
+
+  def __init__(self, url, destination, workers=4, page=500, timeout=30, retries=3):
+    url = urlparse.urlparse(url)
+    self.host = url.hostname
+    self.port = url.port or 80
+    self.destination = destination
+    self.workers = workers
+    self.page = page
+    self.timeout = timeout
+    self.retries = retries
+    self.cursor_file = os.path.join(destination, ".offload-cursor")
+    self.local = threading.local()
+    self.lock = threading.Lock()
+    self.frames = 0
+    self.bytes = 0
+    self.resumed = 0
+    self.errors = 0
+    if not os.path.isdir(destination):
+      os.makedirs(destination)
+
+  def _connection(self):
+    if getattr(self.local, "connection", None) is None:
+      self.local.connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+    return self.local.connection
+
+  def _request(self, method, path, headers={}):
+    """ Sends a request on the connection of the calling thread, reconnecting once if the server closed it """
+    for attempt in range(2):
+      connection = self._connection()
+      try:
+        connection.request(method, path, headers=headers)
+        return connection.getresponse()
+      except (httplib.HTTPException, IOError):
+        connection.close()
+        self.local.connection = None
+        if attempt == 1:
+          raise
+
+  def _json(self, path):
+    response = self._request("GET", path)
+    data = response.read()
+    if response.status != 200:
+      raise OffloadError("GET %s: %d %s" % (path, response.status, response.reason))
+    return json.loads(data)
+
+  def status(self):
+    return self._json("/status")
+
+  def listing(self, since):
+    """ Metadata of the frames from sequence number since on, one page at a time """
+    while True:
+      page = self._json("/frames?since=%d&limit=%d" % (since, self.page))
+      if not page["frames"]:
+        return
+      for frame in page["frames"]:
+        yield frame
+      since = page["next"]
+
+  def loadCursor(self):
+    """ Sequence number from which frames still have to be pulled """
+    try:
+      with open(self.cursor_file) as f:
+        return json.load(f)["next"]
+    except (IOError, ValueError):
+      return 0
+
+  def saveCursor(self, next_seq):
+    tmp = self.cursor_file + ".tmp"
+    with open(tmp, "w") as f:
+      json.dump({"next": next_seq}, f)
+    os.rename(tmp, self.cursor_file)
+
+  def fetch(self, frame):
+    """ Pulls one frame, resuming a partial download. Returns the number of bytes transferred """
+    filename = os.path.join(self.destination, shardPath(frame["seq"], frame["wall"]))
+    if os.path.exists(filename) and os.path.getsize(filename) == frame["size"]:
+      return 0
+    part = filename + ".part"
+    if not os.path.isdir(os.path.dirname(filename)):
+      try:
+        os.makedirs(os.path.dirname(filename))
+      except OSError: # created by another worker in the meantime
+        pass
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"Range": "bytes=%d-" % offset} if offset > 0 else {}
+    response = self._request("GET", "/frames/%d" % frame["seq"], headers)
+    if response.status == 416:
+      # the partial file is not a prefix of this frame: start over
+      response.read()
+      os.remove(part)
+      return self.fetch(frame)
+    if response.status == 200:
+      offset = 0
+    elif response.status != 206:
+      response.read()
+      raise OffloadError("Frame %d: %d %s" % (frame["seq"], response.status, response.reason))
+    expected = int(response.getheader("X-Frame-CRC32"), 16)
+    transferred = 0
+    with open(part, "r+b" if offset > 0 else "wb") as f:
+      f.seek(offset)
+      f.truncate()
+      while True:
+        chunk = response.read(CHUNK)
+        if not chunk:
+          break
+        f.write(chunk)
+        transferred += len(chunk)
+    crc = 0
+    with open(part, "rb") as f:
+      while True:
+        chunk = f.read(CHUNK)
+        if not chunk:
+          break
+        crc = zlib.crc32(chunk, crc)
+    if crc & 0xffffffff != expected:
+      os.remove(part)
+      raise OffloadError("Frame %d: checksum mismatch" % frame["seq"])
+    os.rename(part, filename)
+    if offset > 0:
+      with self.lock:
+        self.resumed += 1
+    return transferred
+
+  def _work(self, queue, done):
+    while True:
+      frame = queue.get()
+      if frame is None:
+        return
+      ok = False
+      for attempt in range(self.retries):
+        try:
+          transferred = self.fetch(frame)
+          ok = True
+          break
+        except (OffloadError, httplib.HTTPException, IOError), err:
+          print "Frame %d: %s (attempt %d)" % (frame["seq"], err, attempt + 1)
+          time.sleep(0.5 * 2 ** attempt)
+      with self.lock:
+        if ok:
+          self.frames += 1
+          self.bytes += transferred
+          done[frame["seq"]] = True
+        else:
+          self.errors += 1
+          done[frame["seq"]] = False
+
+  def sync(self, max_frames=None):
+    """ Pulls every frame after the cursor (or max_frames of them) and moves the cursor
+    past the frames received without a gap """
+    since = self.loadCursor()
+    queue = Queue.Queue(maxsize=self.workers * 4)
+    done = {}
+    threads = [threading.Thread(target=self._work, args=(queue, done)) for i in range(self.workers)]
+    for t in threads:
+      t.daemon = True
+      t.start()
+    order = []
+    queued = 0
+    cursor = since
+    try:
+      for frame in self.listing(since):
+        if max_frames is not None and queued >= max_frames:
+          break
+        queued += 1
+        order.append(frame["seq"])
+        queue.put(frame)
+        cursor = self._advance(order, done, cursor)
+    finally:
+      for t in threads:
+        queue.put(None)
+      for t in threads:
+        t.join()
+      self._advance(order, done, cursor)
+
+  def _advance(self, order, done, cursor):
+    """ Moves the cursor over the frames received in order, stopping at the first pending or failed one """
+    with self.lock:
+      moved = cursor
+      while order and done.get(order[0]):
+        moved = order.pop(0) + 1
+        done.pop(moved - 1)
+    if moved != cursor:
+      self.saveCursor(moved)
+    return moved
+
+  def report(self):
+    return "Offload: %d frames (%.1f MB) received, %d resumed, %d failed" % (
+           self.frames, self.bytes / 1e6, self.resumed, self.errors)
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="Pulls the frames of a mission from an offload server")
+  parser.add_argument("url", help="server address, e.g. http://10.0.0.2:8000")
+  parser.add_argument("destination", help="local directory for the frames")
+  parser.add_argument("--workers", type=int, default=4, help="concurrent transfers")
+  parser.add_argument("--max-frames", type=int, help="stops after this many frames")
+  args = parser.parse_args()
+  client = OffloadClient(args.url, args.destination, args.workers)
+  status = client.status()
+  print "Mission %s: %d frames on the server, pulling from frame %d" % (status["mission"], status["frames"], client.loadCursor())
+  start = time.time()
+  try:
+    client.sync(args.max_frames)
+  except KeyboardInterrupt:
+    print " Stopping, run again to resume..."
+  elapsed = time.time() - start
+  print client.report()
+  print "%.1fs, %.1f MB/s" % (elapsed, client.bytes / 1e6 / elapsed if elapsed > 0 else 0.0)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Throughput benchmark of the offload server and client on a local stand-in
+# mission: synthetic frames are written with either storage backend, served
+# from a thread on localhost and pulled with increasing numbers of workers.
+# A partial pull followed by a resumed one checks the cursor and the Range
+# resume on the way.
+#
+#   python offload_harness.py --frames 200 --size 2500 --workers 1 2 4 8
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from frame_index import FrameIndex, FrameRecord, shardPath
+from segments import SegmentArchive
+from offload import OffloadServer
+from offload_client import OffloadClient
+
+def standIn(path, backend, frames, size, seed=0):
+  """ Writes a mission of frames frames of about size bytes each """
+  os.makedirs(path)
+  rng = random.Random(seed)
+  block = os.urandom(size)
+  index = FrameIndex(os.path.join(path, "frames.idx"))
+  archive = SegmentArchive(os.path.join(path, "segments")) if backend == "segments" else None
+  wall = time.time() - frames * 8
+  for seq in range(frames):
+    data = block[:size - rng.randint(0, size // 10)] + str(seq)
+    record = FrameRecord(seq, seq * 8.0, wall + seq * 8, 20.0, len(data), shardPath(seq, wall + seq * 8))
+    if archive is not None:
+      record = archive.append(record, data)
+    else:
+      filename = os.path.join(path, record.path)
+      if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+      with open(filename, "wb") as f:
+        f.write(data)
+    index.append(record)
+  if archive is not None:
+    archive.close()
+  index.close()
+
+def pull(url, destination, workers, max_frames=None):
+  client = OffloadClient(url, destination, workers)
+  start = time.time()
+  client.sync(max_frames)
+  return client, time.time() - start
+
+def run(args, backend, workdir):
+  mission = os.path.join(workdir, backend)
+  standIn(mission, backend, args.frames, args.size * 1000)
+  server = OffloadServer(mission, ("127.0.0.1", 0))
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  url = "http://127.0.0.1:%d" % server.server_address[1]
+  for workers in args.workers:
+    destination = os.path.join(workdir, "pull-%s-%d" % (backend, workers))
+    client, elapsed = pull(url, destination, workers)
+    print "%-8s %2d workers: %d frames, %.1f MB in %.2fs: %.1f MB/s, %.0f frames/s, %d failed" % (
+          backend, workers, client.frames, client.bytes / 1e6, elapsed, client.bytes / 1e6 / elapsed,
+          client.frames / elapsed, client.errors)
+    shutil.rmtree(destination)
+  # Resume: half of the frames, one of them cut in the middle, then the rest
+  destination = os.path.join(workdir, "resume-%s" % backend)
+  first, elapsed = pull(url, destination, 2, args.frames // 2)
+  record = server.index.read(args.frames // 2 - 1)
+  last = os.path.join(destination, shardPath(record.seq, record.wall))
+  with open(last, "rb") as f:
+    data = f.read()
+  os.remove(last)
+  with open(last + ".part", "wb") as f:
+    f.write(data[:len(data) // 2])
+  first.saveCursor(args.frames // 2 - 1)
+  second, elapsed = pull(url, destination, 2)
+  print "%-8s resume: %d + %d frames, %d resumed with a Range request, %d failed, cursor at %d of %d" % (
+        backend, first.frames, second.frames, second.resumed, first.errors + second.errors,
+        second.loadCursor(), args.frames)
+  server.shutdown()
+  server.close()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Offload throughput benchmark on a local stand-in mission")
+  parser.add_argument("--frames", type=int, default=200, help="frames in the stand-in mission")
+  parser.add_argument("--size", type=int, default=2500, help="frame size in KB")
+  parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="concurrent transfers to try")
+  parser.add_argument("--backend", nargs="+", default=["files", "segments"], choices=["files", "segments"])
+  args = parser.parse_args()
+  workdir = tempfile.mkdtemp(prefix="offload-")
+  try:
+    for backend in args.backend:
+      run(args, backend, workdir)
+  finally:
+    shutil.rmtree(workdir)
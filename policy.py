@@ -0,0 +1,83 @@
+from collections import namedtuple
+
+class CaptureLevel(namedtuple("CaptureLevel", "quality scale period_factor size")):
+  """ One step of the capture policy: JPEG quality, resolution scale, period multiplier and the
+  expected size of a frame relative to the first level """
+
+  def describe(self):
+    return "quality %d, scale %.2f, period x%g" % (self.quality, self.scale, self.period_factor)
+
+class AdaptivePolicy(object):
+  """ Chooses how to capture so the card lasts until the end of the mission
+
+  Levels go from the best (first) to the cheapest (last). decide() works out,
+  for each level, the bytes needed to keep capturing until end_date: frames
+  left (time left / period of the level) times the bytes per frame of the
+  level, scaled from the bytes per frame observed at the current level. It
+  picks the best level whose need, times margin, fits in the budget (free
+  space above the memory threshold), and the last one if none fits. Going
+  back up needs an extra hysteresis of headroom, and no decision is taken
+  until hold_frames frames have been captured at the current level, so the
+  observed frame size can follow the change.
+
+  decide() only uses its arguments, so a policy can be evaluated offline;
+  every change is kept in `decisions` as (wall time, old level, new level, reason).
+  """
+
+  def __init__(self, levels, margin=1.1, hysteresis=0.2, hold_frames=50):
+    if not levels:
+      raise ValueError("The adaptive policy needs at least one capture level")
+    self.levels = levels
+    self.margin = margin
+    self.hysteresis = hysteresis
+    self.hold_frames = hold_frames
+    self.current = 0
+    self.frames_at_level = 0
+    self.decisions = []
+
+  def level(self):
+    return self.levels[self.current]
+
+  def frameCaptured(self, count=1):
+    self.frames_at_level += count
+
+  def state(self):
+    return {"current": self.current, "frames_at_level": self.frames_at_level}
+
+  def reset(self):
+    """ Goes back to the first level, as when the policy is turned off """
+    self.current = 0
+    self.frames_at_level = 0
+
+  def restore(self, state):
+    """ Restores the level saved by state() after a reboot """
+    self.current = min(state["current"], len(self.levels) - 1)
+    self.frames_at_level = state["frames_at_level"]
+
+  def need(self, i, bytes_per_frame, seconds_left, period):
+    """ Bytes level i needs until the end of the mission, given the bytes per frame observed at the current level """
+    level = self.levels[i]
+    frame_bytes = bytes_per_frame / self.levels[self.current].size * level.size
+    return seconds_left / (period * level.period_factor) * frame_bytes
+
+  def decide(self, budget, bytes_per_frame, seconds_left, period, wall=None):
+    """ Returns the index of the level to use. budget is the free space above the threshold, in bytes """
+    if not bytes_per_frame or self.frames_at_level < self.hold_frames:
+      return self.current
+    chosen = len(self.levels) - 1
+    for i in range(0, len(self.levels)):
+      margin = self.margin * (1 + self.hysteresis) if i < self.current else self.margin
+      if self.need(i, bytes_per_frame, seconds_left, period) * margin <= budget:
+        chosen = i
+        break
+    if chosen != self.current:
+      reason = "%.1f MB left, %.1f MB needed at level %d, %.0f KB/frame, %.1f h to go" % (
+               budget / 1e6, self.need(chosen, bytes_per_frame, seconds_left, period) / 1e6, chosen,
+               bytes_per_frame / 1e3, seconds_left / 3600.0)
+      self.decisions.append((wall, self.current, chosen, reason))
+      self.current = chosen
+      self.frames_at_level = 0
+    return self.current
+
+  def report(self):
+    return "Capture policy: level %d (%s), %d changes" % (self.current, self.level().describe(), len(self.decisions))
@@ -0,0 +1,102 @@
+import threading
+from collections import deque
+
+from clock import SystemClock
+
+class TemperatureSampler(object):
+  """ Reads the MCP9808 from a background thread into a fixed-size ring buffer
+
+  The capture path never waits for the I2C bus: it takes the latest cached
+  sample, a smoothed value or the rate of change from the buffer. Samples
+  older than max_age seconds are not trusted, so a sensor that stops
+  answering shows up as no reading (None) instead of a stale or -1 value.
+  """
+
+  def __init__(self, sensor, interval=2.0, size=64, max_age=30.0, smoothing=5, clock=None):
+    self.sensor = sensor
+    self.interval = interval
+    self.max_age = max_age
+    self.smoothing = smoothing
+    self.clock = clock if clock is not None else SystemClock()
+    self.samples = deque(maxlen=size) # (monotonic time, celsius)
+    self.lock = threading.Lock() # the capture path reads the samples while the thread appends
+    self.reads = 0
+    self.errors = 0
+    self.running = threading.Event()
+    self.thread = None
+
+  def start(self):
+    """ Takes a first sample and starts the sampling thread """
+    self.sampleOnce()
+    self.running.set()
+    self.thread = threading.Thread(target=self._run, name="TemperatureSampler")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self):
+    self.running.clear()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def _run(self):
+    next_sample = self.clock.monotonic() + self.interval
+    while self.running.is_set():
+      self.clock.sleep(next_sample - self.clock.monotonic())
+      self.sampleOnce()
+      next_sample += self.interval
+
+  def sampleOnce(self):
+    """ Reads the sensor once and stores the sample. Returns the value or None on error """
+    try:
+      value = self.sensor.readTempC()
+    except (IOError, OSError), err:
+      self.errors += 1
+      return None
+    self.reads += 1
+    with self.lock:
+      self.samples.append((self.clock.monotonic(), value))
+    return value
+
+  def _fresh(self, max_age):
+    max_age = self.max_age if max_age is None else max_age
+    oldest = self.clock.monotonic() - max_age
+    with self.lock:
+      samples = list(self.samples)
+    return [sample for sample in samples if sample[0] >= oldest]
+
+  def latest(self, max_age=None):
+    """ Last sample, or None if there is none younger than max_age seconds """
+    if not self.samples:
+      return None
+    t, value = self.samples[-1]
+    if self.clock.monotonic() - t > (self.max_age if max_age is None else max_age):
+      return None
+    return value
+
+  def smoothed(self, max_age=None):
+    """ Mean of the last `smoothing` fresh samples, or None if there are no fresh samples """
+    fresh = self._fresh(max_age)[-self.smoothing:]
+    if not fresh:
+      return None
+    return sum(value for t, value in fresh) / float(len(fresh))
+
+  def rate(self, max_age=None):
+    """ Rate of change in celsius per minute (least squares over the fresh samples), None with less than 2 """
+    fresh = self._fresh(max_age)
+    if len(fresh) < 2:
+      return None
+    n = float(len(fresh))
+    mean_t = sum(t for t, value in fresh) / n
+    mean_v = sum(value for t, value in fresh) / n
+    var_t = sum((t - mean_t) ** 2 for t, value in fresh)
+    if var_t == 0:
+      return None
+    cov = sum((t - mean_t) * (value - mean_v) for t, value in fresh)
+    return cov / var_t * 60.0
+
+  def report(self):
+    rate = self.rate()
+    return "Temperature: %s C smoothed, %s C/min, %d reads, %d errors" % (
+           "%.2f" % self.smoothed() if self.smoothed() is not None else "n/a",
+           "%+.3f" % rate if rate is not None else "n/a", self.reads, self.errors)
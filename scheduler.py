@@ -0,0 +1,155 @@
+import math
+from collections import deque
+
+from clock import SystemClock
+
+class CaptureScheduler(object):
+  """ Fires frames on an absolute grid of monotonic deadlines (anchor + k * period)
+
+  Nothing done between two frames (temperature reads, LED flashes, memory
+  checks...) can push the grid, so the achieved rate over a long mission is
+  exactly 1/period as long as a frame fits in its slot. When a deadline is
+  missed, the policy decides what happens with the lost slots:
+    * skip:     slots that have completely passed are dropped and the latest
+                one is fired right away. The grid phase is kept.
+    * catchup:  every missed slot is fired back to back until the grid is
+                reached again. No frame is lost.
+    * compress: like catchup, but frames are never closer than min_interval
+                (period / 2 by default), spreading the recovery.
+  """
+
+  POLICIES = ("skip", "catchup", "compress")
+
+  def __init__(self, period, policy="skip", min_interval=None, clock=None, history=1000):
+    if policy not in CaptureScheduler.POLICIES:
+      raise ValueError("Unknown missed frame policy '%s' (expected one of %s)" % (policy, ", ".join(CaptureScheduler.POLICIES)))
+    if period <= 0:
+      raise ValueError("Capture period must be positive")
+    self.period = float(period)
+    self.policy = policy
+    self.fixed_min_interval = min_interval is not None
+    self.min_interval = float(min_interval) if min_interval is not None else self.period / 2.0
+    self.clock = clock if clock is not None else SystemClock()
+    self.lateness_history = deque(maxlen=history)
+    self.anchor = None
+    self.start()
+
+  def start(self, anchor=None):
+    """ (Re)starts the grid at anchor (monotonic seconds, default now) and clears the statistics """
+    self.anchor = self.clock.monotonic() if anchor is None else anchor
+    self.index = 0
+    self.first_fire = None
+    self.last_fire = None
+    self.last_lateness = 0.0
+    self.last_interval = None
+    self.frames = 0
+    self.skipped = 0
+    self.late_frames = 0
+    self.lateness_sum = 0.0
+    self.lateness_max = 0.0
+    self.jitter_sum = 0.0
+    self.jitter_sq_sum = 0.0
+    self.jitter_max = 0.0
+    self.intervals = 0
+    self.lateness_history.clear()
+
+  def setPeriod(self, period):
+    """ Changes the period from the next deadline on, keeping the frames already scheduled """
+    if period <= 0:
+      raise ValueError("Capture period must be positive")
+    self.anchor = self.deadline()
+    self.index = 0
+    self.period = float(period)
+    if not self.fixed_min_interval:
+      self.min_interval = self.period / 2.0
+
+  def deadline(self):
+    """ Monotonic time of the next slot of the grid """
+    return self.anchor + self.index * self.period
+
+  def wait(self):
+    """ Sleeps until the next frame is due and returns its lateness in seconds """
+    now = self.clock.monotonic()
+    deadline = self.deadline()
+    fire_at = deadline
+    if now > deadline:
+      if self.policy == "skip":
+        missed = int(math.floor((now - deadline) / self.period))
+        if missed > 0:
+          self.index += missed
+          self.skipped += missed
+          deadline = self.deadline()
+      elif self.policy == "compress" and self.last_fire is not None:
+        fire_at = max(deadline, self.last_fire + self.min_interval)
+    if fire_at > now:
+      self.clock.sleep(fire_at - now)
+      now = self.clock.monotonic()
+    self._record(now, deadline)
+    self.index += 1
+    return self.last_lateness
+
+  def advance(self, count):
+    """ Moves the grid count slots on as if each of them had fired right on its deadline. For replays
+    that account for a stretch of frames at once; nothing sleeps """
+    if count <= 0:
+      return
+    if self.last_fire is None:
+      self.first_fire = self.deadline()
+      self.intervals += count - 1
+    else:
+      self.intervals += count
+    self.last_fire = self.deadline() + (count - 1) * self.period
+    self.last_lateness = 0.0
+    self.lateness_history.extend([0.0] * min(count, self.lateness_history.maxlen))
+    self.frames += count
+    self.index += count
+
+  def _record(self, fired, deadline):
+    lateness = max(0.0, fired - deadline)
+    self.last_lateness = lateness
+    self.lateness_history.append(lateness)
+    self.frames += 1
+    self.lateness_sum += lateness
+    if lateness > self.lateness_max:
+      self.lateness_max = lateness
+    # A frame counts as late once it leaves a 1% slot of its deadline
+    if lateness > self.period * 0.01:
+      self.late_frames += 1
+    if self.last_fire is not None:
+      interval = fired - self.last_fire
+      jitter = abs(interval - self.period)
+      self.last_interval = interval
+      self.intervals += 1
+      self.jitter_sum += jitter
+      self.jitter_sq_sum += jitter * jitter
+      if jitter > self.jitter_max:
+        self.jitter_max = jitter
+    else:
+      self.first_fire = fired
+    self.last_fire = fired
+
+  def stats(self):
+    """ Returns the lateness and jitter statistics since the last start() """
+    frames = max(self.frames, 1)
+    intervals = max(self.intervals, 1)
+    elapsed = (self.last_fire - self.first_fire) if self.last_fire is not None else 0.0
+    return {
+      "frames": self.frames,
+      "skipped": self.skipped,
+      "late_frames": self.late_frames,
+      "lateness_mean": self.lateness_sum / frames,
+      "lateness_max": self.lateness_max,
+      "jitter_mean": self.jitter_sum / intervals,
+      "jitter_rms": math.sqrt(self.jitter_sq_sum / intervals),
+      "jitter_max": self.jitter_max,
+      "achieved_period": elapsed / (self.frames - 1) if self.frames > 1 else None,
+    }
+
+  def report(self):
+    """ One line summary of the schedule, meant for mission_info.log """
+    s = self.stats()
+    achieved = "%.4fs" % s["achieved_period"] if s["achieved_period"] is not None else "n/a"
+    return ("Schedule: %d frames (%d skipped, %d late), period %s (nominal %.4fs), "
+            "lateness mean %.4fs max %.4fs, jitter rms %.4fs max %.4fs" %
+            (s["frames"], s["skipped"], s["late_frames"], achieved, self.period,
+             s["lateness_mean"], s["lateness_max"], s["jitter_rms"], s["jitter_max"]))
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+import os
+import struct
+import zlib
+
+from frame_index import FrameIndex, shardPath
+
+# Every frame is appended to the current segment as a fixed-size header
+#   magic (4 bytes), sequence (u64), wall time (f64, unix seconds),
+#   size in bytes (u32), CRC32 of the data (u32)
+# followed by the JPEG data, so a segment can be walked (and a torn tail
+# detected) without the frame index
+ENTRY = struct.Struct("<4sQdII")
+ENTRY_MAGIC = "GCSF"
+SEGMENT_NAME = "seg-%06d.gcs"
+
+def location(segment, offset):
+  """ How the frame index refers to a frame in a segment, relative to the mission directory """
+  return "segments/%s#%d" % (segment, offset)
+
+def parseLocation(text):
+  """ Returns (segment filename relative to the mission directory, offset) of a location, or None for a plain file """
+  name, sep, offset = text.rpartition("#")
+  if not sep:
+    return None
+  return name, int(offset)
+
+def crc32(data):
+  return zlib.crc32(data) & 0xffffffff
+
+class SegmentArchive(object):
+  """ Appends encoded frames to large rolling segment files
+
+  Millions of small JPEGs cost an inode and a directory entry each, and
+  copying them off a recovered card is dominated by the per-file overhead.
+  Here frames are appended to <mission>/segments/seg-NNNNNN.gcs files of up
+  to segment_size bytes, each with a header carrying its sequence number,
+  time and CRC32. append() returns the frame record with its path replaced
+  by "segments/<segment>#<offset>", so the frame index doubles as the
+  offset index of the archive. Segments are fsync'ed every sync_every
+  frames; a frame torn by a power cut is cut off when the archive is
+  reopened.
+  """
+
+  def __init__(self, directory, segment_size=256000000, sync_every=10):
+    self.directory = directory
+    self.segment_size = segment_size
+    self.sync_every = sync_every
+    self.unsynced = 0
+    self.frames = 0
+    self.bytes_written = 0
+    self.file = None
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    numbers = segmentNumbers(directory)
+    self.number = numbers[-1] if numbers else 0
+    self._open()
+
+  def _open(self):
+    self.name = SEGMENT_NAME % self.number
+    filename = os.path.join(self.directory, self.name)
+    self.file = open(filename, "r+b" if os.path.exists(filename) else "w+b")
+    end = validEnd(self.file)
+    self.file.truncate(end)
+    self.file.seek(end)
+    self.size = end
+
+  def _roll(self):
+    self.sync()
+    self.file.close()
+    self.number += 1
+    self._open()
+
+  def append(self, record, data):
+    """ Appends the data of a frame and returns its record pointing at the segment """
+    if self.size > 0 and self.size + ENTRY.size + len(data) > self.segment_size:
+      self._roll()
+    offset = self.size
+    self.file.write(ENTRY.pack(ENTRY_MAGIC, record.seq, record.wall, len(data), crc32(data)))
+    self.file.write(data)
+    self.file.flush()
+    self.size += ENTRY.size + len(data)
+    self.frames += 1
+    self.bytes_written += len(data)
+    self.unsynced += 1
+    if self.unsynced >= self.sync_every:
+      self.sync()
+    return record._replace(path=location(self.name, offset))
+
+  def sync(self):
+    if self.unsynced > 0:
+      os.fsync(self.file.fileno())
+      self.unsynced = 0
+
+  def close(self):
+    if self.file is not None:
+      self.sync()
+      self.file.close()
+      self.file = None
+
+  def report(self):
+    """ One line summary of the archive, meant for mission_info.log """
+    return "Segments: %d frames (%.1f MB) appended, current %s at %.1f MB" % (
+           self.frames, self.bytes_written / 1e6, self.name, self.size / 1e6)
+
+def segmentNumbers(directory):
+  """ Numbers of the segments in a directory, sorted """
+  numbers = []
+  for name in os.listdir(directory):
+    if name.startswith("seg-") and name.endswith(".gcs"):
+      numbers.append(int(name[4:-4]))
+  return sorted(numbers)
+
+def scan(f):
+  """ Walks the entries of an open segment, yielding (offset, seq, wall, size, crc) up to the first torn one """
+  f.seek(0, os.SEEK_END)
+  end = f.tell()
+  offset = 0
+  while offset + ENTRY.size <= end:
+    f.seek(offset)
+    magic, seq, wall, size, crc = ENTRY.unpack(f.read(ENTRY.size))
+    if magic != ENTRY_MAGIC or offset + ENTRY.size + size > end:
+      return
+    yield offset, seq, wall, size, crc
+    offset += ENTRY.size + size
+
+def validEnd(f):
+  """ Offset where the intact entries of a segment end. The last entry's checksum is verified too,
+  since its data may not have reached the card before a power cut """
+  last = None
+  for entry in scan(f):
+    last = entry
+  if last is None:
+    return 0
+  offset, seq, wall, size, crc = last
+  f.seek(offset + ENTRY.size)
+  if crc32(f.read(size)) != crc:
+    return offset
+  return offset + ENTRY.size + size
+
+class SegmentReader(object):
+  """ Reads frames of a mission back, whether they are plain files or entries of a segment """
+
+  def __init__(self, path):
+    self.path = path
+    self.segment = None
+    self.file = None
+
+  def read(self, record):
+    """ Returns the data of the frame of an index record. Raises ValueError if its checksum does not match """
+    where = parseLocation(record.path)
+    if where is None:
+      with open(os.path.join(self.path, record.path), "rb") as f:
+        return f.read()
+    segment, offset = where
+    if segment != self.segment:
+      self.close()
+      self.file = open(os.path.join(self.path, segment), "rb")
+      self.segment = segment
+    self.file.seek(offset)
+    magic, seq, wall, size, crc = ENTRY.unpack(self.file.read(ENTRY.size))
+    if magic != ENTRY_MAGIC or seq != record.seq:
+      raise ValueError("No frame %d at %s" % (record.seq, record.path))
+    data = self.file.read(size)
+    if len(data) != size or crc32(data) != crc:
+      raise ValueError("Frame %d at %s is corrupt" % (record.seq, record.path))
+    return data
+
+  def close(self):
+    if self.file is not None:
+      self.file.close()
+      self.file = None
+      self.segment = None
+
+if __name__ == "__main__":
+  import argparse
+  import time
+  from datetime import datetime
+  def parseDate(text):
+    return time.mktime(datetime.strptime(text, "%d/%m/%Y %H:%M").timetuple())
+  parser = argparse.ArgumentParser(description="Lists, verifies or extracts the frames of a mission")
+  parser.add_argument("mission", help="mission directory (holding frames.idx)")
+  parser.add_argument("--from", dest="start", type=parseDate, help="dd/mm/YYYY HH:MM")
+  parser.add_argument("--to", dest="end", type=parseDate, help="dd/mm/YYYY HH:MM")
+  parser.add_argument("--seq", type=int, help="first sequence number")
+  parser.add_argument("--count", type=int, help="number of frames from --seq")
+  parser.add_argument("--verify", action="store_true", help="checks the CRC of every selected frame")
+  parser.add_argument("--extract", metavar="DIR", help="writes the selected frames to DIR/YYYYmmdd/HH/")
+  args = parser.parse_args()
+  index = FrameIndex(os.path.join(args.mission, "frames.idx"), readonly=True)
+  if args.seq is not None:
+    records = index.since(args.seq, args.count)
+  else:
+    records = index.between(args.start or 0, args.end or float("inf"))
+  reader = SegmentReader(args.mission)
+  frames = bad = 0
+  for r in records:
+    frames += 1
+    if not args.verify and not args.extract:
+      print "%8d %s %9d %s" % (r.seq, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r.wall)), r.size, r.path)
+      continue
+    try:
+      data = reader.read(r)
+    except (ValueError, IOError), err:
+      bad += 1
+      print err
+      continue
+    if args.extract:
+      filename = os.path.join(args.extract, shardPath(r.seq, r.wall))
+      if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+      with open(filename, "wb") as f:
+        f.write(data)
+  if args.verify or args.extract:
+    print "%d frames, %d unreadable" % (frames, bad)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+from clock import SystemClock
+
+# The log starts with the names of its channels and then holds one record per
+# sampling pass or saved frame:
+#   frame sequence number (u64, NO_FRAME for a plain sampling pass),
+#   monotonic time (f64), wall time (f64, unix seconds),
+#   one f32 per channel (NaN when the sensor did not answer)
+HEADER = struct.Struct("<8sI")
+MAGIC = "GCSENS01"
+NAME = struct.Struct("16s")
+NO_FRAME = 0xFFFFFFFFFFFFFFFF
+
+def recordStruct(channels):
+  return struct.Struct("<Qdd%df" % channels)
+
+class SensorLog(object):
+  """ Append-only binary time series of the housekeeping sensors """
+
+  def __init__(self, filename, names, sync_every=10):
+    self.filename = filename
+    self.names = list(names)
+    self.record = recordStruct(len(self.names))
+    self.sync_every = sync_every
+    self.unsynced = 0
+    self.records = 0
+    header = HEADER.pack(MAGIC, len(self.names)) + "".join(NAME.pack(name) for name in self.names)
+    if os.path.exists(filename) and os.path.getsize(filename) > 0:
+      with open(filename, "rb") as f:
+        existing = f.read(len(header))
+      if existing != header:
+        # the channels changed since the file was started: keep it aside
+        os.rename(filename, "%s.%s" % (filename, time.strftime("%Y%m%d-%H%M%S")))
+    if os.path.exists(filename):
+      self.file = open(filename, "r+b")
+      size = os.path.getsize(filename)
+      self.file.truncate(size - (size - len(header)) % self.record.size) # drops a torn record
+    else:
+      self.file = open(filename, "w+b")
+      self.file.write(header)
+    self.file.seek(0, os.SEEK_END)
+
+  def append(self, seq, monotonic, wall, values):
+    values = [float("nan") if value is None else value for value in values]
+    self.file.write(self.record.pack(NO_FRAME if seq is None else seq, monotonic, wall, *values))
+    self.file.flush()
+    self.records += 1
+    self.unsynced += 1
+    if self.unsynced >= self.sync_every:
+      os.fsync(self.file.fileno())
+      self.unsynced = 0
+
+  def close(self):
+    self.file.flush()
+    os.fsync(self.file.fileno())
+    self.file.close()
+
+def readLog(filename):
+  """ Yields (frame sequence number or None, monotonic, wall, {channel: value or None}) for every record of a log """
+  with open(filename, "rb") as f:
+    magic, channels = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+      raise ValueError("%s is not a sensor log" % filename)
+    names = [NAME.unpack(f.read(NAME.size))[0].rstrip("\0") for i in range(channels)]
+    record = recordStruct(channels)
+    while True:
+      data = f.read(record.size)
+      if len(data) < record.size:
+        return
+      fields = record.unpack(data)
+      values = dict((name, value if value == value else None) for name, value in zip(names, fields[3:]))
+      yield (fields[0] if fields[0] != NO_FRAME else None), fields[1], fields[2], values
+
+class SensorHub(object):
+  """ Samples every housekeeping sensor in one scheduled pass on a background thread
+
+  Channels are registered with add(name, read), read being any callable
+  returning a float (an MCP9808 readTempC, a voltage monitor...). Every
+  interval seconds a pass reads them all (on the shared I2C bus, so the
+  reads are serialised there) and publishes the result as a single
+  snapshot, which the capture loop takes without touching the bus. Each
+  pass is appended to the log, and so is the snapshot of every saved frame:
+  frameTaken() only queues it, the sampling thread writes it before its
+  next pass, so the capture thread never waits for the card.
+  """
+
+  def __init__(self, filename, interval=10.0, clock=None, sync_every=10):
+    self.filename = filename
+    self.interval = interval
+    self.sync_every = sync_every
+    self.clock = clock if clock is not None else SystemClock()
+    self.channels = []
+    self.log = None
+    self.lock = threading.Lock() # serialises the log writes of the sampling and capture threads
+    self.current = None # (monotonic, wall, values), replaced as a whole on every pass
+    self.frames = deque() # (seq, snapshot) of the saved frames, waiting for the sampling thread
+    self.passes = 0
+    self.errors = dict()
+    self.running = threading.Event()
+    self.thread = None
+
+  def add(self, name, read):
+    """ Registers a channel. Channels must be added before start() """
+    if len(name) > NAME.size:
+      raise ValueError("Sensor name '%s' is longer than %d characters" % (name, NAME.size))
+    self.channels.append((name, read))
+    self.errors[name] = 0
+
+  def names(self):
+    return [name for name, read in self.channels]
+
+  def start(self):
+    """ Opens the log, takes a first pass and starts the sampling thread """
+    self.log = SensorLog(self.filename, self.names(), self.sync_every)
+    self.sample()
+    self.running.set()
+    self.thread = threading.Thread(target=self._run, name="SensorHub")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self):
+    self.running.clear()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+    self._appendFrames()
+    if self.log is not None:
+      with self.lock:
+        self.log.close()
+        self.log = None
+
+  def _run(self):
+    next_pass = self.clock.monotonic() + self.interval
+    while self.running.is_set():
+      self.clock.sleep(next_pass - self.clock.monotonic())
+      self._appendFrames()
+      self.sample()
+      next_pass += self.interval
+
+  def sample(self):
+    """ Reads every channel once, publishes the snapshot and logs it """
+    values = []
+    for name, read in self.channels:
+      try:
+        values.append(read())
+      except (IOError, OSError):
+        self.errors[name] += 1
+        values.append(None)
+    snapshot = (self.clock.monotonic(), self.clock.time(), values)
+    self.current = snapshot
+    self.passes += 1
+    self._append(None, snapshot)
+    return snapshot
+
+  def snapshot(self):
+    """ {channel: value} of the last pass (None where the sensor failed), without waiting for the bus """
+    current = self.current
+    if current is None:
+      return {}
+    return dict(zip(self.names(), current[2]))
+
+  def frameTaken(self, seq):
+    """ Queues the last snapshot, logged against the sequence number of a saved frame """
+    current = self.current
+    if current is not None:
+      self.frames.append((seq, current))
+
+  def _appendFrames(self):
+    while self.frames:
+      self._append(*self.frames.popleft())
+
+  def _append(self, seq, snapshot):
+    with self.lock:
+      if self.log is not None:
+        self.log.append(seq, *snapshot)
+
+  def report(self):
+    """ One line summary, meant for mission_info.log """
+    values = self.snapshot()
+    return "Sensors: %s, %d passes, errors %s" % (
+           ", ".join("%s %s" % (name, "%.2f" % values[name] if values.get(name) is not None else "n/a")
+                     for name in self.names()),
+           self.passes, ", ".join("%s %d" % (name, self.errors[name]) for name in self.names()))
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="Prints a sensor log as CSV")
+  parser.add_argument("log", help="sensor log (<mission>/sensors.bin)")
+  parser.add_argument("--frames", action="store_true", help="only the records of saved frames")
+  args = parser.parse_args()
+  names = None
+  for seq, monotonic, wall, values in readLog(args.log):
+    if names is None:
+      names = sorted(values)
+      print ",".join(["frame", "time"] + names)
+    if args.frames and seq is None:
+      continue
+    print ",".join(["" if seq is None else str(seq), time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(wall))] +
+                   ["" if values[name] is None else "%.4f" % values[name] for name in names])
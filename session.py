@@ -0,0 +1,103 @@
+import threading
+
+from clock import SystemClock
+
+class CameraSession(object):
+  """ Keeps the camera open between capture cycles
+
+  Opening a PiCamera, applying its settings and letting the auto exposure
+  settle costs seconds, which slave mode used to pay on every rising edge.
+  The session opens the camera on the first acquire() and keeps it open after
+  release() until it has been idle for idle_timeout seconds (0 closes it right
+  away, a negative value never). The settings applied to the open camera are
+  cached, so acquire() only touches the parameters that changed.
+  """
+
+  def __init__(self, factory, idle_timeout=300, warmup=1.0, clock=None, close_timer=True):
+    self.factory = factory
+    self.idle_timeout = idle_timeout
+    self.warmup = warmup
+    self.close_timer = close_timer # without the timer an expired camera is only closed by the next acquire()
+    self.clock = clock if clock is not None else SystemClock()
+    self.camera = None
+    self.applied = {}
+    self.in_use = False
+    self.timer = None
+    self.released_at = None
+    self.lock = threading.Lock()
+    self.opens = 0
+    self.reuses = 0
+
+  def acquire(self, settings):
+    """ Returns the open camera with settings (list of (attribute, value) pairs, applied in order) """
+    with self.lock:
+      self._cancelTimer()
+      if (self.camera is not None and self.released_at is not None and self.idle_timeout > 0 and
+          self.clock.monotonic() - self.released_at >= self.idle_timeout):
+        self._close() # expired, but the timer did not get to close it
+      self.in_use = True
+      if self.camera is None:
+        self.camera = self.factory()
+        self.applied = {}
+        self.opens += 1
+        opened = True
+      else:
+        self.reuses += 1
+        opened = False
+      self._apply(settings)
+    if opened:
+      self.clock.sleep(self.warmup) # lets the sensor and the auto exposure settle
+    return self.camera
+
+  def apply(self, settings):
+    """ Changes settings of the camera in use, like acquire() does. A closed camera gets them on the next acquire() """
+    with self.lock:
+      if self.camera is not None:
+        self._apply(settings)
+
+  def _apply(self, settings):
+    for name, value in settings:
+      if name not in self.applied or self.applied[name] != value:
+        setattr(self.camera, name, value)
+        self.applied[name] = value
+
+  def release(self):
+    """ The cycle is over: the camera stays open until idle_timeout expires """
+    with self.lock:
+      self.in_use = False
+      self.released_at = self.clock.monotonic()
+      if self.camera is None or self.idle_timeout < 0:
+        return
+      if self.idle_timeout == 0:
+        self._close()
+        return
+      if not self.close_timer:
+        return
+      self.timer = threading.Timer(self.idle_timeout, self._expire)
+      self.timer.daemon = True
+      self.timer.start()
+
+  def close(self):
+    """ Closes the camera now """
+    with self.lock:
+      self._cancelTimer()
+      self._close()
+
+  def _expire(self):
+    with self.lock:
+      if not self.in_use:
+        self._close()
+
+  def _cancelTimer(self):
+    if self.timer is not None:
+      self.timer.cancel()
+      self.timer = None
+
+  def _close(self):
+    if self.camera is not None:
+      self.camera.close()
+      self.camera = None
+      self.applied = {}
+
+  def report(self):
+    return "Camera session: %d opens, %d reuses, %s" % (self.opens, self.reuses, "open" if self.camera is not None else "closed")
@@ -0,0 +1,128 @@
+from __future__ import absolute_import
+import math
+import random
+
+# Rough JPEG size relative to quality 85 (the picamera default)
+QUALITY_SIZE = [(1, 0.1), (50, 0.45), (60, 0.52), (70, 0.62), (80, 0.8), (85, 1.0), (90, 1.25), (95, 1.8), (100, 3.0)]
+
+def qualityFactor(quality):
+  for (q0, f0), (q1, f1) in zip(QUALITY_SIZE, QUALITY_SIZE[1:]):
+    if quality <= q1:
+      return f0 + (f1 - f0) * (quality - q0) / float(q1 - q0)
+  return QUALITY_SIZE[-1][1]
+
+class SimulatedCamera(object):
+  """ Stand-in for picamera.PiCamera
+
+  Every capture takes capture_time seconds of the clock (video_port_time
+  through the video port) and produces a frame whose size follows a normal
+  distribution (frame_bytes, frame_bytes_sd) at full resolution and quality
+  85, scaled by the resize area and a rough quality model. Frames captured to a stream get
+  that many bytes written; frames captured to a filename are only written
+  with write_files, their size is kept in `sizes` for whoever accounts for the storage.
+  Settings are plain attributes, like on the real camera. YUV previews show
+  a random scene, brighter or darker with shutter_speed x iso relative to
+  reference_exposure once exposure_mode is 'off'; as on the camera, the
+  gains freeze at the ISO set before exposure_mode went to 'off', a later
+  ISO has no effect until it is turned on again. A still capture with the
+  auto exposure on spends ae_settle_time of its capture_time settling.
+  """
+
+  def __init__(self, clock, capture_time=0.5, video_port_time=0.1, frame_bytes=2500000,
+               frame_bytes_sd=250000, scene_change=1.0, reference_exposure=3800 * 375,
+               ae_settle_time=0.3, seed=0, write_files=False):
+    self.clock = clock
+    self.capture_time = capture_time
+    self.video_port_time = video_port_time
+    self.frame_bytes = frame_bytes
+    self.frame_bytes_sd = frame_bytes_sd
+    self.random = random.Random(seed)
+    self.scene_change = scene_change
+    self.scene = None
+    self.scene_id = 0
+    self.reference_exposure = reference_exposure
+    self.ae_settle_time = ae_settle_time
+    self.write_files = write_files
+    self.resolution = None
+    self._exposure_mode = "auto"
+    self.frozen_iso = None
+    self.sizes = {}
+    self.captures = 0
+    self.closed = False
+
+  @property
+  def exposure_mode(self):
+    return self._exposure_mode
+
+  @exposure_mode.setter
+  def exposure_mode(self, mode):
+    if mode == "off" and self._exposure_mode != "off":
+      self.frozen_iso = getattr(self, "iso", None)
+    self._exposure_mode = mode
+
+  def sizeModel(self, options):
+    """ Mean and standard deviation of the size of a frame captured with options """
+    scale = 1.0
+    resize = options.get("resize")
+    if resize and self.resolution:
+      scale *= float(resize[0] * resize[1]) / (self.resolution[0] * self.resolution[1])
+    if options.get("quality"):
+      scale *= qualityFactor(options["quality"])
+    return self.frame_bytes * scale, self.frame_bytes_sd * scale
+
+  def frameSizes(self, count, options):
+    """ Total size of count frames captured with options, drawn at once (the sum of count normal sizes) """
+    mean, sd = self.sizeModel(options)
+    self.captures += count
+    return max(1024 * count, int(self.random.gauss(count * mean, math.sqrt(count) * sd)))
+
+  def _frameSize(self, options):
+    mean, sd = self.sizeModel(options)
+    return max(1024, int(self.random.gauss(mean, sd)))
+
+  def _output(self, output, size):
+    if hasattr(output, "write"):
+      output.write("\0" * size)
+    else:
+      self.sizes[output] = size
+      if self.write_files:
+        with open(output, "wb") as f:
+          f.write("\0" * size)
+
+  def _preview(self, resize):
+    """ YUV420 preview of the current scene. The scene changes with probability scene_change per preview """
+    width, height = resize
+    stride = (width + 31) // 32 * 32
+    rows = (height + 15) // 16 * 16
+    if self.scene is None or len(self.scene) != stride * rows or self.random.random() < self.scene_change:
+      self.scene_id += 1
+      rng = random.Random(self.scene_id)
+      light = rng.uniform(0.3, 1.0) # some scenes are darker than others
+      self.scene = bytearray(int(rng.getrandbits(8) * light) for i in range(stride * rows))
+    y = self.scene
+    if self.exposure_mode == "off":
+      # fixed exposure: the preview gets brighter with the shutter and the frozen gain
+      gain = self.shutter_speed * self.frozen_iso / float(self.reference_exposure)
+      y = bytearray(min(255, int(v * gain)) for v in y)
+    return str(y) + "\x80" * (stride * rows // 2)
+
+  def capture(self, output, format=None, use_video_port=False, **options):
+    if use_video_port:
+      self.clock.sleep(self.video_port_time)
+    elif self.exposure_mode == "off":
+      self.clock.sleep(self.capture_time - self.ae_settle_time)
+    else:
+      self.clock.sleep(self.capture_time)
+    if format == "yuv":
+      output.write(self._preview(options["resize"]))
+      return
+    self._output(output, self._frameSize(options))
+    self.captures += 1
+
+  def capture_sequence(self, outputs, format="jpeg", use_video_port=False, **options):
+    for output in outputs:
+      self.capture(output, format, use_video_port, **options)
+
+  def close(self):
+    self.closed = True
+    self._exposure_mode = "auto" # the factory hands the same object out again, like a new camera
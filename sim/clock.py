@@ -0,0 +1,31 @@
+from __future__ import absolute_import
+import time
+from datetime import datetime
+
+class VirtualClock(object):
+  """ Clock whose time only moves when somebody sleeps on it
+
+  monotonic() and time() are the same virtual unix time, so a year of
+  sleeps between frames takes no real time at all. Not meant to be shared
+  with threads: everything using it must run in the simulation thread.
+  """
+
+  def __init__(self, start=None):
+    if start is None:
+      start = datetime.now()
+    self.t = time.mktime(start.timetuple()) + start.microsecond * 1e-6
+    self.slept = 0.0
+
+  def monotonic(self):
+    return self.t
+
+  def time(self):
+    return self.t
+
+  def now(self):
+    return datetime.fromtimestamp(self.t)
+
+  def sleep(self, seconds):
+    if seconds > 0:
+      self.t += seconds
+      self.slept += seconds
@@ -0,0 +1,157 @@
+from __future__ import absolute_import
+import Queue
+import threading
+
+from clock import SystemClock
+
+class SimulatedGPIO(object):
+  """ Stand-in for the RPi.GPIO module, for running the camera logic off the Pi
+
+  Outputs are only remembered. Inputs are driven with setInput()/pulse(), and
+  edge callbacks registered with add_event_detect() run on a dispatcher
+  thread, one after the other, like RPi.GPIO does with its callback thread.
+  """
+
+  BCM = 11
+  BOARD = 10
+  OUT = 0
+  IN = 1
+  LOW = 0
+  HIGH = 1
+  PUD_OFF = 20
+  PUD_DOWN = 21
+  PUD_UP = 22
+  RISING = 31
+  FALLING = 32
+  BOTH = 33
+
+  def __init__(self, clock=None):
+    self.clock = clock if clock is not None else SystemClock()
+    self.mode = None
+    self.levels = {}
+    self.directions = {}
+    self.detectors = {}
+    self.output_log = []
+    self.log_outputs = False
+    self.input_sources = {}
+    self.on_since = {}
+    self.on_time = {}
+    self.lock = threading.Lock()
+    self.events = Queue.Queue()
+    self.dispatcher = threading.Thread(target=self._dispatch, name="SimulatedGPIO")
+    self.dispatcher.daemon = True
+    self.dispatcher.start()
+
+  # RPi.GPIO API
+
+  def setmode(self, mode):
+    self.mode = mode
+
+  def setwarnings(self, flag):
+    pass
+
+  def setup(self, channel, direction, pull_up_down=None, initial=None):
+    self.directions[channel] = direction
+    if direction == self.OUT:
+      self.levels[channel] = initial if initial is not None else self.LOW
+    else:
+      self.levels.setdefault(channel, self.HIGH if pull_up_down == self.PUD_UP else self.LOW)
+
+  def output(self, channel, value):
+    value = 1 if value else 0
+    if value != self.levels.get(channel, self.LOW):
+      now = self.clock.monotonic()
+      if value:
+        self.on_since[channel] = now
+      elif channel in self.on_since:
+        self.on_time[channel] = self.on_time.get(channel, 0.0) + now - self.on_since.pop(channel)
+    self.levels[channel] = value
+    if self.log_outputs:
+      self.output_log.append((self.clock.monotonic(), channel, self.levels[channel]))
+
+  def input(self, channel):
+    if channel in self.input_sources:
+      return self.input_sources[channel]()
+    return self.levels.get(channel, self.LOW)
+
+  def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+    with self.lock:
+      if channel in self.detectors:
+        raise RuntimeError("Edge detection already enabled for channel %d" % channel)
+      self.detectors[channel] = {"edge": edge, "callbacks": [callback] if callback else [],
+                                 "bouncetime": (bouncetime or 0) / 1000.0, "last": None}
+
+  def add_event_callback(self, channel, callback):
+    with self.lock:
+      self.detectors[channel]["callbacks"].append(callback)
+
+  def remove_event_detect(self, channel):
+    with self.lock:
+      self.detectors.pop(channel, None)
+
+  def cleanup(self, channel=None):
+    with self.lock:
+      if channel is None:
+        self.detectors.clear()
+        self.levels.clear()
+      else:
+        self.detectors.pop(channel, None)
+        self.levels.pop(channel, None)
+
+  # Simulation helpers
+
+  def setInputSource(self, channel, source):
+    """ input(channel) returns source() from now on (no edge callbacks are fired) """
+    self.input_sources[channel] = source
+
+  def onTime(self, channel):
+    """ Seconds an output has been high """
+    extra = self.clock.monotonic() - self.on_since[channel] if channel in self.on_since else 0.0
+    return self.on_time.get(channel, 0.0) + extra
+
+  def addOnTime(self, channel, seconds):
+    """ Accounts for an output that was high for seconds more, without replaying its edges """
+    self.on_time[channel] = self.on_time.get(channel, 0.0) + seconds
+
+  def setInput(self, channel, value):
+    """ Drives an input pin and fires the matching edge callbacks. Returns True if an edge was detected """
+    value = 1 if value else 0
+    previous = self.levels.get(channel, self.LOW)
+    self.levels[channel] = value
+    if value == previous:
+      return False
+    now = self.clock.monotonic()
+    with self.lock:
+      detector = self.detectors.get(channel)
+      if detector is None:
+        return False
+      edge = self.RISING if value else self.FALLING
+      if detector["edge"] not in (edge, self.BOTH):
+        return False
+      if detector["last"] is not None and now - detector["last"] < detector["bouncetime"]:
+        return False
+      detector["last"] = now
+      callbacks = list(detector["callbacks"])
+    self.events.put((channel, callbacks))
+    return True
+
+  def pulse(self, channel, width=0.0):
+    """ Rising edge, width seconds high, then falling edge """
+    fired = self.setInput(channel, 1)
+    self.clock.sleep(width)
+    self.setInput(channel, 0)
+    return fired
+
+  def settle(self):
+    """ Waits until every queued callback has run """
+    self.events.join()
+
+  def _dispatch(self):
+    while True:
+      channel, callbacks = self.events.get()
+      for callback in callbacks:
+        try:
+          callback(channel)
+        except Exception, err:
+          print "SimulatedGPIO: callback for channel %d failed: %s" % (channel, err)
+      self.events.task_done()
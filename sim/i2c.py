@@ -0,0 +1,65 @@
+from __future__ import absolute_import
+import errno
+import random
+
+class SimulatedSMBus(object):
+  """ Stand-in for smbus.SMBus, to put under an Adafruit_I2C.I2CBus
+
+  Devices are attached at their address as objects with read(register) and
+  write(register, value) over 16-bit big endian registers, like the MCP9808
+  ones. Every transaction takes transfer_time seconds of the clock and fails
+  with EIO with probability error_rate (or when the device raises IOError).
+  Word reads come back byte swapped, as read_word_data does on the Pi.
+  """
+
+  def __init__(self, clock, transfer_time=0.0003, error_rate=0.0, seed=0):
+    self.clock = clock
+    self.transfer_time = transfer_time
+    self.error_rate = error_rate
+    self.random = random.Random(seed)
+    self.devices = {}
+    self.transactions = 0
+
+  def attach(self, address, device):
+    self.devices[address] = device
+
+  def _device(self, address):
+    self.transactions += 1
+    self.clock.sleep(self.transfer_time)
+    if address not in self.devices or (self.error_rate and self.random.random() < self.error_rate):
+      raise IOError(errno.EIO, "Remote I/O error")
+    return self.devices[address]
+
+  def read_word_data(self, address, register):
+    value = self._device(address).read(register)
+    return ((value & 0xFF) << 8) | (value >> 8)
+
+  def read_byte_data(self, address, register):
+    return self._device(address).read(register) >> 8
+
+  def read_i2c_block_data(self, address, register, length):
+    # the register pointer is not incremented, as on the MCP9808
+    value = self._device(address).read(register)
+    return [(value >> 8, value & 0xFF)[i % 2] for i in range(length)]
+
+  def write_word_data(self, address, register, value):
+    self._device(address).write(register, ((value & 0xFF) << 8) | (value >> 8))
+
+  def write_byte_data(self, address, register, value):
+    self._device(address).write(register, value << 8)
+
+class MCP9808Registers(object):
+  """ Register map of an MCP9808 whose temperature comes from a sensor model (see sim.sensor.SimulatedMCP9808) """
+
+  def __init__(self, sensor):
+    self.sensor = sensor
+    self.registers = {0x01: 0x0000, 0x06: 0x0054, 0x07: 0x0400}
+
+  def read(self, register):
+    if register == 0x05:
+      # 13-bit two's complement in sixteenths of a degree
+      return int(round(self.sensor.readTempC() * 16)) & 0x1FFF
+    return self.registers.get(register, 0)
+
+  def write(self, register, value):
+    self.registers[register] = value
@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+import math
+import random
+
+from sampler import TemperatureSampler
+
+class SimulatedMCP9808(object):
+  """ Stand-in for the MCP9808: a daily temperature cycle with noise and an optional I2C error rate """
+
+  def __init__(self, clock, mean=20.0, swing=5.0, cycle=86400.0, noise=0.1, error_rate=0.0, seed=0):
+    self.clock = clock
+    self.mean = mean
+    self.swing = swing
+    self.cycle = cycle
+    self.noise = noise
+    self.error_rate = error_rate
+    self.random = random.Random(seed)
+    self.reads = 0
+
+  def begin(self):
+    return True
+
+  def readTempC(self):
+    self.reads += 1
+    if self.error_rate and self.random.random() < self.error_rate:
+      raise IOError("simulated I2C error")
+    return self.temperature(self.clock.time()) + self.random.gauss(0.0, self.noise)
+
+  def temperature(self, t):
+    """ Temperature of the daily cycle at the unix time t, without the noise """
+    phase = 2 * math.pi * (t % self.cycle) / self.cycle
+    return self.mean + self.swing * math.sin(phase)
+
+  def extremes(self, start, end):
+    """ Lowest and highest temperature of the daily cycle (without the noise) between two unix times """
+    if end - start >= self.cycle:
+      return self.mean - abs(self.swing), self.mean + abs(self.swing)
+    values = [self.temperature(start), self.temperature(end)]
+    for quarter in (0.25, 0.75): # the peak and the trough of the sine
+      t = start - start % self.cycle + quarter * self.cycle
+      if t < start:
+        t += self.cycle
+      if t <= end:
+        values.append(self.temperature(t))
+    return min(values), max(values)
+
+class LazyTemperatureSampler(TemperatureSampler):
+  """ TemperatureSampler without the thread: when a value is asked for and the last sample is older
+  than the sampling interval, a single sample is read then. Samples missed in between are not made up """
+
+  def start(self):
+    self.sampleOnce()
+
+  def stop(self):
+    pass
+
+  def _catchUp(self):
+    now = self.clock.monotonic()
+    if self.samples and now - self.samples[-1][0] < self.interval:
+      return
+    self.sampleOnce()
+
+  def latest(self, max_age=None):
+    self._catchUp()
+    return TemperatureSampler.latest(self, max_age)
+
+  def _fresh(self, max_age):
+    self._catchUp()
+    return TemperatureSampler._fresh(self, max_age)
@@ -0,0 +1,27 @@
+from __future__ import absolute_import
+import posix
+
+class SimulatedCard(object):
+  """ SD card of `capacity` bytes with `used` bytes already taken. statvfs() can be handed to StorageBudget """
+
+  def __init__(self, capacity, used=0, block_size=4096):
+    self.capacity = capacity
+    self.used = used
+    self.block_size = block_size
+
+  def add(self, nbytes, count=1):
+    """ Writes count files of nbytes bytes in total. Each file is rounded up to whole blocks; for several
+    files at once the rounding is taken as half a block each """
+    if count == 1:
+      blocks = (nbytes + self.block_size - 1) // self.block_size
+    else:
+      blocks = (nbytes + count * self.block_size // 2) // self.block_size
+    self.used += blocks * self.block_size
+
+  def free(self):
+    return max(0, self.capacity - self.used)
+
+  def statvfs(self, path):
+    blocks = self.capacity // self.block_size
+    free = self.free() // self.block_size
+    return posix.statvfs_result((self.block_size, self.block_size, blocks, free, free, 0, 0, 0, 0, 255))
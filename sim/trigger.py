@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+import random
+
+from trigger import EdgeTrigger
+
+class PulseTrain(object):
+  """ Glider signal: pulses of `width` seconds, either every `every` seconds (+- jitter) from `start`
+  or at the explicit monotonic `times`. Edges are generated lazily, so a year of pulses costs nothing """
+
+  def __init__(self, start, every=None, width=1.0, jitter=0.0, times=None, seed=0):
+    self.width = width
+    if times is not None:
+      self.edges = iter(sorted(times))
+    else:
+      self.edges = self._periodic(start, every, jitter, random.Random(seed))
+    self.current = None
+    self.next = next(self.edges, None)
+
+  @staticmethod
+  def _periodic(start, every, jitter, rng):
+    k = 1
+    while True:
+      yield start + k * every + (rng.uniform(-jitter, jitter) if jitter else 0.0)
+      k += 1
+
+  def peek(self):
+    """ Time of the next rising edge not consumed yet (None: no more edges) """
+    return self.next
+
+  def pop(self):
+    edge = self.next
+    self.current = edge
+    self.next = next(self.edges, None)
+    return edge
+
+  def level(self, now):
+    """ Signal level at now (now must not go backwards) """
+    while self.next is not None and self.next <= now:
+      self.pop()
+    return 1 if self.current is not None and now < self.current + self.width else 0
+
+class VirtualTrigger(EdgeTrigger):
+  """ EdgeTrigger fed by a PulseTrain on a virtual clock: wait() sleeps the clock up to the next edge
+
+  With `until` (monotonic), a wait stretches over the timeout up to the next edge or `until`, whichever
+  comes first, so the idle time between pulses is crossed in a single jump instead of one timeout at a
+  time. Only for callers that do nothing between two waits that depends on the time.
+  """
+
+  def __init__(self, gpio, pin, pulses, clock, until=None):
+    EdgeTrigger.__init__(self, gpio, pin, clock=clock)
+    self.pulses = pulses
+    self.until = until
+
+  def pending(self):
+    edge = self.pulses.peek()
+    return edge is not None and edge <= self.clock.monotonic()
+
+  def wait(self, timeout=None):
+    edge = self.pulses.peek()
+    now = self.clock.monotonic()
+    if self.until is not None and timeout is not None and now < self.until:
+      limit = self.until if edge is None else min(edge, self.until)
+      timeout = max(timeout, limit - now)
+    if edge is None or (timeout is not None and edge > now + timeout):
+      self.clock.sleep(timeout if timeout is not None else 0.0)
+      return None
+    self.clock.sleep(edge - now)
+    self.edges += 1
+    return self.pulses.pop()
+
+  def discard(self):
+    while self.pending():
+      self.pulses.pop()
+      self.edges += 1
+      self.discarded += 1
@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# Replays a mission in virtual time: the real GliderCamera control logic
+# (schedule, temperature gate, storage budget, state LEDs, slave cycles) runs
+# against simulated camera, GPIO, temperature sensor and SD card, and every
+# sleep only moves a virtual clock. Prints how many frames the configuration
+# gives, the gaps, the storage curve and the LED on-time.
+#
+# So that a year replays in seconds, the waits between slave pulses end in a
+# single jump at the next pulse, and in master mode, once a frame has gone
+# through the capture path, the following ones are replayed from the models
+# alone: stretches whose outcome is certain (temperature far from the limits,
+# room on the card, no threshold or new day to cross) at once, the others
+# frame by frame. Not with dedup, exposure, the adaptive policy or sensor
+# errors, which need every frame. --exact sends every frame through capture.
+#
+#   python simulate.py --card-gb 32 --frame-kb 2500
+#   python simulate.py --mode slave --trigger-every 600 --days 30
+import argparse
+import math
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from camera import GliderCamera
+from config import MissionConfig
+from frame_index import FrameRecord
+from instrument import NullTimer
+from scheduler import CaptureScheduler
+from storage import StorageBudget
+from sim.camera import SimulatedCamera
+from sim.clock import VirtualClock
+from sim.gpio import SimulatedGPIO
+from sim.sensor import SimulatedMCP9808, LazyTemperatureSampler
+from sim.storage import SimulatedCard
+from sim.trigger import PulseTrain, VirtualTrigger
+
+class MissionEnded(Exception):
+  """ Raised when the mission reaches its end date (instead of shutting the system down) """
+
+class _NullOutput(object):
+  def write(self, text):
+    pass
+
+class MissionStats(object):
+  """ What happened during a simulated mission """
+
+  def __init__(self, period, gap_factor=1.5):
+    self.period = period
+    self.gap_threshold = period * gap_factor
+    self.frames = 0
+    self.cycles = 0
+    self.bytes = 0
+    self.temperature_rejects = 0
+    self.gaps = 0
+    self.longest_gap = 0.0
+    self.last_frame = None
+    self.first_frame = None
+    self.threshold_crossed = None
+    self.card_full = 0
+    self.curve = [] # (date, frames, free bytes), one point per day
+    self.next_day = None
+    self.batched = 0
+
+  def frameSaved(self, wall, size, free, above_threshold):
+    if self.last_frame is not None:
+      interval = wall - self.last_frame
+      if interval > self.gap_threshold:
+        self.gaps += 1
+        self.longest_gap = max(self.longest_gap, interval)
+    else:
+      self.first_frame = wall
+    if self.next_day is None or wall >= self.next_day:
+      day = datetime.fromtimestamp(wall).date()
+      self.curve.append((day, self.frames, free))
+      self.next_day = time.mktime((day + timedelta(days=1)).timetuple())
+    self.frames += 1
+    self.bytes += size
+    self.last_frame = wall
+    if not above_threshold and self.threshold_crossed is None:
+      self.threshold_crossed = wall
+
+  def framesSaved(self, wall, count, size, free, above_threshold):
+    """ count frames of size bytes in total, one every period from wall, none of them on a new day """
+    self.frameSaved(wall, size, free, above_threshold)
+    self.frames += count - 1
+    self.last_frame = wall + (count - 1) * self.period
+
+class SimulatedGliderCamera(GliderCamera):
+  """ GliderCamera with the background threads, the disk and the system shutdown replaced by simulated ones """
+
+  # Margin, in standard deviations of the sensor noise and of the frame size, before a steady stretch is
+  # thought to be able to change the outcome of a frame, and the chance allowed for a card-full stretch
+  # to hide a frame small enough to fit
+  STEADY_SIGMAS = 6
+  STEADY_RISK = 0.01
+  MIN_BATCH = 8
+
+  def __init__(self, args, clock, gpio, camera, sensor, card, pulses):
+    self.args = args
+    self.card = card
+    self.pulses = pulses
+    self.sim_camera = camera
+    self.sim_sensor = sensor
+    self.next_seq = 0
+    self.led_time = None # illumination LED on-time and duration of a frame that passed the temperature gate
+    self.frame_time = None
+    self.stretch = self.MIN_BATCH
+    GliderCamera.__init__(self, args.config, args.camera_config, gpio=gpio,
+                          camera_factory=lambda: camera, temp_sensor=sensor, clock=clock)
+    self.stats = MissionStats(self.period)
+    self.session.close_timer = False
+
+  def readConfig(self, config_filename, camera_config_filename):
+    GliderCamera.readConfig(self, config_filename, camera_config_filename)
+    self.config_watcher = None # the command line overrides would not survive a reload
+    # Command line overrides of the mission settings, applied to the configuration so the
+    # scheduler is built with them
+    for name in ("mode", "period", "photos_per_cycle", "slave_trigger", "burst_mode", "missed_frame_policy"):
+      value = getattr(self.args, name)
+      if value is not None:
+        setattr(self.config, name, value)
+    self.mode = self.config.mode
+    self.slave_trigger = self.config.slave_trigger
+    self.setMissionConfig()
+    self.scheduler = CaptureScheduler(self.period, self.missed_frame_policy, clock=self.clock)
+    if self.args.dedup:
+      self.camera_config.dedup = True
+    if self.args.exposure:
+      self.camera_config.exposure_predictor = True
+    if self.args.days is not None:
+      self.end_date = self.start_date + timedelta(days=self.args.days)
+
+  def startSensor(self):
+    GliderCamera.startSensor(self)
+    self.temp_sampler = LazyTemperatureSampler(self.temp_sensor, self.camera_config.temp_sample_interval,
+                                               self.camera_config.temp_buffer_size, self.camera_config.temp_max_age,
+                                               self.camera_config.temp_smoothing, clock=self.clock)
+
+  def startStorage(self):
+    self.path = self.mission_name
+    self.memory_threshold = self.camera_config.memory_threshold
+    self.storage = StorageBudget(self.path, self.memory_threshold, resync_frames=self.camera_config.storage_resync_frames,
+                                 clock=self.clock, statvfs=self.card.statvfs)
+    self.index = None
+    self.segments = None
+    self.writer = None
+    self.timer = NullTimer()
+
+  def startState(self):
+    self.state = None # every run is a whole mission
+    self.resume = None
+
+  def startSensorHub(self):
+    self.sensors = None
+
+  def startHousekeeping(self):
+    self.housekeeper = None # a single process on the virtual clock
+
+  def startThreads(self):
+    self.temp_sampler.start() # no thread: samples are taken when asked for
+
+  def startTrigger(self):
+    # Nothing the edge loop does between two waits depends on the time but the end date
+    until = time.mktime(self.end_date.timetuple())
+    return VirtualTrigger(self.gpio, self.signal_input, self.pulses, self.clock, until=until)
+
+  def shutdown(self):
+    raise MissionEnded()
+
+  def captureCycle(self, trigger_time=None, count=None):
+    self.stats.cycles += 1
+    GliderCamera.captureCycle(self, trigger_time, count)
+
+  def capture(self):
+    rejects = self.stats.temperature_rejects
+    led_on = self.gpio.onTime(self.led_output)
+    GliderCamera.capture(self)
+    if self.stats.temperature_rejects == rejects:
+      self.led_time = self.gpio.onTime(self.led_output) - led_on
+      self.frame_time = self.clock.monotonic() - self.scheduler.last_fire
+    if self.mode == "master" and not self.args.exact and self.canReplay():
+      self.replayFrames()
+
+  def canReplay(self):
+    """ True when nothing but the temperature, the card and the storage decides how the next frames end,
+    and each of them fits in its slot """
+    return (self.dedup is None and self.exposure is None and not self.adaptive_policy and
+            not self.sim_sensor.error_rate and self.frame_time is not None and
+            self.frame_time < self.scheduler.period and self.scheduler.last_lateness == 0)
+
+  def replayFrames(self):
+    """ Accounts for the frames up to the end date without going through capture(). Stretches whose
+    outcome is certain are accounted for at once; near the temperature limits the gate is drawn frame by
+    frame from the sensor model, sampled and smoothed like the LazyTemperatureSampler does """
+    period = self.scheduler.period
+    left = int((time.mktime(self.end_date.timetuple()) - self.clock.monotonic()) / period) - 1
+    sampler = self.temp_sampler
+    self.readings = deque(list(sampler.samples)[-sampler.smoothing:], maxlen=sampler.smoothing)
+    samples = min(sampler.smoothing, int(sampler.max_age / max(period, sampler.interval)) + 1)
+    margin = self.STEADY_SIGMAS * self.sim_sensor.noise / math.sqrt(samples)
+    self.above_threshold = self.storage.aboveThreshold()
+    while left > 0:
+      deadline = self.scheduler.deadline()
+      outcome, count = self.steadyStretch(deadline, left, margin)
+      if count == 0:
+        count = min(left, self.MIN_BATCH)
+        for k in range(count):
+          self.clock.sleep(period)
+          self.replayFrame(deadline + k * period)
+      else:
+        self.clock.sleep(count * period)
+        self.replayStretch(deadline, outcome, count)
+      self.scheduler.advance(count)
+      self.stats.batched += count
+      left -= count
+    sampler.samples.extend(self.readings)
+
+  def replayStretch(self, deadline, outcome, count):
+    """ Accounts for count frames from deadline that all end with outcome """
+    if outcome == "rejected":
+      self.stats.temperature_rejects += count
+      return
+    self.gpio.addOnTime(self.led_output, count * self.led_time)
+    if outcome == "card_full":
+      self.stats.card_full += count
+      self.sim_camera.captures += count
+      return
+    size = self.sim_camera.frameSizes(count, self.capture_options)
+    self.card.add(size, count)
+    self.storage.add(size, count)
+    self.stats.framesSaved(deadline + self.led_time_on_capture, count, size, self.storage.freeBytes(),
+                           self.storage.aboveThreshold())
+    self.next_seq += count
+    self.policy.frameCaptured(count)
+    self.last_capture = self.stats.last_frame
+
+  def replayFrame(self, deadline):
+    """ Accounts for the frame of deadline, its temperature drawn from the sensor model """
+    sampler = self.temp_sampler
+    if not self.readings or deadline - self.readings[-1][0] >= sampler.interval:
+      sensor = self.sim_sensor
+      sensor.reads += 1
+      self.readings.append((deadline, sensor.temperature(deadline) + sensor.random.gauss(0.0, sensor.noise)))
+    fresh = [value for t, value in self.readings if t >= deadline - sampler.max_age]
+    if not self.checkTemperature(sum(fresh) / len(fresh)):
+      return
+    self.gpio.addOnTime(self.led_output, self.led_time)
+    size = self.sim_camera.frameSizes(1, self.capture_options)
+    if self.card.free() < size:
+      self.stats.card_full += 1
+      return
+    self.card.add(size)
+    self.storage.add(size)
+    self.stats.frameSaved(deadline + self.led_time_on_capture, size, self.storage.freeBytes(),
+                          self.storage.aboveThreshold())
+    self.next_seq += 1
+    self.policy.frameCaptured()
+    self.last_capture = self.stats.last_frame
+    if self.storage.aboveThreshold() != self.above_threshold:
+      self.above_threshold = not self.above_threshold
+      self.indicateMemory()
+
+  def steadyStretch(self, start, count, margin):
+    """ (outcome, frames) for a run of at most count frames from the deadline start that would surely all
+    end the same way ("saved", "rejected" or "card_full"), or (None, 0). Temperatures within margin of
+    the limits could go either way """
+    period = self.scheduler.period
+    # The length tried grows while stretches are steady and shrinks near the limits, so a frame by frame
+    # stretch costs a single look at the temperature
+    count = min(count, self.stretch)
+    if count < self.MIN_BATCH:
+      return None, 0
+    low, high = self.sim_sensor.extremes(start, start + count * period)
+    if high + margin < self.min_temp or low - margin > self.max_temp:
+      self.stretch = min(2 * self.stretch, int(self.sim_sensor.cycle / period))
+      return "rejected", count
+    if not (low - margin > self.min_temp and high + margin < self.max_temp):
+      self.stretch = max(self.MIN_BATCH, self.stretch // 2)
+      return None, 0
+    self.stretch = min(2 * self.stretch, int(self.sim_sensor.cycle / period))
+    mean, sd = self.sim_camera.sizeModel(self.capture_options)
+    largest = mean + self.STEADY_SIGMAS * sd + self.card.block_size
+    if self.card.free() < largest:
+      # A frame from the low tail of the sizes still fits now and then
+      fits = 0.5 * math.erfc((mean - self.card.free()) / (sd * math.sqrt(2))) if sd > 0 else 0.0
+      if fits > 0:
+        count = min(count, int(self.STEADY_RISK / fits))
+      return ("card_full", count) if count >= self.MIN_BATCH else (None, 0)
+    # Saved frames: room on the card, no threshold crossed and no new point of the storage curve
+    if self.stats.next_day is None:
+      return None, 0
+    count = min(count, int(self.card.free() / largest))
+    if self.storage.aboveThreshold():
+      count = min(count, int((self.storage.freeBytes() - self.storage.threshold) / largest))
+    count = min(count, int((self.stats.next_day - start - self.led_time_on_capture) / period))
+    return ("saved", count) if count >= self.MIN_BATCH else (None, 0)
+
+  def checkTemperature(self, temp):
+    ok = GliderCamera.checkTemperature(self, temp)
+    if not ok:
+      self.stats.temperature_rejects += 1
+    return ok
+
+  def newFrame(self, temp):
+    seq = self.next_seq
+    self.next_seq += 1
+    return FrameRecord(seq, self.clock.monotonic(), self.clock.time(), temp, 0, "%d.jpg" % seq)
+
+  def frameFilename(self, record):
+    return record.path
+
+  def fileSize(self, filename):
+    return self.sim_camera.sizes.pop(filename)
+
+  def frameSaved(self, record, size):
+    if self.card.free() < size:
+      self.stats.card_full += 1 # the write would fail
+      return
+    self.card.add(size)
+    self.storage.add(size)
+    self.stats.frameSaved(record.wall, size, self.storage.freeBytes(), self.storage.aboveThreshold())
+
+  def __del__(self):
+    pass
+
+  def summary(self, elapsed):
+    s = self.stats
+    mission = (self.end_date - self.start_date).total_seconds()
+    lines = ["Simulated mission %s (%s mode) from %s to %s" % (self.mission_name, self.mode, self.start_date, self.end_date),
+             "  Replayed %.1f days in %.1fs of real time (%d frames batched)" % (mission / 86400.0, elapsed, s.batched),
+             "  Frames saved:           %d (%.1f GB)" % (s.frames, s.bytes / 1e9)]
+    if self.mode == "master":
+      lines.append("  Frames expected:        %d (one every %ss)" % (int(mission / float(self.period)), self.period))
+      lines.append("  Skipped slots:          %d" % self.scheduler.skipped)
+    else:
+      lines.append("  Capture cycles:         %d" % s.cycles)
+      if self.trigger is not None:
+        lines.append("  Trigger edges:          %d (%d during cycles)" % (self.trigger.edges, self.trigger.discarded))
+      if self.trigger is not None and self.trigger.latencies:
+        lines.append("  Trigger latency:        p50 %.3fs p95 %.3fs max %.3fs" % (
+                     self.trigger.percentile(50), self.trigger.percentile(95), self.trigger.latency_max))
+    lines.append("  Temperature rejects:    %d" % s.temperature_rejects)
+    lines.append("  Lost, card full:        %d" % s.card_full)
+    lines.append("  Gaps over %5.1fs:       %d (longest %.1fs)" % (s.gap_threshold, s.gaps, s.longest_gap))
+    if s.threshold_crossed is not None:
+      lines.append("  Memory threshold:       crossed on %s" % datetime.fromtimestamp(s.threshold_crossed))
+    else:
+      lines.append("  Memory threshold:       never crossed")
+    lines.append("  Free space at the end:  %.2f GB" % (self.storage.freeBytes() / 1e9))
+    lines.append("  Illumination LED on:    %.1fs" % self.gpio.onTime(self.led_output))
+    lines.append("  Red state LED on:       %.1fs" % self.leds.onTime(self.led_state_red))
+    lines.append("  Green state LED on:     %.1fs" % self.leds.onTime(self.led_state_green))
+    if self.dedup is not None:
+      lines.append("  Near-duplicates:        %d dropped, %d kept" % (self.dedup.dropped, self.dedup.kept))
+    if self.exposure is not None:
+      lines.append("  Exposure:               shutter %dus, ISO %d, preview mean %.1f" % (
+                   self.exposure.shutter, self.exposure.iso, self.exposure.mean or 0.0))
+    if self.adaptive_policy:
+      lines.append("  Capture policy changes: %d" % len(self.policy.decisions))
+      for wall, previous, current, reason in self.policy.decisions[:self.args.curve_points]:
+        lines.append("    %s level %d -> %d: %s" % (datetime.fromtimestamp(wall), previous, current, reason))
+    lines.append("  Storage curve (date, frames, free GB):")
+    step = max(1, len(s.curve) // self.args.curve_points)
+    for day, frames, free in s.curve[::step]:
+      lines.append("    %s %10d %8.2f" % (day, frames, free / 1e9))
+    return "\n".join(lines)
+
+def main():
+  parser = argparse.ArgumentParser(description="Replays a GliderCamera mission in virtual time")
+  parser.add_argument("--config", default="config.yaml")
+  parser.add_argument("--camera-config", default="camera_config.yaml")
+  parser.add_argument("--mode", choices=["master", "slave"], help="overrides the mode of the configuration")
+  parser.add_argument("--period", type=float, help="overrides the period of the configuration")
+  parser.add_argument("--photos-per-cycle", type=int)
+  parser.add_argument("--slave-trigger", choices=["edge", "poll"])
+  parser.add_argument("--burst-mode", type=lambda v: v.lower() in ("1", "true", "yes"))
+  parser.add_argument("--missed-frame-policy", choices=["skip", "catchup", "compress"])
+  parser.add_argument("--days", type=float, help="simulates only the first DAYS days of the mission")
+  parser.add_argument("--card-gb", type=float, default=32.0, help="capacity of the SD card")
+  parser.add_argument("--used-gb", type=float, default=4.0, help="space already used on the card")
+  parser.add_argument("--frame-kb", type=float, default=2500.0, help="mean JPEG size")
+  parser.add_argument("--frame-kb-sd", type=float, default=250.0, help="standard deviation of the JPEG size")
+  parser.add_argument("--dedup", action="store_true", help="turns the near-duplicate suppression on")
+  parser.add_argument("--exposure", action="store_true", help="turns the exposure prediction on")
+  parser.add_argument("--scene-change", type=float, default=1.0, help="probability of a new scene at each frame")
+  parser.add_argument("--capture-time", type=float, default=0.5, help="seconds per still capture")
+  parser.add_argument("--ae-settle", type=float, default=0.3,
+                      help="seconds of each still capture spent settling the auto exposure (not with a fixed exposure)")
+  parser.add_argument("--temp-mean", type=float, default=20.0)
+  parser.add_argument("--temp-swing", type=float, default=5.0, help="amplitude of the daily temperature cycle")
+  parser.add_argument("--temp-error-rate", type=float, default=0.0, help="fraction of failed sensor reads")
+  parser.add_argument("--trigger-every", type=float, default=600.0, help="seconds between glider pulses (slave)")
+  parser.add_argument("--trigger-jitter", type=float, default=0.0)
+  parser.add_argument("--trigger-width", type=float, default=1.0, help="pulse width in seconds")
+  parser.add_argument("--trigger-times", help="file with the pulse times, seconds from the mission start, one per line")
+  parser.add_argument("--curve-points", type=int, default=24, help="lines of the storage curve")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--exact", action="store_true", help="replays every frame through the capture path "
+                      "instead of accounting for steady stretches at once")
+  parser.add_argument("--verbose", action="store_true", help="shows the camera log")
+  args = parser.parse_args()
+
+  # The mission start is only known once the configuration is read, so the clock starts at the start
+  # date of the configuration file (read twice, it is cheap)
+  start = MissionConfig.load(args.config).start_date
+  clock = VirtualClock(start)
+  gpio = SimulatedGPIO(clock)
+  camera = SimulatedCamera(clock, args.capture_time, frame_bytes=int(args.frame_kb * 1000),
+                           frame_bytes_sd=int(args.frame_kb_sd * 1000), scene_change=args.scene_change,
+                           ae_settle_time=args.ae_settle, seed=args.seed)
+  sensor = SimulatedMCP9808(clock, args.temp_mean, args.temp_swing, error_rate=args.temp_error_rate, seed=args.seed)
+  card = SimulatedCard(int(args.card_gb * 1e9), int(args.used_gb * 1e9))
+  if args.trigger_times:
+    with open(args.trigger_times) as f:
+      times = [clock.monotonic() + float(line) for line in f if line.strip()]
+    pulse_args = dict(width=args.trigger_width, times=times)
+  else:
+    pulse_args = dict(every=args.trigger_every, width=args.trigger_width, jitter=args.trigger_jitter, seed=args.seed)
+  pulses = PulseTrain(clock.monotonic(), **pulse_args)
+  level = PulseTrain(clock.monotonic(), **pulse_args) # same pulses, for the polled input
+
+  stdout = sys.stdout
+  if not args.verbose:
+    sys.stdout = _NullOutput()
+  started = time.time()
+  try:
+    glider = SimulatedGliderCamera(args, clock, gpio, camera, sensor, card, pulses)
+    gpio.setInputSource(glider.signal_input, lambda: level.level(clock.monotonic()))
+    try:
+      glider.run()
+    except MissionEnded:
+      pass
+  finally:
+    sys.stdout = stdout
+  print glider.summary(time.time() - started)
+
+if __name__ == "__main__":
+  main()
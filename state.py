@@ -0,0 +1,90 @@
+import json
+import math
+import os
+
+from clock import SystemClock
+
+class MissionState(object):
+  """ Crash-safe checkpoint of the mission progress
+
+  The glider can brown out at any time, and boot.sh then starts the camera
+  again from scratch. A small JSON checkpoint with the frame counter, the
+  last capture time, the storage accounting and the schedule phase is
+  rewritten every save_frames frames (or save_interval seconds), so the
+  restarted camera goes on with the same sequence and cadence. Each save goes
+  to a temporary file that is fsync'ed and renamed over the previous one, so
+  after a power cut the file holds either the old or the new checkpoint,
+  never a torn one. Loading it is one small read.
+  """
+
+  VERSION = 1
+
+  def __init__(self, filename, save_frames=10, save_interval=60, clock=None):
+    self.filename = filename
+    self.save_frames = save_frames
+    self.save_interval = save_interval
+    self.clock = clock if clock is not None else SystemClock()
+    self.frames_since_save = 0
+    self.last_save = self.clock.monotonic()
+    self.saves = 0
+    self.errors = 0
+
+  def load(self):
+    """ Returns the last checkpoint, or None if there is none or it cannot be read """
+    try:
+      with open(self.filename, "r") as f:
+        state = json.load(f)
+    except IOError:
+      return None
+    except ValueError:
+      print "Mission state %s is not readable, starting from scratch" % self.filename
+      return None
+    if state.get("version") != MissionState.VERSION:
+      return None
+    return state
+
+  def save(self, state):
+    """ Atomically replaces the checkpoint with state (a dict of JSON types) """
+    state = dict(state, version=MissionState.VERSION)
+    tmp = self.filename + ".tmp"
+    try:
+      with open(tmp, "w") as f:
+        json.dump(state, f, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+      os.rename(tmp, self.filename)
+      # the rename itself is only durable once the directory is synced
+      fd = os.open(os.path.dirname(os.path.abspath(self.filename)), os.O_RDONLY)
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+    except (IOError, OSError), err:
+      # a full card must not stop the capture loop
+      self.errors += 1
+      print "Mission state not saved: %s" % err
+      return False
+    self.saves += 1
+    self.frames_since_save = 0
+    self.last_save = self.clock.monotonic()
+    return True
+
+  def frameCaptured(self, count=1):
+    self.frames_since_save += count
+
+  def due(self):
+    """ True when the checkpoint should be rewritten """
+    return (self.frames_since_save >= self.save_frames or
+            (self.frames_since_save > 0 and self.clock.monotonic() - self.last_save >= self.save_interval))
+
+  def report(self):
+    """ One line summary, meant for mission_info.log """
+    return "Mission state: %d checkpoints saved to %s (%d errors)" % (self.saves, self.filename, self.errors)
+
+def nextSlot(next_deadline, period, now):
+  """ First slot of a wall clock grid (next_deadline + k * period) that is not before now,
+  and the number of slots that have passed """
+  if next_deadline >= now:
+    return next_deadline, 0
+  missed = int(math.ceil((now - next_deadline) / period))
+  return next_deadline + missed * period, missed
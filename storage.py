@@ -0,0 +1,108 @@
+import os
+
+from clock import SystemClock
+
+class StorageBudget(object):
+  """ Keeps track of the free space of the filesystem holding the images
+
+  A statvfs() call gives the baseline, after which every saved image is
+  accounted for by its size rounded up to whole filesystem blocks. The real
+  figure is re-read only every resync_frames images (or resync_interval
+  seconds), so checking the budget from the capture loop costs nothing.
+  Sizes are in bytes except the threshold, which is in kilobytes like the
+  "Available" column of df.
+  """
+
+  def __init__(self, path, threshold_kb, resync_frames=500, resync_interval=3600, clock=None, statvfs=os.statvfs):
+    self.path = path
+    self.threshold = threshold_kb * 1024
+    self.resync_frames = resync_frames
+    self.resync_interval = resync_interval
+    self.clock = clock if clock is not None else SystemClock()
+    self.statvfs = statvfs
+    self.frames = 0
+    self.bytes_written = 0
+    self.bytes_per_frame = None
+    self.drift = 0
+    self.free = None
+    self.frames_since_sync = 0
+    self.sync()
+
+  def sync(self):
+    """ Re-reads the real free space from the filesystem """
+    st = self.statvfs(self.path)
+    free = st.f_bavail * st.f_frsize
+    if self.frames_since_sync > 0:
+      self.drift = self.free - free # how far the estimate was off (other writers, metadata...)
+    self.block_size = st.f_frsize
+    self.total = st.f_blocks * st.f_frsize
+    self.free = free
+    self.frames_since_sync = 0
+    self.last_sync = self.clock.monotonic()
+
+  def add(self, nbytes, count=1):
+    """ Accounts for a new image of nbytes bytes (or count images of nbytes bytes in total, each
+    taken as rounded up by half a block) """
+    if count == 1:
+      blocks = (nbytes + self.block_size - 1) // self.block_size
+    else:
+      blocks = (nbytes + count * self.block_size // 2) // self.block_size
+    self.free -= blocks * self.block_size
+    self.frames += count
+    self.bytes_written += nbytes
+    # Exponential moving average, so a change of scene or settings shows up within a few dozen frames
+    size = nbytes / float(count)
+    if self.bytes_per_frame is None:
+      self.bytes_per_frame = size
+    else:
+      self.bytes_per_frame += (1 - 0.95 ** count) * (size - self.bytes_per_frame)
+    self.frames_since_sync += count
+    if (self.frames_since_sync >= self.resync_frames or
+        self.clock.monotonic() - self.last_sync >= self.resync_interval):
+      self.sync()
+
+  def state(self):
+    """ Accounting to carry over a reboot (the free space itself is re-read) """
+    return {"frames": self.frames, "bytes_written": self.bytes_written, "bytes_per_frame": self.bytes_per_frame}
+
+  def restore(self, state):
+    """ Restores the accounting saved by state() """
+    self.frames = state["frames"]
+    self.bytes_written = state["bytes_written"]
+    self.bytes_per_frame = state["bytes_per_frame"]
+
+  def follow(self, free, state):
+    """ Takes over the figures of a budget kept by another process (see housekeeping.py) """
+    self.restore(state)
+    self.free = free
+
+  def addFile(self, filename):
+    """ Accounts for an image already written to disk """
+    self.add(os.path.getsize(filename))
+
+  def freeBytes(self):
+    return self.free
+
+  def aboveThreshold(self):
+    """ True while the free space is over the memory threshold """
+    return self.free > self.threshold
+
+  def framesAffordable(self):
+    """ Number of frames of the current average size that still fit above the threshold """
+    if not self.bytes_per_frame:
+      return None
+    return max(0, int((self.free - self.threshold) / self.bytes_per_frame))
+
+  def framesNeeded(self, now, end_date, period):
+    """ Number of frames left until end_date at one frame every period seconds """
+    left = (end_date - now).total_seconds()
+    return max(0, int(left / period))
+
+  def report(self, now=None, end_date=None, period=None):
+    """ One line summary of the storage budget, meant for mission_info.log """
+    line = "Storage: %.1f MB free (threshold %.1f MB)" % (self.free / 1e6, self.threshold / 1e6)
+    if self.bytes_per_frame:
+      line += ", %.0f KB/frame, %d frames affordable" % (self.bytes_per_frame / 1e3, self.framesAffordable())
+    if end_date is not None:
+      line += ", %d frames until end date" % self.framesNeeded(now, end_date, period)
+    return line
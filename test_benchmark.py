@@ -0,0 +1,26 @@
+import argparse
+import os
+
+import pytest
+
+import benchmark
+
+def test_compare_reports_metrics_worse_than_the_tolerance():
+  baselines = {"cases": {"master-files": {"fps": 100.0, "latency_p50": 0.01, "trigger_p95": None, "cpu": 50.0}}}
+  results = [("master-files", {"fps": 70.0, "latency_p50": 0.0115, "trigger_p95": 0.5, "cpu": 10.0}),
+             ("slave-edge", {"fps": 1.0})]
+  regressions = benchmark.compare(results, baselines, 0.2)
+  assert len(regressions) == 1
+  assert regressions[0].startswith("master-files fps: 70 against 100")
+
+@pytest.mark.parametrize("name", [case[0] for case in benchmark.CASES])
+def test_case_runs_on_the_simulated_hardware(name, monkeypatch):
+  monkeypatch.chdir(os.getcwd()) # runCase changes the working directory
+  args = argparse.Namespace(frames=20, cycles=3, capture_time=0.001, frame_kb=10, period=0.001,
+                            trigger_period=0.02, seed=0)
+  result = benchmark.runCase(name, args)
+  assert result["frames"] >= 3
+  assert result["fps"] > 0
+  assert result["latency_p50"] <= result["latency_p95"] <= result["latency_max"]
+  if name.startswith("slave"):
+    assert result["trigger_p50"] is not None
@@ -0,0 +1,45 @@
+import pytest
+
+def test_master_frames_follow_the_grid(mission):
+  mission.configure({"mode": "master", "period": 10})
+  camera = mission.start(power_cut=lambda camera: len(camera.index) == 5)
+  assert camera.runMission() == "power cut"
+  walls = [record.wall for record in mission.frames()]
+  assert [round(b - a, 6) for a, b in zip(walls, walls[1:])] == [10] * 4
+
+def test_slave_cycle_takes_photos_per_cycle_at_each_pulse(mission):
+  mission.configure({"mode": "slave", "slave_trigger": "edge", "photos_per_cycle": 3, "period": 1, "burst_mode": False})
+  mission.pulseAt(10, 100)
+  camera = mission.start()
+  assert camera.runMission() == "end date"
+  camera.close()
+  assert camera.slave_cycles == 2
+  assert [record.seq for record in mission.frames()] == range(6)
+
+def test_out_of_temperature_frames_are_not_taken(mission):
+  mission.configure({"mode": "master", "period": 10}, {"min_temp": 25, "max_temp": 30})
+  camera = mission.start(power_cut=lambda camera: camera.scheduler.frames == 5)
+  assert camera.runMission() == "power cut"
+  assert mission.frames() == []
+
+def test_still_scene_is_saved_every_dedup_keep_every_frames(mission):
+  pytest.importorskip("numpy")
+  mission.configure({"mode": "master", "period": 10}, {"dedup": True, "dedup_keep_every": 5})
+  mission.camera.scene_change = 0.0
+  camera = mission.start(power_cut=lambda camera: camera.scheduler.frames == 12)
+  assert camera.runMission() == "power cut"
+  assert camera.dedup.dropped == 9
+  assert len(mission.frames()) == 3
+
+def test_split_mission_indexes_every_frame_across_housekeeping_restarts(mission):
+  mission.configure({"mode": "master", "period": 10}, {"process_split": True, "process_restart_delay": 0.1})
+  def kill(camera):
+    if camera.index.next_seq == 5:
+      camera.housekeeper.proc.kill()
+    return camera.index.next_seq == 15
+  camera = mission.start(power_cut=kill)
+  assert camera.runMission() == "power cut"
+  camera.close()
+  assert camera.housekeeper.failures == 1
+  assert camera.housekeeper.lost == 0
+  assert [record.seq for record in mission.frames()] == range(15)
@@ -0,0 +1,62 @@
+import pytest
+
+RELOAD = {"mode": "master", "period": 10, "config_reload": True, "config_check_interval": 0.1}
+
+def reconfigure(mission, at, stop, mission_settings=None, camera_settings=None):
+  """ Hook that changes the configuration after frame at and stops the mission after frame stop """
+  def hook(camera):
+    frames = len(camera.index)
+    if frames == at:
+      mission.reconfigure(mission_settings, camera_settings)
+    return frames == stop
+  return hook
+
+def intervals(mission):
+  walls = [record.wall for record in mission.frames()]
+  return [round(b - a, 6) for a, b in zip(walls, walls[1:])]
+
+def test_reloaded_period_applies_after_the_frame_already_scheduled(mission):
+  mission.configure(RELOAD)
+  camera = mission.start(power_cut=reconfigure(mission, 3, 6, {"period": 20}))
+  assert camera.runMission() == "power cut"
+  assert camera.period == 20
+  assert intervals(mission) == [10, 10, 10, 20, 20]
+
+def test_restart_only_change_waits(mission):
+  mission.configure(RELOAD)
+  camera = mission.start(power_cut=reconfigure(mission, 2, 4, camera_settings={"width": 640}))
+  assert camera.runMission() == "power cut"
+  assert camera.camera_config.width != 640
+
+def test_turning_the_policy_off_goes_back_to_full_capture(mission):
+  mission.configure(RELOAD, {"adaptive_policy": True})
+  reload = reconfigure(mission, 2, 4, camera_settings={"adaptive_policy": False})
+  def stepDown(camera):
+    if len(camera.index) == 1:
+      # as adaptCapture does when the card runs short
+      camera.policy.current = len(camera.policy.levels) - 1
+      level = camera.policy.level()
+      camera.capture_options = camera.captureOptions(level)
+      camera.scheduler.setPeriod(camera.period * level.period_factor)
+    return reload(camera)
+  camera = mission.start(power_cut=stepDown)
+  factor = camera.policy.levels[-1].period_factor
+  assert camera.runMission() == "power cut"
+  assert not camera.adaptive_policy
+  assert camera.policy.current == 0
+  assert camera.capture_options == camera.captureOptions(camera.policy.levels[0])
+  assert intervals(mission) == [10, 10 * factor, 10]
+
+def test_iso_is_reloaded_without_the_predictor(mission):
+  mission.configure(RELOAD)
+  camera = mission.start(power_cut=reconfigure(mission, 2, 3, camera_settings={"iso": 500}))
+  assert camera.runMission() == "power cut"
+  assert mission.camera.iso == 500
+
+def test_iso_waits_for_a_restart_with_the_predictor(mission):
+  pytest.importorskip("numpy")
+  mission.configure(RELOAD, {"exposure_predictor": True})
+  camera = mission.start(power_cut=reconfigure(mission, 2, 3, camera_settings={"iso": 500}))
+  assert camera.runMission() == "power cut"
+  assert camera.camera_config.iso == 375
+  assert mission.camera.iso == camera.exposure.iso
@@ -0,0 +1,56 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from dedup import DuplicateFilter
+
+WIDTH, HEIGHT = 64, 48
+
+def yuv(luma):
+  """ YUV420 buffer of a HEIGHT x WIDTH luma array (neutral chroma) """
+  y = np.clip(np.round(luma), 0, 255).astype(np.uint8)
+  return y.tostring() + "\x80" * (WIDTH * HEIGHT // 2)
+
+def flat(rng, level=90.0, noise=2.0):
+  return level + rng.normal(0.0, noise, (HEIGHT, WIDTH))
+
+def textured(seed, noise=2.0, rng=None):
+  """ Blocky scene (cells of 8x8 pixels with levels from 30 to 220) plus sensor noise """
+  cells = np.random.RandomState(seed).uniform(30, 220, (HEIGHT // 8, WIDTH // 8))
+  scene = np.kron(cells, np.ones((8, 8)))
+  return scene + (rng or np.random.RandomState(seed + 1000)).normal(0.0, noise, scene.shape)
+
+def test_flat_noisy_scene_is_a_duplicate():
+  rng = np.random.RandomState(0)
+  dedup = DuplicateFilter(WIDTH, HEIGHT, threshold=0.15, keep_every=1000)
+  assert dedup.check(yuv(flat(rng)))[0]
+  for i in range(20):
+    keep, distance = dedup.check(yuv(flat(rng)))
+    assert not keep, distance
+    assert distance < 0.15
+  assert dedup.kept == 1
+  assert dedup.dropped == 20
+
+def test_changed_textured_scene_is_kept():
+  rng = np.random.RandomState(0)
+  dedup = DuplicateFilter(WIDTH, HEIGHT, threshold=0.15)
+  assert dedup.check(yuv(textured(1, rng=rng)))[0]
+  keep, distance = dedup.check(yuv(textured(1, rng=rng)))
+  assert not keep # the same scene, new noise
+  keep, distance = dedup.check(yuv(textured(2, rng=rng)))
+  assert keep
+  assert distance > 0.15
+
+def test_brightness_change_alone_is_a_duplicate():
+  rng = np.random.RandomState(0)
+  dedup = DuplicateFilter(WIDTH, HEIGHT, threshold=0.15)
+  scene = textured(1, rng=rng)
+  dedup.check(yuv(scene))
+  keep, distance = dedup.check(yuv(scene * 0.7))
+  assert not keep, distance
+
+def test_still_scene_is_kept_every_keep_every_frames():
+  rng = np.random.RandomState(0)
+  dedup = DuplicateFilter(WIDTH, HEIGHT, threshold=0.15, keep_every=5)
+  kept = [dedup.check(yuv(flat(rng)))[0] for i in range(11)]
+  assert kept == [True, False, False, False, False, True, False, False, False, False, True]
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+# A narrow shutter range makes the predictor move the ISO on most frames
+PREDICTOR = {"exposure_predictor": True, "exposure_shutter_min": 3000, "exposure_shutter_max": 4500, "camera_warmup": 1}
+
+def run(mission, period, frames):
+  mission.configure({"mode": "master", "period": period}, PREDICTOR)
+  camera = mission.start(power_cut=lambda camera: len(camera.index) == frames)
+  assert camera.runMission() == "power cut"
+  return camera
+
+def test_iso_change_waits_when_the_next_frame_is_closer_than_the_warmup(mission):
+  camera = run(mission, 0.5, 20)
+  assert camera.scheduler.skipped == 0
+  assert camera.scheduler.late_frames == 0
+  assert mission.camera.iso == camera.exposure.iso == 375
+  assert camera.camera_config.exposure_shutter_min <= mission.camera.shutter_speed <= camera.camera_config.exposure_shutter_max
+
+def test_iso_changes_when_the_period_leaves_time_for_the_warmup(mission):
+  camera = run(mission, 5, 20)
+  assert camera.scheduler.skipped == 0
+  assert mission.camera.iso != 375
+  assert mission.camera.frozen_iso == camera.exposure.iso
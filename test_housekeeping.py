@@ -0,0 +1,110 @@
+import fcntl
+import os
+import signal
+import time
+
+import pytest
+
+from frame_index import HEADER, RECORD, FrameIndex, FrameRecord, shardPath
+from housekeeping import Housekeeper, openIndex
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture
+def path(tmpdir):
+  """ Mission directory """
+  return str(tmpdir.mkdir("test"))
+
+def frame(seq):
+  wall = time.time()
+  return FrameRecord(seq, time.time(), wall, 20.0, 0, shardPath(seq, wall)), "frame %d" % seq
+
+def housekeeper(path, **options):
+  h = Housekeeper(path, os.path.join(HERE, "camera_config.yaml"), restart_delay=0.1, **options)
+  assert h.start()
+  return h
+
+def indexed(path):
+  index = FrameIndex(path + "/frames.idx", readonly=True)
+  try:
+    return [index.read(i) for i in range(len(index))]
+  finally:
+    index.close()
+
+def test_unconfirmed_frames_are_sent_again_after_a_kill(path):
+  h = housekeeper(path, queue_size=2)
+  h.proc.send_signal(signal.SIGSTOP) # takes frames without confirming any
+  for seq in range(10):
+    h.put(*frame(seq))
+  h.proc.kill()
+  h.close()
+  assert h.starts >= 2
+  assert (h.saved, h.lost) == (10, 0)
+  records = indexed(path)
+  assert [record.seq for record in records] == range(10)
+  for record in records:
+    assert open(os.path.join(path, record.path)).read() == "frame %d" % record.seq
+
+def test_frames_indexed_by_a_previous_process_are_not_written_again(path):
+  index = FrameIndex(path + "/frames.idx")
+  for seq in range(5):
+    index.append(frame(seq)[0]._replace(size=7))
+  index.close()
+  h = housekeeper(path)
+  assert h.next_seq == 5
+  for seq in range(3, 8):
+    h.put(*frame(seq))
+  h.close()
+  assert h.saved == 5
+  records = indexed(path)
+  assert [record.seq for record in records] == range(8)
+  assert not os.path.exists(os.path.join(path, records[3].path))
+  assert os.path.exists(os.path.join(path, records[5].path))
+
+def test_oldest_frames_are_dropped_past_the_backlog(path):
+  h = housekeeper(path, queue_size=0, backlog=4)
+  h.proc.send_signal(signal.SIGSTOP)
+  for seq in range(10):
+    h.put(*frame(seq))
+  h.proc.send_signal(signal.SIGCONT)
+  h.close()
+  seqs = [record.seq for record in indexed(path)]
+  assert h.lost == 10 - len(seqs) >= 10 - 4 - 1 # the one frame sent to the stopped process is not dropped
+  assert seqs == sorted(seqs)
+  assert seqs[-4:] == range(6, 10)
+
+def test_killed_mid_stream_index_has_every_frame_once(path):
+  h = housekeeper(path, queue_size=4, backlog=1000)
+  for seq in range(150):
+    h.put(*frame(seq))
+    if seq in (40, 90):
+      h.proc.kill()
+    time.sleep(0.002)
+  h.close()
+  assert h.failures >= 2
+  assert h.lost == 0
+  assert [record.seq for record in indexed(path)] == range(150)
+
+def test_capture_process_leaves_the_index_of_a_running_housekeeping_process(path):
+  index = FrameIndex(path + "/frames.idx")
+  for seq in range(3):
+    index.append(frame(seq)[0])
+  index.file.write("torn") # a record half appended
+  index.close()
+  size = os.path.getsize(path + "/frames.idx")
+  lock = open(path + "/housekeeping.lock", "w")
+  fcntl.flock(lock, fcntl.LOCK_EX)
+  index = openIndex(path, 0.2)
+  assert os.path.getsize(path + "/frames.idx") == size
+  assert index.next_seq == 3
+  index.close()
+  lock.close()
+  index = openIndex(path, 0.2) # nobody appending: the torn record is dropped
+  assert os.path.getsize(path + "/frames.idx") == HEADER.size + 3 * RECORD.size
+  assert index.next_seq == 3
+  index.close()
+
+def test_capture_process_creates_the_index(path):
+  index = openIndex(path, 0.2)
+  assert (len(index), index.next_seq) == (0, 0)
+  index.close()
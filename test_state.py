@@ -0,0 +1,44 @@
+import json
+import os
+
+from state import MissionState
+
+SLAVE = {"mode": "slave", "slave_trigger": "edge", "photos_per_cycle": 5, "period": 1, "burst_mode": False}
+RESUME = {"resume_mission": True, "state_save_frames": 1}
+
+def test_power_cut_in_a_cycle_is_resumed_without_retaking_a_frame(mission):
+  mission.configure(SLAVE, RESUME)
+  mission.pulseAt(10)
+  camera = mission.start(power_cut=lambda camera: camera.in_cycle and len(camera.index) == 3)
+  assert camera.runMission() == "power cut"
+  state = MissionState(os.path.join(mission.path, "test", "state.json")).load()
+  assert state["in_cycle"]
+  assert state["cycle_frames"] == 3
+  mission.clock.sleep(60) # reboot
+  camera = mission.start()
+  assert camera.runMission() == "end date"
+  camera.close()
+  assert [record.seq for record in mission.frames()] == range(5)
+
+def test_master_mission_resumes_its_sequence_on_the_same_grid(mission):
+  mission.configure({"mode": "master", "period": 10}, RESUME)
+  camera = mission.start(power_cut=lambda camera: len(camera.index) == 4)
+  assert camera.runMission() == "power cut"
+  cut = mission.clock.time()
+  mission.clock.sleep(35) # reboot
+  camera = mission.start(power_cut=lambda camera: len(camera.index) == 8)
+  assert camera.runMission() == "power cut"
+  frames = mission.frames()
+  assert [record.seq for record in frames] == range(8)
+  assert frames[4].wall > cut + 35
+  for record in frames:
+    offset = (record.wall - frames[0].wall) % 10
+    assert min(offset, 10 - offset) < 1e-6
+
+def test_checkpoint_is_replaced_atomically(tmpdir):
+  state = MissionState(str(tmpdir.join("state.json")))
+  assert state.load() is None
+  assert state.save({"next_seq": 3})
+  assert state.save({"next_seq": 4})
+  assert state.load()["next_seq"] == 4
+  assert not tmpdir.join("state.json.tmp").exists()
@@ -0,0 +1,88 @@
+import Queue
+from collections import deque
+
+from clock import SystemClock
+
+class EdgeTrigger(object):
+  """ Rising edge trigger for the slave mode built on GPIO edge callbacks
+
+  RPi.GPIO calls _onEdge from its own thread as soon as the edge is seen, so
+  every trigger is timestamped when it arrives (monotonic clock) and queued,
+  no matter what the capture loop is doing at that moment. Edges that find
+  the queue full are counted as dropped. The capture loop reports the first
+  exposure of each cycle with exposed(), which keeps the trigger-to-exposure
+  latency of every cycle.
+  """
+
+  def __init__(self, gpio, pin, bouncetime=50, queue_size=64, clock=None, history=1000):
+    self.gpio = gpio
+    self.pin = pin
+    self.clock = clock if clock is not None else SystemClock()
+    self.queue = Queue.Queue(maxsize=queue_size)
+    self.latencies = deque(maxlen=history)
+    self.edges = 0
+    self.dropped = 0
+    self.discarded = 0
+    self.cycles = 0
+    self.latency_max = 0.0
+    self.gpio.add_event_detect(pin, gpio.RISING, callback=self._onEdge, bouncetime=bouncetime)
+
+  def _onEdge(self, channel):
+    timestamp = self.clock.monotonic()
+    self.edges += 1
+    try:
+      self.queue.put_nowait(timestamp)
+    except Queue.Full:
+      self.dropped += 1
+
+  def pending(self):
+    """ True if there is a trigger waiting to be served """
+    return not self.queue.empty()
+
+  def wait(self, timeout=None):
+    """ Returns the timestamp of the next trigger, or None if none arrives within timeout seconds """
+    try:
+      if timeout is not None and timeout <= 0:
+        return self.queue.get_nowait()
+      return self.queue.get(timeout=timeout)
+    except Queue.Empty:
+      return None
+
+  def discard(self):
+    """ Drops the triggers that arrived while a cycle was running (cycles do not overlap) """
+    while True:
+      try:
+        self.queue.get_nowait()
+      except Queue.Empty:
+        return
+      self.discarded += 1
+
+  def exposed(self, trigger_time):
+    """ Records that the first exposure for the trigger at trigger_time is starting """
+    latency = self.clock.monotonic() - trigger_time
+    self.latencies.append(latency)
+    self.cycles += 1
+    if latency > self.latency_max:
+      self.latency_max = latency
+    return latency
+
+  def close(self):
+    self.gpio.remove_event_detect(self.pin)
+
+  def percentile(self, p, values=None):
+    """ p-th percentile (0-100) of the latencies kept in the history (or of the sorted values) """
+    if values is None:
+      values = sorted(self.latencies)
+    if not values:
+      return None
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+  def report(self):
+    """ One line summary of the trigger, meant for mission_info.log """
+    line = "Trigger: %d edges, %d cycles, %d dropped, %d discarded during cycles" % (
+           self.edges, self.cycles, self.dropped, self.discarded)
+    if self.latencies:
+      values = sorted(self.latencies)
+      line += ", latency p50 %.4fs p95 %.4fs max %.4fs" % (self.percentile(50, values), self.percentile(95, values),
+                                                            self.latency_max)
+    return line
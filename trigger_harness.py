@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# Fires rising edges at EdgeTrigger through the simulated GPIO at increasing
+# rates and prints how many were detected, served and dropped, together with
+# the edge-to-callback and trigger-to-exposure latencies.
+#
+#   python trigger_harness.py --edges 2000 --rates 10 100 1000 5000 --service 0.001
+import argparse
+import threading
+
+from clock import SystemClock
+from sim.gpio import SimulatedGPIO
+from trigger import EdgeTrigger
+
+PIN = 23
+
+def percentile(values, p):
+  if not values:
+    return 0.0
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def run(rate, edges, service_time, bouncetime, queue_size):
+  clock = SystemClock()
+  gpio = SimulatedGPIO(clock)
+  gpio.setup(PIN, gpio.IN, pull_up_down=gpio.PUD_DOWN)
+  trigger = EdgeTrigger(gpio, PIN, bouncetime=bouncetime, queue_size=queue_size, clock=clock, history=edges)
+  fired = []
+  delivered = []
+  gpio.add_event_callback(PIN, lambda channel: delivered.append(clock.monotonic()))
+  done = threading.Event()
+
+  def consume():
+    while True:
+      trigger_time = trigger.wait(0.1)
+      if trigger_time is None:
+        if done.is_set() and not trigger.pending():
+          return
+        continue
+      trigger.exposed(trigger_time)
+      clock.sleep(service_time) # the capture cycle
+
+  consumer = threading.Thread(target=consume)
+  consumer.start()
+  start = clock.monotonic()
+  for i in range(edges):
+    # Absolute deadlines so the edge rate does not depend on the loop overhead
+    delay = start + i / float(rate) - clock.monotonic()
+    clock.sleep(delay)
+    if gpio.setInput(PIN, 1):
+      fired.append(clock.monotonic())
+    gpio.setInput(PIN, 0)
+  elapsed = clock.monotonic() - start
+  gpio.settle()
+  done.set()
+  consumer.join()
+  trigger.close()
+  callback_latency = [d - f for f, d in zip(fired, delivered)]
+  print "%7.0f Hz requested, %7.0f Hz achieved: %d edges, %d detected, %d served, %d dropped" % (
+        rate, edges / elapsed, edges, trigger.edges, trigger.cycles, trigger.dropped)
+  print "          edge->callback p50 %.6fs p95 %.6fs max %.6fs" % (
+        percentile(callback_latency, 50), percentile(callback_latency, 95), max(callback_latency or [0.0]))
+  print "          trigger->exposure p50 %.6fs p95 %.6fs max %.6fs" % (
+        percentile(list(trigger.latencies), 50), percentile(list(trigger.latencies), 95), trigger.latency_max)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Edge trigger stress test on simulated GPIO")
+  parser.add_argument("--edges", type=int, default=1000, help="edges fired per rate")
+  parser.add_argument("--rates", type=float, nargs="+", default=[10, 100, 1000, 5000], help="edge rates in Hz")
+  parser.add_argument("--service", type=float, default=0.0, help="seconds spent serving each trigger")
+  parser.add_argument("--bouncetime", type=int, default=0, help="debounce time in ms")
+  parser.add_argument("--queue", type=int, default=64, help="trigger queue size")
+  args = parser.parse_args()
+  for rate in args.rates:
+    run(rate, args.edges, args.service, args.bouncetime, args.queue)
@@ -0,0 +1,152 @@
+import os
+import Queue
+import threading
+
+from clock import SystemClock
+
+class FrameWriter(object):
+  """ Writes encoded frames to disk from a background thread
+
+  The capture loop hands over (filename, data) pairs through a bounded queue
+  and goes back to its schedule; a stalled SD card then only fills the queue
+  instead of delaying the next exposure. When the queue is full put() blocks,
+  so a card that is slower than the capture rate throttles the camera rather
+  than exhausting the RAM. Files are fsync'ed in batches of fsync_frames
+  (or every fsync_interval seconds), together with their directories.
+  With a sink (see segments.SegmentArchive) frames are appended to it
+  instead of being written to their own files. Frames that could not be
+  written are handed to on_failed(filename, record).
+  """
+
+  def __init__(self, queue_size=8, fsync_frames=10, fsync_interval=30, on_written=None, clock=None, sink=None,
+               on_failed=None):
+    self.queue = Queue.Queue(maxsize=queue_size)
+    self.fsync_frames = fsync_frames
+    self.fsync_interval = fsync_interval
+    self.on_written = on_written
+    self.on_failed = on_failed
+    self.sink = sink
+    self.clock = clock if clock is not None else SystemClock()
+    self.pending = []
+    self.last_fsync = self.clock.monotonic()
+    self.written = 0
+    self.bytes_written = 0
+    self.errors = 0
+    self.max_depth = 0
+    self.blocked_time = 0.0
+    self.thread = threading.Thread(target=self._run, name="FrameWriter")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def put(self, filename, data, record=None):
+    """ Queues a frame for writing. Blocks while the queue is full and returns the time spent blocked.
+    record is handed back to on_written(filename, size, record) once the frame is on disk """
+    start = self.clock.monotonic()
+    self.queue.put((filename, data, record))
+    blocked = self.clock.monotonic() - start
+    self.blocked_time += blocked
+    depth = self.queue.qsize()
+    if depth > self.max_depth:
+      self.max_depth = depth
+    return blocked
+
+  def depth(self):
+    """ Number of frames waiting to be written """
+    return self.queue.qsize()
+
+  def close(self):
+    """ Writes and syncs every queued frame, then stops the thread """
+    if self.thread.is_alive():
+      self.queue.put(None)
+      self.thread.join()
+
+  def _run(self):
+    while True:
+      try:
+        item = self.queue.get(timeout=self.fsync_interval)
+      except Queue.Empty:
+        self._sync()
+        continue
+      if item is None:
+        self._sync()
+        return
+      self._write(*item)
+      if (len(self.pending) >= self.fsync_frames or
+          self.clock.monotonic() - self.last_fsync >= self.fsync_interval):
+        self._sync()
+
+  def _write(self, filename, data, record):
+    if self.sink is not None:
+      self._append(filename, data, record)
+      return
+    f = None
+    try:
+      directory = os.path.dirname(filename)
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+      f = open(filename, 'wb')
+      f.write(data)
+      f.flush()
+    except (IOError, OSError), err:
+      if f is not None:
+        f.close()
+      self.errors += 1
+      print "Error writing %s: %s" % (filename, err)
+      if self.on_failed is not None:
+        self.on_failed(filename, record)
+      return
+    self.pending.append(f)
+    self.written += 1
+    self.bytes_written += len(data)
+    if self.on_written is not None:
+      self.on_written(filename, len(data), record)
+
+  def _append(self, filename, data, record):
+    try:
+      record = self.sink.append(record, data)
+    except (IOError, OSError), err:
+      self.errors += 1
+      print "Error appending %s: %s" % (filename, err)
+      if self.on_failed is not None:
+        self.on_failed(filename, record)
+      return
+    self.written += 1
+    self.bytes_written += len(data)
+    if self.on_written is not None:
+      self.on_written(filename, len(data), record)
+
+  def _sync(self):
+    if self.sink is not None:
+      try:
+        self.sink.sync()
+      except (IOError, OSError), err:
+        self.errors += 1
+        print "Error syncing the segments: %s" % err
+    directories = set()
+    for f in self.pending:
+      try:
+        try:
+          os.fsync(f.fileno())
+        finally:
+          f.close() # even when the sync failed, or every failure leaks a descriptor
+      except (IOError, OSError), err:
+        self.errors += 1
+        print "Error syncing %s: %s" % (f.name, err)
+      directories.add(os.path.dirname(f.name))
+    for directory in directories:
+      try:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+          os.fsync(fd)
+        finally:
+          os.close(fd)
+      except OSError:
+        pass
+    self.pending = []
+    self.last_fsync = self.clock.monotonic()
+
+  def report(self):
+    """ One line summary of the writer, meant for mission_info.log """
+    return ("Writer: %d frames (%.1f MB) written, queue %d/%d (max %d), %.3fs blocked, %d errors" %
+            (self.written, self.bytes_written / 1e6, self.depth(), self.queue.maxsize,
+             self.max_depth, self.blocked_time, self.errors))